@@ -0,0 +1,263 @@
+"""
+animations.py
+LED animations drawn over the buttons at a fixed frame rate.
+
+The launchpad has four brightness levels for each of its red and green LEDs.  Fades and pulses
+step through those levels, progress bars light a row of cells, and countdowns change color as
+their time runs out.  Only the cells that are animating are computed each frame.  They are drawn
+into the draw buffer after the page, so the LED writer sends just the cells whose color changed.
+When an animation ends its cells show the buttons again.
+
+Animations are started from the logic thread (button handlers get the animator) or from any other thread.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from threading import Lock
+from frame_buffer import CELL_INDEX
+from latency import monotonic
+from palette import color
+
+FRAME_RATE = 20     # Animation frames per second
+
+
+def _level(value):
+    return max(0, min(3, int(round(value))))
+
+
+def _blend(start, end, fraction):
+    """
+    Returns the (red, green) levels fraction of the way from start to end
+    """
+    return (_level(start[0] + (end[0] - start[0]) * fraction),
+            _level(start[1] + (end[1] - start[1]) * fraction))
+
+
+class Animation(object):
+    """
+    Animation: Base class for the animations.
+
+    Initialization parameters:
+    cells - Frame buffer cells the animation draws
+    duration - Seconds the animation runs.  None runs until stopped.
+    page - Page the animation is shown on (button_types.Page).  None for every page.
+    """
+
+    def __init__(self, cells, duration=None, page=None):
+        self.cells = tuple(cells)
+        self.duration = duration
+        self.page = page
+        self.started = None
+
+    def finished(self, now):
+        return self.duration is not None and now - self.started >= self.duration
+
+    def progress(self, now):
+        """
+        Returns the fraction of the duration that has run (0-1)
+        """
+        if not self.duration:
+            return 1.0
+        return max(0.0, min(1.0, (now - self.started) / float(self.duration)))
+
+    def draw(self, now):
+        """
+        Returns the (cell, velocity) pairs to show at time now
+        """
+        raise NotImplementedError
+
+
+def button_cells(button):
+    """
+    Returns the cell and page of a button, for animating it
+    """
+    page_frame = button._renderer
+    return (button._draw_position,), page_frame.page if page_frame is not None else None
+
+
+class Fade(Animation):
+    """
+    Fade: Steps a cell from one color to another through the brightness levels.
+
+    Initialization parameters:
+    button - Button whose cell fades
+    start - (red, green) levels to start from
+    end - (red, green) levels to end at
+    duration - Seconds the fade takes
+    """
+
+    def __init__(self, button, start, end, duration):
+        cells, page = button_cells(button)
+        super(Fade, self).__init__(cells, duration, page)
+        self.start = start
+        self.end = end
+
+    def draw(self, now):
+        velocity = color(*_blend(self.start, self.end, self.progress(now)))
+        return [(cell, velocity) for cell in self.cells]
+
+
+class Pulse(Animation):
+    """
+    Pulse: Brightens and dims a cell over and over.
+
+    Initialization parameters:
+    button - Button whose cell pulses
+    red, green - Levels at the brightest point (0-3)
+    period - Seconds for one pulse.  Default 1
+    duration - Seconds to pulse.  Default None, until stopped
+    """
+
+    def __init__(self, button, red=3, green=0, period=1.0, duration=None):
+        cells, page = button_cells(button)
+        super(Pulse, self).__init__(cells, duration, page)
+        self.brightest = (red, green)
+        self.period = period
+
+    def draw(self, now):
+        phase = ((now - self.started) / self.period) % 1.0
+        strength = 1.0 - abs(2.0 * phase - 1.0)     # 0 -> 1 -> 0
+        velocity = color(*_blend((0, 0), self.brightest, strength))
+        return [(cell, velocity) for cell in self.cells]
+
+
+class ProgressBar(Animation):
+    """
+    ProgressBar: Lights a row of cells from left to right.
+
+    Either fills over duration seconds, or shows the value set with set_value (0-1).
+    The edge cell is dimmer for a part filled cell.
+
+    Initialization parameters:
+    y - Launchpad row (0-8)
+    red, green - Levels of the lit cells (0-3).  Default 0, 3
+    duration - Seconds to fill the bar.  Default None, filled by set_value
+    page - Page the bar is shown on.  Default None, every page
+    columns - The columns of the row to use.  Default 0-7
+    """
+
+    def __init__(self, y, red=0, green=3, duration=None, page=None, columns=range(8)):
+        super(ProgressBar, self).__init__([CELL_INDEX[x][y] for x in columns], duration, page)
+        self.lit = (red, green)
+        self.value = 0.0
+
+    def set_value(self, value):
+        self.value = max(0.0, min(1.0, value))
+
+    def draw(self, now):
+        filled = (self.progress(now) if self.duration else self.value) * len(self.cells)
+        pairs = []
+        for number, cell in enumerate(self.cells):
+            pairs.append((cell, color(*_blend((0, 0), self.lit, max(0.0, min(1.0, filled - number))))))
+        return pairs
+
+
+class Countdown(Animation):
+    """
+    Countdown: Shows the time left on a button.  Green, then yellow, then red, flashing red for the last
+    fifth.  The flashing is done by the launchpad so it sends no extra MIDI.
+
+    Initialization parameters:
+    button - Button showing the countdown
+    duration - Seconds to count down
+    """
+
+    def __init__(self, button, duration):
+        cells, page = button_cells(button)
+        super(Countdown, self).__init__(cells, duration, page)
+
+    def draw(self, now):
+        left = 1.0 - self.progress(now)
+        if left > .5:
+            velocity = color(0, 3)
+        elif left > .2:
+            velocity = color(3, 3)
+        else:
+            velocity = color(3, 0, flashing=True)
+        return [(cell, velocity) for cell in self.cells]
+
+
+class Animator(object):
+    """
+    Animator: Runs the animations of one launchpad and draws them over its page.
+
+    Initialization parameters:
+    frame_rate - Animation frames per second.  Default 20
+    """
+
+    def __init__(self, frame_rate=FRAME_RATE):
+        self.frame_interval = 1.0 / frame_rate
+        self._animations = []
+        self._restore = {}      # cell: page of cells to show the buttons in again
+        self._next_frame = 0.0
+        self._lock = Lock()
+
+    def start(self, animation):
+        """
+        Start an animation.  It replaces any animation of the same cells on the same page.
+        """
+        animation.started = monotonic()
+        cells = set(animation.cells)
+        with self._lock:
+            for old in [old for old in self._animations
+                        if old.page is animation.page and cells.intersection(old.cells)]:
+                self._remove(old)
+            self._animations.append(animation)
+            self._next_frame = 0.0
+        return animation
+
+    def stop(self, animation):
+        with self._lock:
+            if animation in self._animations:
+                self._remove(animation)
+                self._next_frame = 0.0
+
+    def _remove(self, animation):
+        self._animations.remove(animation)
+        for cell in animation.cells:
+            self._restore[cell] = animation.page
+
+    def running(self, animation):
+        with self._lock:
+            return animation in self._animations
+
+    def render(self, draw_buffer, base, page, now, repaint=False):
+        """
+        Draw the animations shown on page into draw_buffer.  base is the page's own frame, used for the
+        cells of animations that ended.  repaint means draw_buffer was just copied from base.
+        Returns True if draw_buffer changed.
+        """
+        with self._lock:
+            if not repaint and now < self._next_frame:
+                return False
+            self._next_frame = now + self.frame_interval
+            for animation in [animation for animation in self._animations if animation.finished(now)]:
+                self._remove(animation)
+            restore, self._restore = self._restore, {}
+            animations = [animation for animation in self._animations
+                          if animation.page is None or animation.page is page]
+
+        changed = False
+        for cell, animation_page in restore.items():
+            if (animation_page is None or animation_page is page) and draw_buffer[cell] != base[cell]:
+                draw_buffer[cell] = base[cell]
+                changed = True
+        for animation in animations:
+            for cell, velocity in animation.draw(now):
+                if draw_buffer[cell] != velocity:
+                    draw_buffer[cell] = velocity
+                    changed = True
+        return changed
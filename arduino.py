@@ -18,34 +18,412 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import serial
+import atexit
+from contextlib import contextmanager
+from threading import RLock, Thread, Event
 from time import sleep
+from key_scheduler import KeyScheduler
+from latency import monotonic
+
+BAUD_RATE = 115200
+
+# Serial frame (host -> board):  SYNC | SEQ | COUNT | COUNT x (OP, KEY) | CHECKSUM  (XOR of SEQ, COUNT and the op bytes)
+# SEQ 0 restarts the board's count, after that it runs 1-255 and wraps to 1.  COUNT 0 just asks for a status.
+# Status frame (board -> host):  STATUS_SYNC | SEQ | 32 byte bitmap of the keys held | CHECKSUM (XOR of SEQ and bitmap)
+# The board answers every frame with a status holding the last SEQ it accepted, and sends one when
+# its held keys change.  A frame that does not follow the last accepted one is ignored until it is sent again.
+FRAME_SYNC = 0xA5
+STATUS_SYNC = 0x5A
+STATUS_BITMAP_BYTES = 32
+MAX_FRAME_OPS = 32
+
+READ_TIMEOUT = .01      # Seconds a read of the serial port waits for data
+ACK_TIMEOUT = .05       # Seconds before frames that were not acknowledged are sent again
+MAX_RETRIES = 5
+SYNC_TRIES = 3          # Status requests at startup before the board is taken to be an old one that never answers
+RECONCILE_SETTLE = .05  # Seconds after the last write before the board's status is used to fix keys
+TIMED_MARGIN = .1       # Seconds after a timed press should end that the key is still left to the board
+
+OP_PRESS = 0x01
+OP_RELEASE = 0x02
+OP_RELEASE_ALL = 0x03
+OP_DELAY = 0x04         # KEY is a pause of 1-255 ms before the board runs the next op
+
+# Timed commands.  Their arguments are sent first as OP_ARG ops, times as 16 bit ms, high byte first.
+OP_ARG = 0x05
+OP_PRESS_FOR = 0x06     # Args: hold.  Press now, the board releases after hold ms
+OP_TAP = 0x07           # Args: count, interval, hold.  Tap count times, a press every interval ms
+OP_RELEASE_AFTER = 0x08  # Args: delay.  Release after delay ms
+
+MAX_DELAY_MS = 255
+MAX_TIMED_MS = 0xFFFF
+TAP_HOLD = .05          # Seconds each tap is held
+
+
+def next_sequence(sequence):
+    return 1 if sequence >= 0xFF else sequence + 1
+
+
+def encode_frame(sequence, ops):
+    """
+    Pack a list of up to MAX_FRAME_OPS (op, key) pairs into a serial frame
+    """
+    frame = bytearray([FRAME_SYNC, sequence, len(ops)])
+    checksum = sequence ^ len(ops)
+    for op, key in ops:
+        frame.append(op)
+        frame.append(key)
+        checksum ^= op ^ key
+    frame.append(checksum)
+    return bytes(frame)
+
+
+def decode_frames(data):
+    """
+    Returns (sequence, [(op, key), ...]) for each frame in data written to the board.  Stops at anything else.
+    """
+    data = bytearray(data)
+    frames = []
+    position = 0
+    while position + 3 < len(data) and data[position] == FRAME_SYNC:
+        sequence, count = data[position + 1], data[position + 2]
+        ops = data[position + 3:position + 3 + 2 * count]
+        frames.append((sequence, list(zip(ops[0::2], ops[1::2]))))
+        position += 4 + 2 * count
+    return frames
+
+
+def decode_bitmap(bitmap):
+    """
+    Returns the key codes set in a status bitmap
+    """
+    return frozenset(index * 8 + bit for index, value in enumerate(bytearray(bitmap))
+                     for bit in range(8) if value & (1 << bit))
+
+
+class StatusParser(object):
+    """
+    StatusParser: Picks the status frames out of the bytes read from the board
+    """
+
+    FRAME_SIZE = 3 + STATUS_BITMAP_BYTES
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Add bytes read from the board.  Returns (sequence, keys held) for each complete status frame.
+        """
+        self._buffer += bytearray(data)
+        statuses = []
+        while True:
+            start = self._buffer.find(bytearray([STATUS_SYNC]))
+            if start < 0:
+                del self._buffer[:]
+                break
+            del self._buffer[:start]
+            if len(self._buffer) < self.FRAME_SIZE:
+                break
+            frame = self._buffer[:self.FRAME_SIZE]
+            checksum = 0
+            for value in frame[1:-1]:
+                checksum ^= value
+            if checksum != frame[-1]:
+                del self._buffer[:1]  # Not a status frame.  Hunt for the next sync byte.
+                continue
+            del self._buffer[:self.FRAME_SIZE]
+            statuses.append((frame[1], decode_bitmap(frame[2:-1])))
+        return statuses
+
+
+def time_args(*seconds):
+    """
+    Returns the OP_ARG ops carrying times in ms
+    """
+    ops = []
+    for value in seconds:
+        ms = max(0, min(MAX_TIMED_MS, int(round(value * 1000))))
+        ops.append((OP_ARG, ms >> 8))
+        ops.append((OP_ARG, ms & 0xFF))
+    return ops
 
 
 class Arduino(object):
     """
     Wrapper for the communication to the arduino board
+
+    Timed presses are run by the board (board_timing=True).  Pass board_timing=False for
+    firmware without the timed commands; the releases are then sent by the scheduler.
+
+    Frames are numbered and the board acknowledges them with the keys it is holding.  Frames that
+    are not acknowledged are sent again, and reconcile() fixes the keys when the board and the
+    host disagree.  A board that never answers gets the old release-all instead.
     """
 
-    def __init__(self, comm_port, baud_rate=9600):
-        self.port = serial.Serial(comm_port, baud_rate)
+    def __init__(self, comm_port, baud_rate=BAUD_RATE, scheduler=None, port=None, board_timing=True):
+        self._own_port = None
+        if not port:
+            import serial   # Only needed for a real board, so the simulator and tests run without pyserial
+            port = self._own_port = serial.Serial(comm_port, baud_rate, timeout=READ_TIMEOUT)
+        self.port = port
+        self.board_timing = board_timing
+        self._write_lock = RLock()
+        self._ops = []
+        self._batch_depth = 0
+        self._keys_down = set()
+        self._pending_releases = {}
+        self._sequence = None       # Last sequence number sent
+        self._unacked = []          # [sequence, data, time sent, tries] of frames not acknowledged yet
+        self._board_keys = None     # Keys the board says it holds.  None until it answers.
+        self._last_write = 0.0
+        self._timed_until = {}      # key: time the board is done with a timed press of the key
+        self._busy_until = 0.0      # Time the board is done playing macros
+        self._status_parser = StatusParser()
+        self._stop = Event()
+        self._reader = None
+        self.scheduler = scheduler if scheduler else KeyScheduler()
+        # Don't leave keys held down on the board if the program exits mid press
+        atexit.register(self.scheduler.run_all)
+        atexit.register(self.close)
+
+        if hasattr(self.port, "read"):
+            self._reader = Thread(target=self._read_status, name="arduino reader")
+            self._reader.daemon = True
+            self._reader.start()
+            self.sync()
+
+    def close(self):
+        """
+        Stop the thread reading the board's status and close the serial port if it was opened here.
+        Can be called more than once.
+        """
+        self._stop.set()
+        if self._reader is not None:
+            self._reader.join()
+            self._reader = None
+        if self._own_port is not None:
+            self._own_port.close()
+            self._own_port = None
+
+    @property
+    def acknowledged(self):
+        """
+        True while the board is answering
+        """
+        return self._board_keys is not None
+
+    @property
+    def board_keys(self):
+        return self._board_keys
+
+    def sync(self):
+        """
+        Restart the sequence numbers and ask the board for its status
+        """
+        with self._write_lock:
+            self._unacked = []
+            self._sequence = None
+            self._send([])
+
+    def _send(self, ops):
+        self._sequence = 0 if self._sequence is None else next_sequence(self._sequence)
+        data = encode_frame(self._sequence, ops)
+        self._last_write = monotonic()
+        if self.acknowledged or self._sequence == 0:
+            self._unacked.append([self._sequence, data, self._last_write, 0])
+        self.port.write(data)
+
+    def _read_status(self):
+        while not self._stop.is_set():
+            try:
+                data = self.port.read(max(1, self.port.in_waiting))
+            except Exception as ex:
+                print(ex)
+                return
+            if data:
+                for sequence, keys in self._status_parser.feed(data):
+                    self._on_status(sequence, keys)
+            else:
+                sleep(READ_TIMEOUT)
+            self._check_acks()
+
+    def _on_status(self, sequence, keys):
+        with self._write_lock:
+            # A board that answers again after going quiet needs its sequence restarted
+            resync = not self.acknowledged and not any(frame[0] == 0 for frame in self._unacked)
+            self._board_keys = keys
+            for index, frame in enumerate(self._unacked):
+                if frame[0] == sequence:
+                    del self._unacked[:index + 1]  # Everything up to sequence arrived
+                    break
+            if resync:
+                self.sync()
+
+    def _check_acks(self):
+        """
+        Send the frames that were not acknowledged again, in order
+        """
+        with self._write_lock:
+            if not self._unacked:
+                return
+            now = monotonic()
+            if now - self._unacked[0][2] < ACK_TIMEOUT:
+                return
+            if self._unacked[0][3] >= (MAX_RETRIES if self.acknowledged else SYNC_TRIES):
+                if self.acknowledged:
+                    print("The arduino stopped answering.  Held keys unknown.")
+                self._unacked = []
+                self._board_keys = None
+                return
+            for frame in self._unacked:
+                frame[2] = now
+                frame[3] += 1
+                self.port.write(frame[1])
+            self._last_write = now
+
+    @contextmanager
+    def batch(self):
+        """
+        Collect the key operations made inside the block and send them as one write
+        """
+        with self._write_lock:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self.flush()
+
+    def flush(self):
+        """
+        Send any queued key operations
+        """
+        with self._write_lock:
+            if self._ops:
+                ops, self._ops = self._ops, []
+                for start in range(0, len(ops), MAX_FRAME_OPS):
+                    self._send(ops[start:start + MAX_FRAME_OPS])
+
+    def _queue(self, op, key):
+        with self._write_lock:
+            self._ops.append((op, key))
+            if not self._batch_depth:
+                self.flush()
+
+    @property
+    def keys_down(self):
+        return frozenset(self._keys_down)
 
     def key_down(self, key):
         """
         Tell the board to send the USB key down
         """
-        self.port.write([key, 0x00])
+        with self._write_lock:
+            self._keys_down.add(key)
+            self._queue(OP_PRESS, key)
 
     def key_release(self, key):
         """
-        Tell the board to release a key
+        Tell the board to release a key.  Key 0x00 releases all keys and is skipped
+        when no keys are down.
+        """
+        with self._write_lock:
+            if key == 0x00:
+                if not self._keys_down:
+                    return
+                self._keys_down.clear()
+                self._timed_until.clear()
+                self._queue(OP_RELEASE_ALL, 0x00)
+            else:
+                self._keys_down.discard(key)
+                self._timed_until.pop(key, None)
+                self._queue(OP_RELEASE, key)
+
+    def reconcile(self):
+        """
+        Called while idle.  Release the keys the board holds that it shouldn't and press the ones it dropped.
+        Without a board that answers, every key is released as before.
+        """
+        with self._write_lock:
+            if not self.acknowledged:
+                self.key_release(0x00)
+                return
+            now = monotonic()
+            if self._unacked or now - self._last_write < RECONCILE_SETTLE or now < self._busy_until:
+                return  # The board's status may not show the last writes yet
+            for key, until in list(self._timed_until.items()):
+                if until <= now:
+                    del self._timed_until[key]
+            board_keys = self._board_keys
+            with self.batch():
+                for key in sorted(board_keys - self._keys_down - set(self._timed_until)):
+                    self._queue(OP_RELEASE, key)
+                for key in sorted(self._keys_down - board_keys):
+                    self._queue(OP_PRESS, key)
+
+    def play(self, ops):
+        """
+        Send a compiled macro (see macros.compile_macro) in one batch.  The board runs the delays.
         """
-        self.port.write([0x00, key])
+        with self.batch():
+            for op, key in ops:
+                self._queue(op, key)
+            playing = sum(key for op, key in ops if op == OP_DELAY) / 1000.0
+            self._busy_until = max(self._busy_until, monotonic() + playing + TIMED_MARGIN)
+
+    def _cancel_release(self, key):
+        pending = self._pending_releases.pop(key, None)
+        if pending:
+            pending.cancel()
+
+    def _timed(self, op, key, ops):
+        with self.batch():
+            for arg in ops:
+                self._queue(*arg)
+            self._queue(op, key)
 
     def key_press(self, key, duration):
         """
-        Tell the board to press and release a key
+        Tell the board to press a key for duration seconds (up to 65s).
+        Pressing a key again while it is held restarts its hold time.
+        """
+        with self._write_lock:
+            self._cancel_release(key)
+            if self.board_timing:
+                self._keys_down.discard(key)  # The board releases it
+                self._timed_until[key] = monotonic() + duration + TIMED_MARGIN
+                self._timed(OP_PRESS_FOR, key, time_args(duration))
+            else:
+                self.key_down(key)
+                self._pending_releases[key] = self.scheduler.schedule(duration, self.key_release, key)
+
+    def key_tap(self, key, count, interval, hold=TAP_HOLD):
+        """
+        Tell the board to tap a key count times (up to 255), starting a tap every interval seconds
+        """
+        count = max(1, min(0xFF, count))
+        hold = min(hold, interval)
+        with self._write_lock:
+            self._cancel_release(key)
+            if self.board_timing:
+                self._keys_down.discard(key)
+                self._timed_until[key] = monotonic() + (count - 1) * interval + hold + TIMED_MARGIN
+                self._timed(OP_TAP, key, [(OP_ARG, count)] + time_args(interval, hold))
+            else:
+                for tap in range(count):
+                    self.scheduler.schedule(tap * interval, self.key_press, key, hold)
+
+    def key_release_after(self, key, delay):
+        """
+        Tell the board to release a key after delay seconds
         """
-        self.port.write([key, 0x00])
-        sleep(duration)
-        self.port.write([0x00, key])
\ No newline at end of file
+        with self._write_lock:
+            self._cancel_release(key)
+            if self.board_timing:
+                self._keys_down.discard(key)
+                self._timed_until[key] = monotonic() + delay + TIMED_MARGIN
+                self._timed(OP_RELEASE_AFTER, key, time_args(delay))
+            else:
+                self._pending_releases[key] = self.scheduler.schedule(delay, self.key_release, key)
\ No newline at end of file
@@ -19,35 +19,339 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 */
 
-char readBuffer[2];
+/*
+Serial frame format (host -> board):
+  SYNC (0xA5) | SEQ | COUNT | COUNT x (OP, KEY) | CHECKSUM
+CHECKSUM is the XOR of SEQ, COUNT and every OP/KEY byte.  Frames with a bad
+checksum are dropped and the reader hunts for the next SYNC byte.
+
+SEQ 0 restarts the count, then frames are numbered 1-255 and wrap to 1.
+Only the frame after the last accepted one is run; others (repeats and
+frames after a lost one) are ignored until the host sends them again.
+COUNT 0 frames carry no ops and just ask for a status.
+
+Status frame (board -> host), sent for every frame received and whenever
+the held keys change:
+  STATUS_SYNC (0x5A) | SEQ | 32 byte bitmap of held keys | CHECKSUM
+SEQ is the last frame accepted.  CHECKSUM is the XOR of SEQ and the bitmap.
+
+Ops are queued and run in order from loop().  OP_DELAY (KEY = 1-255 ms)
+holds back the ops after it, so macros play back with the board's timing
+while the serial port keeps being read.  A frame that does not fit in the
+queue is dropped.
+
+Timed commands take their arguments from the OP_ARG ops just before them.
+Times are 16 bit ms, high byte first.
+  OP_PRESS_FOR      hold                    Press now, release after hold ms
+  OP_TAP            count, interval, hold   Tap count times, a press every interval ms
+  OP_RELEASE_AFTER  delay                   Release after delay ms
+Each key has at most one timer; a new timed command for the key replaces it.
+OP_RELEASE and OP_RELEASE_ALL cancel the timers of the keys they release.
+*/
+
+#define BAUD_RATE 115200
+
+#define FRAME_SYNC 0xA5
+#define STATUS_SYNC 0x5A
+#define BITMAP_BYTES 32
+#define MAX_FRAME_OPS 32
+
+#define OP_PRESS 0x01
+#define OP_RELEASE 0x02
+#define OP_RELEASE_ALL 0x03
+#define OP_DELAY 0x04
+#define OP_ARG 0x05
+#define OP_PRESS_FOR 0x06
+#define OP_TAP 0x07
+#define OP_RELEASE_AFTER 0x08
+
+#define MAX_ARGS 5
+#define MAX_TIMERS 16
+
+#define OP_QUEUE_SIZE 256
+
+enum ReadState {
+  WAIT_SYNC,
+  READ_SEQ,
+  READ_COUNT,
+  READ_OPS,
+  READ_CHECKSUM
+};
+
+ReadState readState = WAIT_SYNC;
+byte frameSeq = 0;
+byte lastSeq = 0;
+byte opCount = 0;
+byte opBuffer[MAX_FRAME_OPS * 2];
+int opBytesRead = 0;
+byte checksum = 0;
+
+// Ring buffer of (OP, KEY) pairs waiting to run
+byte opQueue[OP_QUEUE_SIZE * 2];
+int queueHead = 0;
+int queueLength = 0;
+bool delaying = false;
+unsigned long delayStart = 0;
+unsigned long delayLength = 0;
+
+byte args[MAX_ARGS];
+int argCount = 0;
+
+struct KeyTimer {
+  bool active;
+  byte key;
+  bool down;              // Release at due, else press at due
+  byte tapsLeft;          // Presses still to come
+  unsigned int hold;      // ms each press is held
+  unsigned int interval;  // ms from one press to the next
+  unsigned long start;    // millis() the wait started
+  unsigned long wait;     // ms to wait from start
+};
+
+KeyTimer timers[MAX_TIMERS];
+
+byte heldKeys[BITMAP_BYTES];
+bool heldChanged = false;
+
+void pressKey(byte key) {
+  Keyboard.press((char)key);
+  heldKeys[key >> 3] |= 1 << (key & 7);
+  heldChanged = true;
+}
+
+void releaseKey(byte key) {
+  Keyboard.release((char)key);
+  heldKeys[key >> 3] &= ~(1 << (key & 7));
+  heldChanged = true;
+}
+
+void releaseAllKeys() {
+  Keyboard.releaseAll();
+  memset(heldKeys, 0, BITMAP_BYTES);
+  heldChanged = true;
+}
+
+void sendStatus() {
+  byte checksum = lastSeq;
+  Serial.write(STATUS_SYNC);
+  Serial.write(lastSeq);
+  for (int index = 0; index < BITMAP_BYTES; index++) {
+    Serial.write(heldKeys[index]);
+    checksum ^= heldKeys[index];
+  }
+  Serial.write(checksum);
+  heldChanged = false;
+}
+
+void setup() {
   // initialize serial:
-  Serial.begin(9600);
+  Serial.begin(BAUD_RATE);
   Keyboard.begin();
 }
 
-void serialEvent() {
-  while (Serial.available()) {
-    // get the new bytes:
-    int count = Serial.readBytes(readBuffer, 2);
-    if (count == 2) {
-      char releaseChar = (char)readBuffer[0];
-      char pressChar = (char)readBuffer[1];
-       
-      if (releaseChar != 0) {
-        //Keyboard.println("release");
-        Keyboard.release(releaseChar);
-      }
-      if (pressChar != 0) {
-        //Keyboard.println("press");
-        Keyboard.press(pressChar);
-      }
-      if (releaseChar == 0 && pressChar == 0) {
-        Keyboard.releaseAll();
+bool queueOps() {
+  if (queueLength + opCount > OP_QUEUE_SIZE) {
+    return false;  // No room for the frame
+  }
+  for (int index = 0; index < opCount * 2; index += 2) {
+    int slot = ((queueHead + queueLength) % OP_QUEUE_SIZE) * 2;
+    opQueue[slot] = opBuffer[index];
+    opQueue[slot + 1] = opBuffer[index + 1];
+    queueLength++;
+  }
+  return true;
+}
+
+unsigned int timeArg(int index) {
+  if (index + 1 >= argCount) {
+    return 0;
+  }
+  return ((unsigned int)args[index] << 8) | args[index + 1];
+}
+
+void cancelTimer(byte key) {
+  for (int index = 0; index < MAX_TIMERS; index++) {
+    if (timers[index].active && timers[index].key == key) {
+      timers[index].active = false;
+    }
+  }
+}
+
+void cancelAllTimers() {
+  for (int index = 0; index < MAX_TIMERS; index++) {
+    timers[index].active = false;
+  }
+}
+
+void startTimer(byte key, bool down, byte tapsLeft, unsigned int hold, unsigned int interval, unsigned long wait) {
+  cancelTimer(key);
+  for (int index = 0; index < MAX_TIMERS; index++) {
+    if (!timers[index].active) {
+      KeyTimer &timer = timers[index];
+      timer.active = true;
+      timer.key = key;
+      timer.down = down;
+      timer.tapsLeft = tapsLeft;
+      timer.hold = hold;
+      timer.interval = interval;
+      timer.start = millis();
+      timer.wait = wait;
+      return;
+    }
+  }
+  // No free timer.  Don't leave the key stuck down.
+  if (down) {
+    releaseKey(key);
+  }
+}
+
+void runTimers() {
+  unsigned long now = millis();
+  for (int index = 0; index < MAX_TIMERS; index++) {
+    KeyTimer &timer = timers[index];
+    if (!timer.active || now - timer.start < timer.wait) {
+      continue;
+    }
+    if (timer.down) {
+      releaseKey(timer.key);
+      if (timer.tapsLeft == 0) {
+        timer.active = false;
+        continue;
       }
+      timer.down = false;
+      timer.start += timer.wait;
+      timer.wait = timer.interval > timer.hold ? timer.interval - timer.hold : 0;
+    } else {
+      pressKey(timer.key);
+      timer.tapsLeft--;
+      timer.down = true;
+      timer.start += timer.wait;
+      timer.wait = timer.hold;
     }
   }
 }
 
+void runTimedOp(byte op, byte key) {
+  switch (op) {
+    case OP_PRESS_FOR:
+      pressKey(key);
+      startTimer(key, true, 0, 0, 0, timeArg(0));
+      break;
+    case OP_TAP:
+      if (argCount >= 1 && args[0] > 0) {
+        pressKey(key);
+        startTimer(key, true, args[0] - 1, timeArg(3), timeArg(1), timeArg(3));
+      }
+      break;
+    case OP_RELEASE_AFTER:
+      startTimer(key, true, 0, 0, 0, timeArg(0));
+      break;
+  }
+}
+
+void runOps() {
+  while (queueLength > 0) {
+    if (delaying) {
+      if (millis() - delayStart < delayLength) {
+        return;
+      }
+      delaying = false;
+    }
+
+    byte op = opQueue[queueHead * 2];
+    byte key = opQueue[queueHead * 2 + 1];
+    queueHead = (queueHead + 1) % OP_QUEUE_SIZE;
+    queueLength--;
+
+    if (op == OP_ARG) {
+      if (argCount < MAX_ARGS) {
+        args[argCount++] = key;
+      }
+      continue;
+    }
+
+    switch (op) {
+      case OP_PRESS:
+        pressKey(key);
+        break;
+      case OP_RELEASE:
+        cancelTimer(key);
+        releaseKey(key);
+        break;
+      case OP_RELEASE_ALL:
+        cancelAllTimers();
+        releaseAllKeys();
+        break;
+      case OP_DELAY:
+        delaying = true;
+        delayStart = millis();
+        delayLength = key;
+        break;
+      case OP_PRESS_FOR:
+      case OP_TAP:
+      case OP_RELEASE_AFTER:
+        runTimedOp(op, key);
+        break;
+    }
+    argCount = 0;
+  }
+}
+
+void readByte(byte value) {
+  switch (readState) {
+    case WAIT_SYNC:
+      if (value == FRAME_SYNC) {
+        readState = READ_SEQ;
+      }
+      break;
+
+    case READ_SEQ:
+      frameSeq = value;
+      readState = READ_COUNT;
+      break;
+
+    case READ_COUNT:
+      if (value > MAX_FRAME_OPS) {
+        readState = WAIT_SYNC;  // Not a frame we can hold
+        break;
+      }
+      opCount = value;
+      opBytesRead = 0;
+      checksum = frameSeq ^ value;
+      readState = value ? READ_OPS : READ_CHECKSUM;
+      break;
+
+    case READ_OPS:
+      opBuffer[opBytesRead++] = value;
+      checksum ^= value;
+      if (opBytesRead == opCount * 2) {
+        readState = READ_CHECKSUM;
+      }
+      break;
+
+    case READ_CHECKSUM:
+      if (value == checksum) {
+        bool expected = frameSeq == 0 || frameSeq == (lastSeq == 255 ? 1 : lastSeq + 1);
+        if (expected && queueOps()) {
+          lastSeq = frameSeq;
+        }
+        sendStatus();
+      }
+      readState = WAIT_SYNC;
+      break;
+  }
+}
+
+void serialEvent() {
+  while (Serial.available()) {
+    readByte((byte)Serial.read());
+  }
+}
+
 void loop() {
-  // Just waiting for serial events
-}
+  runOps();
+  runTimers();
+  if (heldChanged) {
+    sendStatus();
+  }
+}
@@ -0,0 +1,143 @@
+"""
+async_runtime.py
+An asyncio event loop for button actions.
+
+A FunctionButton callback can be a coroutine function (async def).  Each press runs it as a task
+on this loop instead of starting a thread, so long actions run side by side on one thread.
+The button flashes until its tasks are done; task completion marks the button for redrawing.
+
+Launchpad input and serial output stay on the pipeline threads.  pygame.midi and pyserial
+have no handle the event loop can wait on, and the pipeline already keeps them off the logic thread.
+Callbacks can use arduino.key_press and say() directly, both return right away.  Anything that
+blocks should go through run_blocking so the other tasks keep running.
+
+The loop is started on first use.  It needs Python 3.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from threading import Thread, Event, Lock
+
+try:
+    import asyncio
+except ImportError:  # Python 2
+    asyncio = None
+
+
+def is_coroutine(value):
+    """
+    True if value is a coroutine object, what calling an async def function returns
+    """
+    return asyncio is not None and asyncio.iscoroutine(value)
+
+
+class AsyncRuntime(object):
+    """
+    AsyncRuntime: Runs an asyncio event loop on its own thread.
+
+    Initialization parameters:
+    name - Name of the loop thread.  Default "asyncio runtime"
+    """
+
+    def __init__(self, name="asyncio runtime"):
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._lock = Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if asyncio is None:
+            raise RuntimeError("The asyncio runtime needs Python 3")
+        with self._lock:
+            if self.running:
+                return
+            self.loop = asyncio.new_event_loop()
+            ready = Event()
+            self._thread = Thread(target=self._run, args=(ready,), name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+            ready.wait()
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(ready.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def stop(self, timeout=1.0):
+        """
+        Cancel the running tasks and stop the loop
+        """
+        with self._lock:
+            if not self.running:
+                return
+            self.loop.call_soon_threadsafe(self._cancel_tasks)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _cancel_tasks(self):
+        tasks = [task for task in asyncio.all_tasks(self.loop) if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            finished = asyncio.gather(*tasks, return_exceptions=True)
+            finished.add_done_callback(lambda _: self.loop.stop())
+        else:
+            self.loop.stop()
+
+    def submit(self, coroutine, done=None):
+        """
+        Run a coroutine on the loop.  Can be called from any thread.
+        done(future) is called on the loop thread when it finishes.  Returns a concurrent.futures.Future.
+        """
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        future.add_done_callback(_report_error)
+        if done:
+            future.add_done_callback(done)
+        return future
+
+
+def _report_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        print(future.exception())
+
+
+_runtime = AsyncRuntime()
+
+
+def submit(coroutine, done=None):
+    """
+    Run a coroutine on the shared runtime
+    """
+    return _runtime.submit(coroutine, done)
+
+
+def stop():
+    _runtime.stop()
+
+
+def run_blocking(function, *args):
+    """
+    Awaitable that runs a blocking function on a worker thread.  Use from inside a coroutine.
+    """
+    return asyncio.get_event_loop().run_in_executor(None, function, *args)
@@ -0,0 +1,166 @@
+"""
+benchmark.py
+Replays recorded button sessions through the mapper against simulated devices and
+reports the end to end latency and output rates.
+
+Usage:
+python benchmark.py [--midi-delay MS] [--serial-delay MS] [--serial-loss FRACTION] [session.json ...]
+
+The delays slow down every MIDI message / serial write to show how input latency holds up
+when the output is saturated.  The serial loss drops writes to the simulated board to
+exercise the acknowledged protocol.
+
+A session file holds {"events": [[seconds, x, y, pressed], ...]}.  A session log recorded with
+launchpad_mapper.py --record works too: the button events of the first launchpad in its last session are used.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import os
+from bisect import bisect_left
+import launchpad_mapper
+import speech
+from arduino import Arduino, OP_PRESS, OP_PRESS_FOR, OP_TAP, decode_frames
+from latency import LatencyHistogram
+from session_log import is_session_log, read_sessions, session_events
+from simulator import ScriptedLaunchpad, SimulatedDue
+
+DEFAULT_SESSION = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions", "combat.json")
+
+# Output later than this after a press is not counted as caused by it (timed releases come .2s later)
+MATCH_WINDOW = .1
+
+
+def load_session(path):
+    """
+    Returns the (seconds, x, y, pressed) events of a session file or session log
+    """
+    if is_session_log(path):
+        sessions = read_sessions(path)
+        return session_events(sessions[-1]) if sessions else []
+    with open(path) as session_file:
+        session = json.load(session_file)
+    return [(float(seconds), int(x), int(y), bool(pressed)) for seconds, x, y, pressed in session["events"]]
+
+
+def percentile(samples, percent):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def has_key_press(data):
+    """
+    True if the serial data holds a key press op
+    """
+    return any(op in (OP_PRESS, OP_PRESS_FOR, OP_TAP) for _, ops in decode_frames(data) for op, _ in ops)
+
+
+def response_latencies(delivered, output_times, presses_only=False):
+    """
+    For each delivered event, the time from when it was due to the first output that followed it.
+    Events with no output before the next event (or MATCH_WINDOW) are skipped.
+    """
+    latencies = []
+    for index, (due, _, _, _, pressed) in enumerate(delivered):
+        if presses_only and not pressed:
+            continue
+        end = due + MATCH_WINDOW
+        if index + 1 < len(delivered):
+            end = min(end, delivered[index + 1][0])
+        position = bisect_left(output_times, due)
+        if position < len(output_times) and output_times[position] < end:
+            latencies.append(output_times[position] - due)
+    return latencies
+
+
+def run_session(events, end_delay=.5, midi_delay=0.0, serial_delay=0.0, serial_loss=0.0):
+    """
+    Run the mapper over the events and return a dict of results.
+    midi_delay and serial_delay are the seconds each MIDI message and serial write take.
+    serial_loss is the fraction of serial writes lost.
+    """
+    speech.set_backend(speech.RecordingBackend())
+    launchpad = ScriptedLaunchpad(events, end_delay=end_delay, midi_delay=midi_delay)
+    serial_port = SimulatedDue(write_delay=serial_delay, loss=serial_loss)
+    arduino = Arduino(None, port=serial_port)
+    dispatch = LatencyHistogram("event dispatch")
+
+    try:
+        stats = launchpad_mapper.main(launchpad=launchpad, arduino=arduino, histogram=dispatch)
+    finally:
+        arduino.close()
+    duration = stats["duration"] or 1.0
+
+    # Releases (timed ones from the key scheduler included) are not responses to a press
+    key_times = [when for when, data in serial_port.frames if has_key_press(data)]
+    key_latencies = response_latencies(launchpad.delivered, key_times, presses_only=True)
+    led_latencies = response_latencies(launchpad.delivered, [message[0] for message in launchpad.midi.messages])
+    return {
+        "events": len(launchpad.delivered),
+        "duration": duration,
+        "key_latencies": key_latencies,
+        "led_latencies": led_latencies,
+        "dispatch": dispatch,
+        "fps": stats["frames"] / duration,
+        "drawn_fps": stats["frames_drawn"] / duration,
+        "midi_bytes_per_second": launchpad.midi.bytes_written / duration,
+        "serial_bytes_per_second": serial_port.bytes_written / duration,
+        "serial_writes_lost": serial_port.lost,
+        "keys_held_at_end": len(serial_port.held),
+    }
+
+
+def format_results(name, results):
+    lines = ["%s: %d events in %.2f s" % (name, results["events"], results["duration"])]
+    for label, samples in (("press -> keystroke", results["key_latencies"]),
+                           ("press -> LED", results["led_latencies"])):
+        lines.append("  %-20s %4d matched  p50 %7.3f ms  p99 %7.3f ms" %
+                     (label, len(samples), percentile(samples, 50) * 1000.0, percentile(samples, 99) * 1000.0))
+    dispatch = results["dispatch"]
+    lines.append("  %-20s %4d events   p50 %7.3f ms  p99 %7.3f ms" %
+                 ("event dispatch", dispatch.count, dispatch.percentile(50), dispatch.percentile(99)))
+    lines.append("  frames/s %.1f (%.1f drawn)   MIDI %.0f bytes/s   serial %.0f bytes/s" %
+                 (results["fps"], results["drawn_fps"],
+                  results["midi_bytes_per_second"], results["serial_bytes_per_second"]))
+    lines.append("  serial writes lost %d   keys held at the end %d" %
+                 (results["serial_writes_lost"], results["keys_held_at_end"]))
+    return "\n".join(lines)
+
+
+def main(paths, midi_delay=0.0, serial_delay=0.0, serial_loss=0.0):
+    reports = []
+    for path in paths or [DEFAULT_SESSION]:
+        results = run_session(load_session(path), midi_delay=midi_delay, serial_delay=serial_delay,
+                              serial_loss=serial_loss)
+        reports.append(format_results(os.path.basename(path), results))
+    print("\n".join(reports))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay button sessions against simulated devices")
+    parser.add_argument("sessions", nargs="*", help="session files.  Default sessions/combat.json")
+    parser.add_argument("--midi-delay", type=float, default=0.0, metavar="MS", help="time each MIDI message takes")
+    parser.add_argument("--serial-delay", type=float, default=0.0, metavar="MS", help="time each serial write takes")
+    parser.add_argument("--serial-loss", type=float, default=0.0, metavar="FRACTION",
+                        help="fraction of serial writes lost")
+    args = parser.parse_args()
+    main(args.sessions, midi_delay=args.midi_delay / 1000.0, serial_delay=args.serial_delay / 1000.0,
+         serial_loss=args.serial_loss)
@@ -18,8 +18,17 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from utils import get_buffer_position, get_color
-from threading import Thread
+from palette import color, OFF
+from frame_buffer import CELL_INDEX, CELL_COUNT, NO_LED
+from threading import Thread, current_thread
+from async_runtime import is_coroutine, submit
+from animations import Countdown
+from telemetry import STATUS_FLAGS
+
+FLASHING_RED = color(3, 0, flashing=True)
+
+# What a PadPageButton does with its page
+PAGE_ACTIONS = ("show", "push", "back")
 
 
 class ShutdownException(Exception):
@@ -29,18 +38,39 @@ class ShutdownException(Exception):
     pass
 
 
+def color_property(name):
+    """
+    Property for a color setting.  Changing it looks up the button's LED velocities again.
+    """
+    attribute = "_" + name
+
+    def getter(self):
+        return getattr(self, attribute)
+
+    def setter(self, value):
+        if value != getattr(self, attribute):
+            setattr(self, attribute, value)
+            self.update_colors()
+
+    return property(getter, setter)
+
+
 class ButtonKey(object):
     """
     ButtonKey:  Base class for all the button types.
     """
 
+    __slots__ = ("_x", "_y", "_description", "_draw_position", "_renderer", "_red", "_green", "_color")
+
     def __init__(self, x, y, description=""):
         self._x = x
         self._y = y
         self._description = description
-        self._draw_position = get_buffer_position(x, y)
-        self.red = 0
-        self.green = 0
+        self._draw_position = CELL_INDEX[x][y]
+        self._renderer = None
+        self._red = 0
+        self._green = 0
+        self._color = color(0, 0, flashing=True)
 
     @property
     def x(self):
@@ -54,6 +84,60 @@ class ButtonKey(object):
     def description(self):
         return self._description
 
+    red = color_property("red")
+    green = color_property("green")
+
+    def update_colors(self):
+        """
+        Look up the ready to send LED velocities for the color settings and redraw
+        """
+        self._color = color(self._red, self._green, flashing=True)
+        self.mark_dirty()
+
+    def attach(self, renderer):
+        """
+        Called by the renderer when the button's page gets a frame (render.PageFrame) or loses it (None)
+        """
+        self._renderer = renderer
+
+    def mark_dirty(self):
+        """
+        Ask for the button to be redrawn.  Call whenever something used by draw changes.
+        """
+        if self._renderer:
+            self._renderer.mark_dirty(self)
+
+    def adopt_state(self, old_button, arduino=None):
+        """
+        Called when a reloaded profile replaces old_button with this button.
+        Carry over any live state.  Default implementation has none.
+
+        Parameters:
+        old_button  The button being replaced
+        arduino  Arduino object used to release keys the new button no longer sends
+        """
+        pass
+
+    def show_status(self, status):
+        """
+        Called with each new game status (see telemetry.py).  Follow it without sending keys.
+        Default implementation ignores it.
+
+        Parameters:
+        status  The decoded Status.json
+        """
+        pass
+
+    def show_event(self, event, animator=None):
+        """
+        Called with each new game journal event (see telemetry.py).  Default implementation ignores it.
+
+        Parameters:
+        event  The decoded journal line
+        animator  animations.Animator of the launchpad
+        """
+        pass
+
     def pressed(self, launchpad=None, **kwargs):
         """
         Button has been pressed.  Default implementation turns on the red LED
@@ -74,12 +158,86 @@ class ButtonKey(object):
 
     def draw(self, draw_buffer):
         """
-        Called every cycle.  About .1 seconds
+        Called when the button has been marked dirty or its page is shown
 
         Parameters:
         draw_buffer  The raw drawing array for the launchpad
         """
-        draw_buffer[self._draw_position] = get_color(self.red, self.green, flashing=True)
+        draw_buffer[self._draw_position] = self._color
+
+
+class EmptyCell(ButtonKey):
+    """
+    EmptyCell: A cell with no button.  One shared instance, EMPTY, fills every unmapped cell.
+    """
+
+    __slots__ = ()
+
+    def __init__(self):
+        for name, value in (("_x", None), ("_y", None), ("_description", ""), ("_draw_position", NO_LED),
+                            ("_renderer", None), ("_red", 0), ("_green", 0), ("_color", OFF)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The empty cell is shared and can't be changed")
+
+    def attach(self, renderer):
+        pass
+
+    def mark_dirty(self):
+        pass
+
+    def pressed(self, **kwargs):
+        pass
+
+    def released(self, **kwargs):
+        pass
+
+    def draw(self, draw_buffer):
+        pass
+
+
+EMPTY = EmptyCell()
+
+
+class _PageColumn(object):
+    """
+    _PageColumn: page[x][y] access to the cells of a Page.
+    """
+
+    __slots__ = ("_cells", "_column")
+
+    def __init__(self, cells, x):
+        self._cells = cells
+        self._column = CELL_INDEX[x]
+
+    def __getitem__(self, y):
+        return self._cells[self._column[y]]
+
+    def __setitem__(self, y, button):
+        self._cells[self._column[y]] = button if button is not None else EMPTY
+
+
+class Page(object):
+    """
+    Page: The buttons of one launchpad page in a flat list indexed by frame buffer cell (see frame_buffer.py),
+    the order of the launchpad's MIDI addresses.  The corner button without an LED has the spare cell.
+    Unmapped cells hold EMPTY.  page[x][y] reads and sets the button at launchpad position x, y.
+    """
+
+    __slots__ = ("cells",)
+
+    def __init__(self):
+        self.cells = [EMPTY] * (CELL_COUNT + 1)
+
+    def __getitem__(self, x):
+        return _PageColumn(self.cells, x)
+
+    def buttons(self):
+        """
+        Returns the buttons on the page, without the empty cells
+        """
+        return [button for button in self.cells if button is not EMPTY]
 
 
 class ShutdownButton(ButtonKey):
@@ -87,6 +245,8 @@ class ShutdownButton(ButtonKey):
     ShutdownButton: Raised the ShutdownException when pressed.
     """
 
+    __slots__ = ()
+
     def __init__(self, x, y, description=""):
         super(ShutdownButton, self).__init__(x, y, description=description)
 
@@ -98,31 +258,68 @@ class ShutdownButton(ButtonKey):
 
 
 class FunctionButton(ButtonKey):
+    """
+    FunctionButton: Calls a function when pressed.  The button flashes while the function runs.
+
+    Initialization parameters:
+    x - X position of the button on the launchpad (0-8)
+    y - Y position of the button on the launchpad (0-8)
+    red - Intensity of the red LED (0-3).  Default 0
+    green - Intensity of the green LED (0-3).  Default 3
+    callback - Function to call.  An async def function runs as a task on the asyncio runtime.
+    use_thread - Call the function on a new thread.  Default False
+    """
+
+    __slots__ = ("callback", "use_thread", "process", "_running", "_running_color")
 
     def __init__(self, x, y, red=0, green=3, callback=None, use_thread=False, description=""):
         super(FunctionButton, self).__init__(x, y, description=description)
         self.callback = callback
-        self.red = red
-        self.green = green
+        self._red = red
+        self._green = green
         self.use_thread = use_thread
-        self.process = None
+        self.process = None     # Thread or future of the last press
+        self._running = set()   # Threads and futures not finished yet
+        self.update_colors()
+
+    def update_colors(self):
+        self._color = color(self._red, self._green)
+        self._running_color = color(self._red, self._green, flashing=True)
+        self.mark_dirty()
 
     def pressed(self, **kwargs):
         if self.use_thread:
-            self.process = Thread(target=self.callback)
+            self.process = Thread(target=self._run_callback)
+            self._running.add(self.process)
             self.process.start()
+            self.mark_dirty()
         else:
+            result = self.callback()
+            if is_coroutine(result):
+                self.process = submit(result, done=self._finished)
+                self._running.add(self.process)
+                if self.process.done():  # Finished before it was added
+                    self._running.discard(self.process)
+                self.mark_dirty()
+
+    def _run_callback(self):
+        try:
             self.callback()
+        finally:
+            self._finished(current_thread())
+
+    def _finished(self, process):
+        self._running.discard(process)
+        self.mark_dirty()  # Stop flashing
 
     def released(self, **kwargs):
-        if self.process:
-            self.process.join(.01)
+        pass
 
     def draw(self, draw_buffer):
-        if self.process and self.process.isAlive():
-            draw_buffer[self._draw_position] = get_color(self.red, self.green, flashing=True)
+        if self._running:
+            draw_buffer[self._draw_position] = self._running_color
         else:
-            draw_buffer[self._draw_position] = get_color(self.red, self.green)
+            draw_buffer[self._draw_position] = self._color
 
 
 class PadPageButton(ButtonKey):
@@ -135,23 +332,37 @@ class PadPageButton(ButtonKey):
     red - Intensity of the red LED while the button is toggled off (0-3).  Default 0
     green - Intensity of the green LED while the button is toggled off (0-3).  Default 0
     page - The page index that will be displayed when the button pressed.  Default 0
+    action - "show" replaces the current page, "push" shows the page on top of it
+             and "back" returns to the page shown before the last push.  Default "show"
     """
 
-    def __init__(self, x, y, red=0, green=3, page=0, description=""):
+    __slots__ = ("_toggled", "page", "action")
+
+    def __init__(self, x, y, red=0, green=3, page=0, action="show", description=""):
         super(PadPageButton, self).__init__(x, y, description=description)
         self._toggled = False
-        self.red = red
-        self.green = green
+        self._red = red
+        self._green = green
         self.page = page
+        self.action = action
+        self.update_colors()
+
+    def update_colors(self):
+        self._color = color(self._red, self._green)
+        self.mark_dirty()
 
     def pressed(self, pad_states=None, current_pad_state=None, **kwargs):
+        if self.action == "back":
+            return {"back": True}
+        if self.action == "push":
+            return {"push": pad_states[self.page]}
         return {"state": pad_states[self.page]}
 
     def released(self, **kwargs):
         pass
 
     def draw(self, draw_buffer):
-        draw_buffer[self._draw_position] = get_color(self.red, self.green)
+        draw_buffer[self._draw_position] = self._color
 
 
 class InputButton(ButtonKey):
@@ -167,35 +378,46 @@ class InputButton(ButtonKey):
     pressed_green - Intensity of the green LED while the button is pressed (0-3).  Default 0
     key_output - The key that will be reported as down while the button is pressed.  Default None
     flashing - True if the button is to cycle the pressed colors while the button is pressed.  Default False.
+    countdown - Seconds of a countdown shown on the button after a press, for a charge up like the FSD.
+                Pressing again stops it.  Default None
+    countdown_events - Game journal events that stop the countdown, like "StartJump".  Default ()
     """
 
+    __slots__ = ("_pressed_red", "_pressed_green", "key_output", "_pressed", "_flashing", "_pressed_callback",
+                 "_pressed_color", "countdown", "countdown_events", "_countdown")
+
     def __init__(self, x, y, red=0, green=0, pressed_red=3, pressed_green=0,
-                 key_output=None, flashing=False, description=""):
+                 key_output=None, flashing=False, countdown=None, countdown_events=(), description=""):
         super(InputButton, self).__init__(x, y, description=description)
         self._red = red
         self._green = green
-        self.pressed_red = pressed_red
-        self.pressed_green = pressed_green
+        self._pressed_red = pressed_red
+        self._pressed_green = pressed_green
         self.key_output = key_output
         self._pressed = False
-        self.flashing = flashing
+        self._flashing = flashing
         self._pressed_callback = None
-
-    @property
-    def red(self):
-        return self._red
-
-    @red.setter
-    def red(self, value):
-        self._red = value
-
-    @property
-    def green(self):
-        return self._green
-
-    @green.setter
-    def green(self, value):
-        self._green = value
+        self.countdown = countdown
+        self.countdown_events = tuple(countdown_events)
+        self._countdown = None  # Countdown animation running
+        self.update_colors()
+
+    pressed_red = color_property("pressed_red")
+    pressed_green = color_property("pressed_green")
+    flashing = color_property("flashing")
+
+    def update_colors(self):
+        self._color = color(self._red, self._green)
+        self._pressed_color = color(self._pressed_red, self._pressed_green, flashing=self._flashing)
+        self.mark_dirty()
+
+    def adopt_state(self, old_button, arduino=None):
+        if isinstance(old_button, InputButton) and old_button._pressed:
+            if old_button.key_output == self.key_output:
+                self._pressed = True  # Key stays down until the button is released
+                self.mark_dirty()
+            elif old_button.key_output and arduino:
+                arduino.key_release(old_button.key_output)
 
     def set_pressed_callback(self, method):
         """
@@ -203,7 +425,7 @@ class InputButton(ButtonKey):
         """
         self._pressed_callback = method
 
-    def pressed(self, arduino=None, **kwargs):
+    def pressed(self, arduino=None, animator=None, **kwargs):
         if arduino:
             try:
                 if self._pressed_callback:
@@ -212,6 +434,19 @@ class InputButton(ButtonKey):
                     arduino.key_down(self.key_output)
             finally:
                 self._pressed = True
+                self.mark_dirty()
+        if self.countdown and animator:
+            if self._countdown is not None and animator.running(self._countdown):
+                animator.stop(self._countdown)
+                self._countdown = None
+            else:
+                self._countdown = animator.start(Countdown(self, self.countdown))
+
+    def show_event(self, event, animator=None):
+        if self._countdown is not None and event.get("event") in self.countdown_events:
+            if animator:
+                animator.stop(self._countdown)
+            self._countdown = None
 
     def released(self, arduino=None, **kwargs):
         if arduino:
@@ -220,14 +455,69 @@ class InputButton(ButtonKey):
                     arduino.key_release(self.key_output)
             finally:
                 self._pressed = False
+                self.mark_dirty()
+
+    def draw(self, draw_buffer):
+        if self._pressed:
+            draw_buffer[self._draw_position] = self._pressed_color
+        else:
+            draw_buffer[self._draw_position] = self._color
+
+
+class MacroButton(ButtonKey):
+    """
+    MacroButton: Plays a key macro when the button is pressed.
+
+    Initialization parameters:
+    x - X position of the button on the launchpad (0-8)
+    y - Y position of the button on the launchpad (0-8)
+    red - Intensity of the red LED while the button is not pressed (0-3).  Default 0
+    green - Intensity of the green LED while the button is not pressed (0-3).  Default 3
+    pressed_red - Intensity of the red LED while the button is pressed (0-3).  Default 3
+    pressed_green - Intensity of the green LED while the button is pressed (0-3).  Default 3
+    macro - Compiled macro (see macros.compile_macro) sent when the button is pressed.  Default ()
+    """
+
+    __slots__ = ("_pressed_red", "_pressed_green", "macro", "_pressed", "_pressed_color")
+
+    def __init__(self, x, y, red=0, green=3, pressed_red=3, pressed_green=3, macro=(), description=""):
+        super(MacroButton, self).__init__(x, y, description=description)
+        self._red = red
+        self._green = green
+        self._pressed_red = pressed_red
+        self._pressed_green = pressed_green
+        self.macro = tuple(macro)
+        self._pressed = False
+        self.update_colors()
+
+    pressed_red = color_property("pressed_red")
+    pressed_green = color_property("pressed_green")
+
+    def update_colors(self):
+        self._color = color(self._red, self._green)
+        self._pressed_color = color(self._pressed_red, self._pressed_green)
+        self.mark_dirty()
+
+    def adopt_state(self, old_button, arduino=None):
+        if isinstance(old_button, MacroButton):
+            self._pressed = old_button._pressed
+            self.mark_dirty()
+
+    def pressed(self, arduino=None, **kwargs):
+        if arduino and self.macro:
+            arduino.play(self.macro)
+        self._pressed = True
+        self.mark_dirty()
+
+    def released(self, **kwargs):
+        self._pressed = False
+        self.mark_dirty()
 
     def draw(self, draw_buffer):
         if self._pressed:
-            draw_buffer[self._draw_position] = get_color(self.pressed_red,
-                                                         self.pressed_green,
-                                                         flashing=self.flashing)
+            draw_buffer[self._draw_position] = self._pressed_color
         else:
-            draw_buffer[self._draw_position] = get_color(self._red, self._green)
+            draw_buffer[self._draw_position] = self._color
 
 
 class FlashingButton(ButtonKey):
@@ -235,21 +525,30 @@ class FlashingButton(ButtonKey):
     FlashingButton:  Simple button that flashes while pressed
     """
 
+    __slots__ = ("_pressed",)
+
     def __init__(self, x, y, description=""):
         super(FlashingButton, self).__init__(x, y, description=description)
         self._pressed = False
 
+    def adopt_state(self, old_button, arduino=None):
+        if isinstance(old_button, FlashingButton):
+            self._pressed = old_button._pressed
+            self.mark_dirty()
+
     def pressed(self, **kwargs):
         self._pressed = True
+        self.mark_dirty()
 
     def released(self, **kwargs):
         self._pressed = False
+        self.mark_dirty()
 
     def draw(self, draw_buffer):
         if self._pressed:
-            draw_buffer[self._draw_position] = get_color(3, 0, flashing=True)
+            draw_buffer[self._draw_position] = FLASHING_RED
         else:
-            draw_buffer[self._draw_position] = get_color(0, 0)
+            draw_buffer[self._draw_position] = OFF
 
 
 class ToggleButton(ButtonKey):
@@ -267,25 +566,46 @@ class ToggleButton(ButtonKey):
     key_output_cleared - The key that will pressed (down/up) when the button is toggled off.  Default None
     flashing - True if the button is to cycle the toggled colors while the button toggled on.  Default False.
     key_duration - The amount of time the key will be held down for the keypress.  Default .2
+    status_flag - Game status flag (telemetry.STATUS_FLAGS) the button is toggled on with.  Default None
     """
 
+    __slots__ = ("_toggled", "_toggled_red", "_toggled_green", "key_output_set", "key_output_cleared", "_flashing",
+                 "key_duration", "_toggled_color", "status_flag")
+
     def __init__(self, x, y, red=0, green=3, toggled_red=3, toggled_green=0,
                  key_output_set=None, key_output_cleared=None, flashing=False, key_duration=.2,
-                 description=""):
+                 status_flag=None, description=""):
         super(ToggleButton, self).__init__(x, y, description=description)
         self._toggled = False
-        self.red = red
-        self.green = green
-        self.toggled_red = toggled_red
-        self.toggled_green = toggled_green
+        self._red = red
+        self._green = green
+        self._toggled_red = toggled_red
+        self._toggled_green = toggled_green
         self.key_output_set = key_output_set
         self.key_output_cleared = key_output_cleared
-        self.flashing = flashing
+        self._flashing = flashing
         self.key_duration = key_duration
+        self.status_flag = status_flag
+        self.update_colors()
+
+    toggled_red = color_property("toggled_red")
+    toggled_green = color_property("toggled_green")
+    flashing = color_property("flashing")
+
+    def update_colors(self):
+        self._color = color(self._red, self._green)
+        self._toggled_color = color(self._toggled_red, self._toggled_green, flashing=self._flashing)
+        self.mark_dirty()
+
+    def adopt_state(self, old_button, arduino=None):
+        if isinstance(old_button, ToggleButton):
+            self._toggled = old_button._toggled
+            self.mark_dirty()
 
     def pressed(self, arduino=None, **kwargs):
         if arduino:
             self._toggled = not self._toggled
+            self.mark_dirty()
             if self.key_output_set and self._toggled:
                 arduino.key_press(self.key_output_set, self.key_duration)
             if self.key_output_cleared and not self._toggled:
@@ -294,10 +614,17 @@ class ToggleButton(ButtonKey):
     def released(self, **kwargs):
         pass
 
+    def show_status(self, status):
+        if self.status_flag and "Flags" in status:
+            toggled = bool(status["Flags"] & STATUS_FLAGS[self.status_flag])
+            if toggled != self._toggled:
+                self._toggled = toggled
+                self.mark_dirty()
+
     def draw(self, draw_buffer):
         if self._toggled:
-            draw_buffer[self._draw_position] = get_color(self.toggled_red, self.toggled_green, flashing=self.flashing)
+            draw_buffer[self._draw_position] = self._toggled_color
         else:
-            draw_buffer[self._draw_position] = get_color(self.red, self.green)
+            draw_buffer[self._draw_position] = self._color
 
 
@@ -0,0 +1,166 @@
+"""
+devices.py
+The launchpads and output boards used by the mapper, by ID.
+
+A devices file lists them and binds each launchpad's pages to a board:
+{
+  "boards": [
+    {"id": "keys", "port": "COM6"},
+    {"id": "panel", "port": "COM7"},
+    {"id": "local", "type": "uinput"}
+  ],
+  "launchpads": [
+    {"id": "left", "number": 0, "board": "keys", "profile": "profiles/elite_ship.json", "trade": true},
+    {"id": "right", "number": 1, "board": "panel", "profile": "profiles/right_grid.json"}
+  ]
+}
+number is the launchpad's index among the connected launchpads.  Profile paths are relative to
+the devices file.  trade adds the trade page after the profile pages.
+A board's type is "arduino" (the default, needs a port) or "uinput" for a local virtual keyboard
+(see uinput_keyboard.py).
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+from collections import OrderedDict
+from elite_mapping import SHIP_PROFILE
+
+DEFAULT_BOARD = "main"
+DEFAULT_LAUNCHPAD = "main"
+BOARD_TYPES = ("arduino", "uinput")
+
+
+class DeviceError(Exception):
+    """
+    DeviceError: Raised for a devices file that can't be used.
+    """
+    pass
+
+
+class LaunchpadSettings(object):
+    """
+    LaunchpadSettings: A launchpad in the registry and what its pages are bound to.
+
+    Initialization parameters:
+    device_id - ID of the launchpad
+    launchpad - Launchpad object (not opened yet)
+    number - Index of the launchpad among the connected launchpads.  Default 0
+    board - ID of the board the buttons send keys to.  Default "main"
+    profile - Mapping profile with the pages.  Default the ship profile
+    trade - True to add the trade page after the profile pages.  Default False
+    """
+
+    def __init__(self, device_id, launchpad, number=0, board=DEFAULT_BOARD, profile=SHIP_PROFILE, trade=False):
+        self.device_id = device_id
+        self.launchpad = launchpad
+        self.number = number
+        self.board = board
+        self.profile = profile
+        self.trade = trade
+
+
+class DeviceRegistry(object):
+    """
+    DeviceRegistry: The launchpads and output boards of one mapper process, by ID.
+    """
+
+    def __init__(self):
+        self.launchpads = OrderedDict()     # id: LaunchpadSettings
+        self.boards = OrderedDict()         # id: Arduino or UinputKeyboard
+
+    def add_board(self, device_id, board):
+        if device_id in self.boards:
+            raise DeviceError("Board %r is already registered" % device_id)
+        self.boards[device_id] = board
+        return board
+
+    def add_launchpad(self, device_id, launchpad, **settings):
+        if device_id in self.launchpads:
+            raise DeviceError("Launchpad %r is already registered" % device_id)
+        self.launchpads[device_id] = LaunchpadSettings(device_id, launchpad, **settings)
+        return self.launchpads[device_id]
+
+    def board(self, device_id):
+        try:
+            return self.boards[device_id]
+        except KeyError:
+            raise DeviceError("No board %r" % device_id)
+
+    def check(self):
+        """
+        Raise DeviceError unless there is a launchpad and every launchpad's board is registered
+        """
+        if not self.launchpads:
+            raise DeviceError("No launchpads")
+        for settings in self.launchpads.values():
+            self.board(settings.board)
+
+
+def _field(entry, name, kinds, where, default=None):
+    value = entry.get(name, default)
+    if value is None or isinstance(value, bool) != (kinds is bool) or not isinstance(value, kinds):
+        raise DeviceError("%s: %s is missing or of the wrong type" % (where, name))
+    return value
+
+
+def load_devices(path, open_launchpad, open_board, open_uinput=None):
+    """
+    Build a DeviceRegistry from a devices file.
+    open_launchpad() returns a new Launchpad object, open_board(port) an opened board
+    and open_uinput() an opened uinput keyboard.
+    """
+    try:
+        with open(path) as devices_file:
+            config = json.load(devices_file)
+    except ValueError as ex:
+        raise DeviceError("%s: %s" % (path, ex))
+    if not isinstance(config, dict):
+        raise DeviceError("%s: expected {\"boards\": [...], \"launchpads\": [...]}" % path)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    string_types = (type(u""), type(""))
+    registry = DeviceRegistry()
+    for number, entry in enumerate(config.get("boards", [])):
+        where = "%s board %d" % (path, number)
+        if not isinstance(entry, dict):
+            raise DeviceError("%s: expected an object" % where)
+        device_id = _field(entry, "id", string_types, where)
+        board_type = _field(entry, "type", string_types, where, "arduino")
+        if board_type not in BOARD_TYPES:
+            raise DeviceError("%s: type must be one of %s" % (where, ", ".join(BOARD_TYPES)))
+        if board_type == "uinput":
+            if open_uinput is None:
+                raise DeviceError("%s: uinput boards are not available" % where)
+            registry.add_board(str(device_id), open_uinput())
+        else:
+            port = _field(entry, "port", string_types, where)
+            registry.add_board(str(device_id), open_board(str(port)))
+
+    for number, entry in enumerate(config.get("launchpads", [])):
+        where = "%s launchpad %d" % (path, number)
+        if not isinstance(entry, dict):
+            raise DeviceError("%s: expected an object" % where)
+        profile = _field(entry, "profile", string_types, where, SHIP_PROFILE)
+        registry.add_launchpad(str(_field(entry, "id", string_types, where)),
+                               open_launchpad(),
+                               number=_field(entry, "number", int, where, 0),
+                               board=str(_field(entry, "board", string_types, where, DEFAULT_BOARD)),
+                               profile=os.path.join(directory, profile),
+                               trade=_field(entry, "trade", bool, where, False))
+    registry.check()
+    return registry
@@ -0,0 +1,99 @@
+"""
+display.py
+Writes the LED buffer to the Launchpad S.
+
+Single LED changes go out as plain note messages.  Bulk changes (page switches) are written
+into the hidden buffer with the rapid LED update message and then shown with a buffer flip
+so the whole grid changes at once.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from frame_buffer import CELL_COUNT, CONTROL_CHANGE
+from palette import VELOCITY_CLEAR, VELOCITY_FLAGS
+
+RAPID_UPDATE = 146      # Note on, channel 3.  Sets the next two LEDs in the rapid update order
+
+# Buffer control values (controller 0)
+XY_LAYOUT = 1                   # Also resets the rapid update position
+SHOW_1_UPDATE_0 = 0x21          # Display buffer 1 while buffer 0 is written
+SHOW_0_UPDATE_1_COPY = 0x34     # Display buffer 0 and copy it into buffer 1
+FLASHING_ON = 0x28              # Let the launchpad flip the buffers to flash LEDs
+
+# Messages in every bulk update: 2 to set up the buffers, the rapid updates and 2 to flip them.
+# The lit flashing LEDs are rewritten after that, one message each.
+BULK_UPDATE_MESSAGES = 2 + CELL_COUNT // 2 + 2
+
+
+def flashing_cells(cells):
+    """
+    Returns the lit flashing cells, which a bulk update has to rewrite
+    """
+    return [cell for cell in range(CELL_COUNT)
+            if cells[cell] & VELOCITY_FLAGS == VELOCITY_CLEAR and cells[cell] & ~VELOCITY_FLAGS]
+
+
+class LaunchpadDisplay(object):
+    """
+    LaunchpadDisplay: Sends draw buffer changes to the launchpad
+
+    Initialization parameters:
+    launchpad - Launchpad object
+
+    A frame goes out as a bulk update only when that takes fewer messages than setting
+    the changed LEDs one at a time.
+    """
+
+    def __init__(self, launchpad):
+        self.launchpad = launchpad
+
+    def write_changes(self, new_buffer, old_buffer):
+        """
+        Send the cells that differ between new_buffer and old_buffer (what is showing) and
+        bring old_buffer up to date.  Both are FrameBuffer objects.
+        """
+        changed = new_buffer.diff(old_buffer)
+        if not changed:
+            return
+        if (len(changed) > BULK_UPDATE_MESSAGES and
+                len(changed) > BULK_UPDATE_MESSAGES + len(flashing_cells(new_buffer.cells))):
+            self.write_bulk(new_buffer)
+        else:
+            raw_write = self.launchpad.midi.RawWrite
+            for message in new_buffer.midi_messages(changed):
+                raw_write(*message)
+        old_buffer.blit(new_buffer)
+
+    def write_bulk(self, new_buffer):
+        """
+        Repaint every LED.  The LEDs are written to the hidden buffer two at a time
+        and shown with a single buffer flip.
+        """
+        midi = self.launchpad.midi
+        midi.RawWrite(CONTROL_CHANGE, 0, XY_LAYOUT)
+        midi.RawWrite(CONTROL_CHANGE, 0, SHOW_1_UPDATE_0)
+
+        # Frame buffer cells are in rapid update order.  No copy/clear flags so only the hidden buffer is written.
+        cells = new_buffer.cells
+        for cell in range(0, CELL_COUNT, 2):
+            midi.RawWrite(RAPID_UPDATE, cells[cell] & ~VELOCITY_FLAGS, cells[cell + 1] & ~VELOCITY_FLAGS)
+
+        midi.RawWrite(CONTROL_CHANGE, 0, SHOW_0_UPDATE_1_COPY)
+        midi.RawWrite(CONTROL_CHANGE, 0, FLASHING_ON)
+
+        # The copy made both buffers the same.  Rewrite the lit flashing LEDs so they blink again.
+        for message in new_buffer.midi_messages(flashing_cells(cells)):
+            midi.RawWrite(*message)
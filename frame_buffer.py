@@ -0,0 +1,126 @@
+"""
+frame_buffer.py
+Compact LED frame buffer for the Launchpad S.
+
+Cells are stored in the order the rapid LED update message fills them:
+the 8X8 grid by rows (0-63), the scene buttons down the right side (64-71)
+and the automap buttons across the top (72-79).
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+NOTE_ON = 144
+CONTROL_CHANGE = 176
+
+CELL_COUNT = 80
+ROW_SIZE = 8
+NO_LED = CELL_COUNT     # The corner button (8, 0) has no LED.  It draws into a spare cell that is never sent.
+
+
+def cell_index(x, y):
+    """
+    Returns the frame buffer cell for launchpad button x, y (ButtonStateXY coordinates)
+    """
+    if y == 0:
+        return 72 + x if x < 8 else NO_LED
+    if x == 8:
+        return 64 + (y - 1)
+    return (y - 1) * ROW_SIZE + x
+
+
+def cell_address(cell):
+    """
+    Returns the (status, data1) MIDI address of a cell in X/Y layout
+    """
+    if cell >= 72:
+        return CONTROL_CHANGE, 104 + (cell - 72)
+    if cell >= 64:
+        return NOTE_ON, 8 + 16 * (cell - 64)
+    return NOTE_ON, 16 * (cell // ROW_SIZE) + cell % ROW_SIZE
+
+
+CELL_ADDRESS = [cell_address(cell) for cell in range(CELL_COUNT)]
+CELL_INDEX = [[cell_index(x, y) for y in range(9)] for x in range(9)]
+
+
+class FrameBuffer(object):
+    """
+    FrameBuffer: One byte of LED velocity per launchpad cell
+    """
+
+    def __init__(self, cells=None):
+        self.cells = bytearray(CELL_COUNT + 1)
+        if cells is not None:
+            self.cells[:] = cells
+
+    def __len__(self):
+        return CELL_COUNT
+
+    def __getitem__(self, cell):
+        return self.cells[cell]
+
+    def __setitem__(self, cell, velocity):
+        self.cells[cell] = velocity
+
+    def __eq__(self, other):
+        return self.cells[:CELL_COUNT] == other.cells[:CELL_COUNT]
+
+    def __ne__(self, other):
+        return not self == other
+
+    def copy(self):
+        return FrameBuffer(self.cells)
+
+    def blit(self, source):
+        """
+        Copy every cell from source in one operation
+        """
+        self.cells[:] = source.cells
+
+    def fill(self, velocity):
+        self.cells[:] = bytearray([velocity]) * (CELL_COUNT + 1)
+
+    def diff(self, other):
+        """
+        Returns the cells that differ from other.  Rows are compared as slices and only
+        rows that differ are scanned cell by cell.
+        """
+        mine = self.cells
+        theirs = other.cells
+        if mine[:CELL_COUNT] == theirs[:CELL_COUNT]:
+            return []
+        changed = []
+        for start in range(0, CELL_COUNT, ROW_SIZE):
+            end = start + ROW_SIZE
+            if mine[start:end] != theirs[start:end]:
+                changed.extend(cell for cell in range(start, end) if mine[cell] != theirs[cell])
+        return changed
+
+    def midi_messages(self, cells):
+        """
+        Returns the (status, data1, data2) messages that set the given cells
+        """
+        return [CELL_ADDRESS[cell] + (self.cells[cell],) for cell in cells]
+
+    def midi_bytes(self, cells):
+        """
+        Returns the raw MIDI bytes that set the given cells
+        """
+        data = bytearray()
+        for cell in cells:
+            status, data1 = CELL_ADDRESS[cell]
+            data.extend((status, data1, self.cells[cell]))
+        return data
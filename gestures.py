@@ -0,0 +1,237 @@
+"""
+gestures.py
+Buttons that tell a tap, a double tap, a long press and a held repeat apart.
+
+A GestureButton binds a different action to each gesture:
+  tap          Pressed and released before the long press time, with no second press in the double tap window
+  double_tap   Pressed again within the double tap window.  Runs on the second press.
+  long_press   Held for the long press time.  Runs once while the button is still down.
+  hold_repeat  Held for the long press time, then runs every repeat interval until released
+An action is a key (tapped), a compiled macro, or a page change ("show", "push" or "back").
+
+Gesture windows are timed with the monotonic clock on a KeyScheduler.  When a window closes the
+scheduler thread posts a GestureTimer to the launchpad's event queue, so the gesture is decided on the
+logic thread in the order it happened relative to the button events.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from button_types import ButtonKey
+from key_scheduler import KeyScheduler
+from latency import monotonic
+from palette import color
+from arduino import TAP_HOLD
+
+LONG_PRESS_TIME = .5        # Seconds held before a press is a long press
+DOUBLE_TAP_TIME = .25       # Seconds after a tap that a second press makes a double tap
+REPEAT_INTERVAL = .1        # Seconds between the actions of a held repeat
+
+# Gesture states
+IDLE = 0
+PRESSED = 1         # Down, could still become a tap or a long press
+HELD = 2            # Down past the long press time
+TAPPED = 3          # Released after a tap, waiting for a second press
+SECOND_PRESS = 4    # Down for the second press of a double tap
+
+
+class GestureTimer(object):
+    """
+    GestureTimer: A gesture window that closed.  Handed to the logic thread through the event queue.
+    """
+
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+
+    def fire(self, **kwargs):
+        """
+        Called on the logic thread with the handler keyword arguments.  Returns the callback's response.
+        """
+        return self.callback(*self.args, **kwargs)
+
+
+class GestureTimers(object):
+    """
+    GestureTimers: Times gesture windows for the buttons of one launchpad.
+
+    Initialization parameters:
+    post - Function that queues a (GestureTimer, timestamp) pair for the logic thread (MidiReader.post)
+    scheduler - KeyScheduler timing the windows.  Default a new one, started on first use
+    """
+
+    def __init__(self, post, scheduler=None):
+        self.post = post
+        self.scheduler = scheduler
+
+    def schedule(self, delay, callback, *args):
+        """
+        Call callback(*args, **handler kwargs) on the logic thread delay seconds from now.
+        Returns a ScheduledAction that can be cancelled until the timer is posted.
+        """
+        if self.scheduler is None:
+            self.scheduler = KeyScheduler()
+        return self.scheduler.schedule(delay, self._post, GestureTimer(callback, args))
+
+    def _post(self, timer):
+        self.post((timer, monotonic()))
+
+
+def run_action(action, arduino=None, pad_states=None, hold=TAP_HOLD, **kwargs):
+    """
+    Run a compiled gesture action.  Keys are held for hold seconds.
+    Returns the handler response for page changes.
+    """
+    kind, value = action
+    if kind == "key":
+        if arduino:
+            arduino.key_press(value, hold)
+    elif kind == "macro":
+        if arduino:
+            arduino.play(value)
+    elif kind == "show":
+        return {"state": pad_states[value]}
+    elif kind == "push":
+        return {"push": pad_states[value]}
+    elif kind == "back":
+        return {"back": True}
+    return None
+
+
+class GestureButton(ButtonKey):
+    """
+    GestureButton: Runs a different action for a tap, double tap, long press or held repeat.
+
+    Initialization parameters:
+    x - X position of the button on the launchpad (0-8)
+    y - Y position of the button on the launchpad (0-8)
+    red - Intensity of the red LED while the button is not pressed (0-3).  Default 0
+    green - Intensity of the green LED while the button is not pressed (0-3).  Default 3
+    pressed_red - Intensity of the red LED while the button is pressed (0-3).  Default 3
+    pressed_green - Intensity of the green LED while the button is pressed (0-3).  Default 0
+    tap - Action for a tap.  Default None
+    double_tap - Action for a double tap.  Default None.  Without it taps run on release.
+    long_press - Action for a long press.  Default None
+    hold_repeat - Action repeated while the button is held.  Used instead of long_press.  Default None
+    long_press_time - Seconds held before a long press.  Default .5
+    double_tap_time - Seconds after a tap that a second press counts as a double tap.  Default .25
+    repeat_interval - Seconds between held repeats.  Default .1
+    Actions are ("key", key code), ("macro", compiled macro), ("show", page), ("push", page) or ("back", None).
+    """
+
+    __slots__ = ("_pressed_red", "_pressed_green", "tap", "double_tap", "long_press", "hold_repeat",
+                 "long_press_time", "double_tap_time", "repeat_interval", "_state", "_timer", "_generation",
+                 "_pressed_color")
+
+    def __init__(self, x, y, red=0, green=3, pressed_red=3, pressed_green=0, tap=None, double_tap=None,
+                 long_press=None, hold_repeat=None, long_press_time=LONG_PRESS_TIME,
+                 double_tap_time=DOUBLE_TAP_TIME, repeat_interval=REPEAT_INTERVAL, description=""):
+        super(GestureButton, self).__init__(x, y, description=description)
+        self._red = red
+        self._green = green
+        self._pressed_red = pressed_red
+        self._pressed_green = pressed_green
+        self.tap = tap
+        self.double_tap = double_tap
+        self.long_press = long_press
+        self.hold_repeat = hold_repeat
+        self.long_press_time = long_press_time
+        self.double_tap_time = double_tap_time
+        self.repeat_interval = repeat_interval
+        self._state = IDLE
+        self._timer = None
+        self._generation = 0    # Changes whenever the timer is started or cancelled
+        self.update_colors()
+
+    def update_colors(self):
+        self._color = color(self._red, self._green)
+        self._pressed_color = color(self._pressed_red, self._pressed_green)
+        self.mark_dirty()
+
+    @property
+    def state(self):
+        return self._state
+
+    def _start_timer(self, timers, delay, callback):
+        self._cancel_timer()
+        if timers is not None:
+            self._timer = timers.schedule(delay, callback, self._generation)
+
+    def _cancel_timer(self):
+        # A timer already posted to the event queue can't be cancelled.  It sees the new generation and does nothing.
+        self._generation += 1
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _set_state(self, state):
+        self._state = state
+        self.mark_dirty()
+
+    def pressed(self, timers=None, **kwargs):
+        if self._state == TAPPED:
+            self._cancel_timer()
+            self._set_state(SECOND_PRESS)
+            return run_action(self.double_tap, **kwargs)
+        if self._state != IDLE:
+            return None
+        self._set_state(PRESSED)
+        if self.long_press or self.hold_repeat:
+            self._start_timer(timers, self.long_press_time, self._held)
+        return None
+
+    def released(self, timers=None, **kwargs):
+        state = self._state
+        self._cancel_timer()
+        self._set_state(IDLE)
+        if state == PRESSED:
+            if self.double_tap and timers is not None:
+                self._set_state(TAPPED)
+                self._start_timer(timers, self.double_tap_time, self._tap_window_closed)
+            elif self.tap:
+                return run_action(self.tap, **kwargs)
+        return None
+
+    def _repeat_hold(self):
+        # Release the key between repeats so the game sees each one
+        return min(TAP_HOLD, self.repeat_interval / 2.0)
+
+    def _held(self, generation, timers=None, **kwargs):
+        if generation != self._generation:
+            return None
+        self._set_state(HELD)
+        if self.hold_repeat:
+            self._start_timer(timers, self.repeat_interval, self._repeat)
+            return run_action(self.hold_repeat, hold=self._repeat_hold(), **kwargs)
+        return run_action(self.long_press, **kwargs) if self.long_press else None
+
+    def _repeat(self, generation, timers=None, **kwargs):
+        if generation != self._generation:
+            return None
+        self._start_timer(timers, self.repeat_interval, self._repeat)
+        return run_action(self.hold_repeat, hold=self._repeat_hold(), **kwargs)
+
+    def _tap_window_closed(self, generation, timers=None, **kwargs):
+        if generation != self._generation:
+            return None
+        self._cancel_timer()
+        self._set_state(IDLE)
+        return run_action(self.tap, **kwargs) if self.tap else None
+
+    def draw(self, draw_buffer):
+        if self._state in (PRESSED, HELD, SECOND_PRESS):
+            draw_buffer[self._draw_position] = self._pressed_color
+        else:
+            draw_buffer[self._draw_position] = self._color
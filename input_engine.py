@@ -0,0 +1,75 @@
+"""
+input_engine.py
+Waits on the launchpad for button events with a timeout so the main loop never sleeps through a press.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+from time import sleep
+from latency import monotonic
+
+
+class InputEngine(object):
+    """
+    InputEngine: Blocking wrapper around Launchpad.ButtonStateXY.
+
+    pygame.midi has no handle that can be handed to select(), so the engine polls the
+    input in small steps until an event shows up or the timeout runs out.
+
+    Initialization parameters:
+    launchpad - Launchpad object (or a stand-in with a ButtonStateXY method)
+    poll_interval - Seconds between input checks while waiting.  Default .001
+    """
+
+    def __init__(self, launchpad, poll_interval=.001):
+        self.launchpad = launchpad
+        self.poll_interval = poll_interval
+        self._timer_period_set = False
+        self._last_poll = monotonic()
+
+    def start(self):
+        """
+        Windows sleeps in 15.6ms steps by default.  Ask for 1ms timer resolution while the engine runs.
+        """
+        if sys.platform == "win32" and not self._timer_period_set:
+            import ctypes
+            ctypes.windll.winmm.timeBeginPeriod(1)
+            self._timer_period_set = True
+
+    def stop(self):
+        if self._timer_period_set:
+            import ctypes
+            ctypes.windll.winmm.timeEndPeriod(1)
+            self._timer_period_set = False
+
+    def wait_event(self, timeout):
+        """
+        Wait up to timeout seconds for a button event.
+
+        Returns (button_event, timestamp) or None when the timeout expired.  timestamp is the monotonic
+        time of the last poll that came back empty, the earliest the press could have arrived.
+        """
+        deadline = monotonic() + max(timeout, 0)
+        while True:
+            button_event = self.launchpad.ButtonStateXY()
+            now = monotonic()
+            if button_event:
+                return button_event, self._last_poll
+            self._last_poll = now
+            if now >= deadline:
+                return None
+            sleep(min(self.poll_interval, deadline - now))
@@ -0,0 +1,248 @@
+"""
+instrumentation.py
+Timing of each stage of the main loop, for finding out where the time goes when the pad feels slow.
+
+Every loop iteration is stored in a fixed size ring buffer.  Handler times are kept per button
+type and the MIDI and serial traffic is counted.  A report can be dumped on demand with a signal
+(SIGUSR1, or Ctrl+Break on Windows) or by connecting to a local socket, and can be printed
+periodically.  When profiling is off the main loop talks to a NullProfiler whose methods do nothing.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import signal
+import socket
+from array import array
+from threading import Thread
+from latency import LatencyHistogram, monotonic
+
+# Stages of a main loop iteration, in the order they run
+SWAP, RENDER, WRITE_LEDS, IDLE_RELEASE, WAIT, HANDLE_EVENT, SERIAL_FLUSH = range(7)
+STAGE_NAMES = ("swap pages", "render", "write LEDs", "idle release", "wait for input", "handle_event", "serial flush")
+
+RING_SIZE = 1024
+DUMP_PORT = 50505
+
+
+class NullProfiler(object):
+    """
+    NullProfiler: Stands in for the Profiler when profiling is off
+    """
+
+    def begin(self):
+        pass
+
+    def mark(self, stage):
+        pass
+
+    def now(self):
+        return 0
+
+    def record_handler(self, button_key, started, action="pressed"):
+        pass
+
+    def tick(self):
+        pass
+
+    def report(self):
+        return ""
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class _CountingMidi(object):
+    """
+    Wraps launchpad.midi to count the messages written.  Only its LED writer thread counts here.
+    """
+
+    def __init__(self, midi):
+        self._midi = midi
+        self.message_count = 0
+
+    def RawWrite(self, *args):
+        self.message_count += 1
+        return self._midi.RawWrite(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._midi, name)
+
+
+class _CountingPort(object):
+    """
+    Wraps the arduino's raw serial port to count the writes and bytes that reach it.  Put it under the
+    pipeline.SerialWriter, whose one thread makes all the writes while it runs, so the counts need no lock.
+    """
+
+    def __init__(self, port):
+        self._port = port
+        self.write_count = 0
+        self.byte_count = 0
+
+    def write(self, data):
+        self.write_count += 1
+        self.byte_count += len(data)
+        return self._port.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._port, name)
+
+
+class Profiler(object):
+    """
+    Profiler: Records the time spent in each stage of the main loop.
+
+    Initialization parameters:
+    ring_size - Number of loop iterations kept.  Default 1024
+    summary_interval - Seconds between printed summaries.  None to only report on demand.  Default None
+    """
+
+    def __init__(self, ring_size=RING_SIZE, summary_interval=None):
+        self.ring_size = ring_size
+        self.summary_interval = summary_interval
+        self._width = len(STAGE_NAMES)
+        self._ring = array("d", [0.0] * (ring_size * self._width))
+        self._iterations = 0
+        self._base = 0
+        self._last = monotonic()
+        self._started = self._last
+        self._next_summary = self._last + summary_interval if summary_interval else None
+        self._dump_requested = False
+        self.handlers = {}
+        self._midi_counters = []    # One per launchpad, so the writer threads never share a count
+        self._port_counters = []    # One per board
+
+    def instrument(self, launchpad, arduino):
+        """
+        Count the MIDI messages sent to the launchpad and the bytes sent to the arduino.  Either may be None.
+        """
+        if launchpad is not None:
+            launchpad.midi = _CountingMidi(launchpad.midi)
+            self._midi_counters.append(launchpad.midi)
+        if hasattr(arduino, "port"):
+            arduino.port = _CountingPort(arduino.port)
+            self._port_counters.append(arduino.port)
+
+    @property
+    def midi_messages(self):
+        return sum(counter.message_count for counter in self._midi_counters)
+
+    @property
+    def serial_writes(self):
+        return sum(counter.write_count for counter in self._port_counters)
+
+    @property
+    def serial_bytes(self):
+        return sum(counter.byte_count for counter in self._port_counters)
+
+    def begin(self):
+        """
+        Start a loop iteration
+        """
+        self._base = (self._iterations % self.ring_size) * self._width
+        self._iterations += 1
+        self._ring[self._base:self._base + self._width] = array("d", [0.0] * self._width)
+        self._last = monotonic()
+
+    def mark(self, stage):
+        """
+        The stage just finished.  Its time is measured from the previous mark.
+        """
+        now = monotonic()
+        self._ring[self._base + stage] += now - self._last
+        self._last = now
+
+    def now(self):
+        return monotonic()
+
+    def record_handler(self, button_key, started, action="pressed"):
+        """
+        Record how long a button's pressed/released handler took
+        """
+        name = "%s.%s" % (type(button_key).__name__, action)
+        histogram = self.handlers.get(name)
+        if histogram is None:
+            histogram = self.handlers[name] = LatencyHistogram(name)
+        histogram.record(monotonic() - started)
+
+    def tick(self):
+        """
+        Called once per frame.  Prints a requested dump or the periodic summary.
+        """
+        if self._dump_requested:
+            self._dump_requested = False
+            print(self.report())
+        if self._next_summary is not None and monotonic() >= self._next_summary:
+            self._next_summary = monotonic() + self.summary_interval
+            print(self.report())
+
+    def request_dump(self, *_args):
+        """
+        Ask for a report at the next frame.  Safe to call from a signal handler.
+        """
+        self._dump_requested = True
+
+    def install_signal_handler(self):
+        """
+        Dump a report on SIGUSR1 (SIGBREAK, Ctrl+Break, on Windows)
+        """
+        dump_signal = getattr(signal, "SIGUSR1", None) or getattr(signal, "SIGBREAK", None)
+        if dump_signal is not None:
+            signal.signal(dump_signal, self.request_dump)
+
+    def serve(self, port=DUMP_PORT):
+        """
+        Send a report to anything that connects to localhost:port
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(("127.0.0.1", port))
+        server.listen(1)
+
+        def run():
+            while True:
+                connection, _ = server.accept()
+                try:
+                    connection.sendall((self.report() + "\n").encode("utf-8"))
+                finally:
+                    connection.close()
+
+        thread = Thread(target=run, name="profiler dump")
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def report(self):
+        """
+        Returns a printable summary of the recorded iterations, handlers and traffic
+        """
+        count = min(self._iterations, self.ring_size)
+        elapsed = (monotonic() - self._started) or 1.0
+        lines = ["Main loop: %d iterations (last %d kept)" % (self._iterations, count)]
+        for stage, name in enumerate(STAGE_NAMES):
+            samples = sorted(self._ring[row * self._width + stage] * 1000.0 for row in range(count))
+            if not samples:
+                continue
+            lines.append("  %-16s mean %8.3f ms  p99 %8.3f ms  max %8.3f ms" %
+                         (name, sum(samples) / count, samples[min(count - 1, int(count * .99))], samples[-1]))
+        for name in sorted(self.handlers):
+            histogram = self.handlers[name]
+            lines.append("  %-28s %5d calls  mean %7.3f ms  max %7.3f ms" %
+                         (name, histogram.count, histogram.mean_ms, histogram.max_ms))
+        lines.append("  MIDI %d messages (%.1f/s)   serial %d writes, %d bytes (%.1f bytes/s)" %
+                     (self.midi_messages, self.midi_messages / elapsed,
+                      self.serial_writes, self.serial_bytes, self.serial_bytes / elapsed))
+        return "\n".join(lines)
@@ -0,0 +1,84 @@
+"""
+key_codes.py
+Names for the key codes understood by the Arduino Keyboard library.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Special keys.  Printable keys use their ASCII code.
+SPECIAL_KEYS = {
+    "LEFT_CTRL": 0x80,
+    "LEFT_SHIFT": 0x81,
+    "LEFT_ALT": 0x82,
+    "LEFT_GUI": 0x83,
+    "RIGHT_CTRL": 0x84,
+    "RIGHT_SHIFT": 0x85,
+    "RIGHT_ALT": 0x86,
+    "RIGHT_GUI": 0x87,
+    "UP_ARROW": 0xDA,
+    "DOWN_ARROW": 0xD9,
+    "LEFT_ARROW": 0xD8,
+    "RIGHT_ARROW": 0xD7,
+    "BACKSPACE": 0xB2,
+    "TAB": 0xB3,
+    "RETURN": 0xB0,
+    "ESC": 0xB1,
+    "INSERT": 0xD1,
+    "DELETE": 0xD4,
+    "PAGE_UP": 0xD3,
+    "PAGE_DOWN": 0xD6,
+    "HOME": 0xD2,
+    "END": 0xD5,
+    "CAPS_LOCK": 0xC1,
+    "SPACE": 0x20,
+}
+SPECIAL_KEYS.update(("F%d" % number, 0xC1 + number) for number in range(1, 13))
+
+KEY_NAMES = dict((code, name) for name, code in SPECIAL_KEYS.items())
+KEY_NAMES[0x20] = "SPACE"
+
+
+def key_code(value):
+    """
+    Returns the key code for a key name ("ESC", "F9"), a single character ("v"),
+    a hex string ("0x76") or an int.  Raises ValueError for anything else.
+    """
+    if isinstance(value, bool):
+        raise ValueError("Not a key: %r" % (value,))
+    if isinstance(value, int):
+        code = value
+    elif value in SPECIAL_KEYS:
+        code = SPECIAL_KEYS[value]
+    elif len(value) == 1:
+        code = ord(value)
+    elif value.lower().startswith("0x"):
+        code = int(value, 16)
+    else:
+        raise ValueError("Unknown key name: %r" % (value,))
+    if not 0 < code < 0x100:
+        raise ValueError("Key code out of range: %r" % (value,))
+    return code
+
+
+def key_name(code):
+    """
+    Returns the name key_code() accepts for a key code
+    """
+    if code in KEY_NAMES:
+        return KEY_NAMES[code]
+    if 0x20 < code < 0x7F:
+        return chr(code)
+    return "0x%02X" % code
@@ -0,0 +1,104 @@
+"""
+key_scheduler.py
+Runs timed key actions (such as the release half of a key press) on a background thread.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from heapq import heappush, heappop
+from itertools import count
+from threading import Thread, Condition
+from latency import monotonic
+
+
+class ScheduledAction(object):
+    """
+    ScheduledAction: Handle returned by KeyScheduler.schedule.  Can be cancelled until it runs.
+    """
+
+    def __init__(self, due, action, args):
+        self.due = due
+        self.action = action
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class KeyScheduler(object):
+    """
+    KeyScheduler: Heap of pending actions ordered by due time.
+    Actions run on the scheduler thread so the caller never sleeps.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._sequence = count()
+        self._condition = Condition()
+        self._thread = Thread(target=self._run, name="key scheduler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def schedule(self, delay, action, *args):
+        """
+        Run action(*args) delay seconds from now.  Returns a ScheduledAction.
+        """
+        scheduled = ScheduledAction(monotonic() + delay, action, args)
+        with self._condition:
+            heappush(self._heap, (scheduled.due, next(self._sequence), scheduled))
+            self._condition.notify()
+        return scheduled
+
+    def pending(self):
+        """
+        Returns the number of actions waiting to run
+        """
+        with self._condition:
+            return sum(1 for _, _, scheduled in self._heap if not scheduled.cancelled)
+
+    def run_all(self):
+        """
+        Run every pending action now.  Used at shutdown so no key is left held down.
+        """
+        with self._condition:
+            waiting = [heappop(self._heap)[2] for _ in range(len(self._heap))]
+        for scheduled in waiting:
+            self._call(scheduled)
+
+    def _call(self, scheduled):
+        # Test and set under the lock so run_all and the scheduler thread can't both run it
+        with self._condition:
+            if scheduled.cancelled:
+                return
+            scheduled.cancelled = True
+        try:
+            scheduled.action(*scheduled.args)
+        except Exception as ex:
+            print(ex)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                due = self._heap[0][0]
+                delay = due - monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                scheduled = heappop(self._heap)[2]
+            self._call(scheduled)
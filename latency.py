@@ -0,0 +1,97 @@
+"""
+latency.py
+Clock and latency histogram used to measure how quickly the mapper reacts to the launchpad.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+# Monotonic clock when the interpreter has one.  time.time() can jump with the wall clock.
+monotonic = getattr(time, "monotonic", time.time)
+
+# Upper edge of each bucket in milliseconds.  The last bucket catches everything else.
+BUCKET_LIMITS_MS = (0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, float("inf"))
+
+
+class LatencyHistogram(object):
+    """
+    LatencyHistogram: Counts latency samples into fixed millisecond buckets.
+
+    Initialization parameters:
+    name - Label printed with the summary.  Default "latency"
+    limits - Upper edge of each bucket in milliseconds.  Default BUCKET_LIMITS_MS
+    """
+
+    def __init__(self, name="latency", limits=BUCKET_LIMITS_MS):
+        self.name = name
+        self.limits = limits
+        self.counts = [0] * len(limits)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, seconds):
+        """
+        Add one sample measured in seconds
+        """
+        value_ms = seconds * 1000.0
+        for index, limit in enumerate(self.limits):
+            if value_ms <= limit:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.total_ms += value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+
+    def percentile(self, percent):
+        """
+        Returns the bucket edge (ms) that contains the requested percentile.
+        The open ended bucket reports the largest sample seen.
+        """
+        if not self.count:
+            return 0.0
+        needed = self.count * percent / 100.0
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= needed and bucket_count:
+                return min(self.limits[index], self.max_ms)
+        return self.max_ms
+
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.count if self.count else 0.0
+
+    def reset(self):
+        self.counts = [0] * len(self.limits)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def summary(self):
+        """
+        Returns a printable table of the buckets
+        """
+        lines = ["%s: %d samples  mean %.3f ms  p50 %.3f ms  p99 %.3f ms  max %.3f ms" %
+                 (self.name, self.count, self.mean_ms, self.percentile(50), self.percentile(99), self.max_ms)]
+        lower = 0
+        for limit, bucket_count in zip(self.limits, self.counts):
+            if bucket_count:
+                lines.append("  %8s - %-8s ms  %d" % (lower, limit, bucket_count))
+            lower = limit
+        return "\n".join(lines)
@@ -18,126 +18,411 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import time
 from launchpad import Launchpad
-from button_types import ShutdownException, ButtonKey
-from elite_mapping import setup_ship
+from button_types import ShutdownException
+from profile_watcher import ProfileWatcher, new_pad_state
 from trade_extensions import setup_trade
-from arduino_mock import Arduino
-from itertools import chain
+from arduino import Arduino, BAUD_RATE
 from speech import say
+from render import Renderer
+from animations import Animator, FRAME_RATE as ANIMATION_FRAME_RATE
+from display import LaunchpadDisplay
+from frame_buffer import FrameBuffer, CELL_INDEX
+from input_engine import InputEngine
+from pipeline import MidiReader, LedWriter, SerialWriter, InputMultiplexer
+from devices import DeviceRegistry, DeviceError, load_devices, DEFAULT_BOARD, DEFAULT_LAUNCHPAD
+from uinput_keyboard import UinputKeyboard
+from gestures import GestureTimer, GestureTimers
+from telemetry import Telemetry, TelemetryUpdate, show_telemetry
+from session_log import SessionRecorder, RecordingPort, NO_PAGE
+import async_runtime
+from latency import LatencyHistogram, monotonic
+from instrumentation import (Profiler, NullProfiler, NULL_PROFILER, SWAP, RENDER, WRITE_LEDS, IDLE_RELEASE,
+                             WAIT, HANDLE_EVENT, SERIAL_FLUSH)
+import argparse
+
+FRAME_INTERVAL = 1 / 30.0       # Seconds between display refreshes
+IDLE_RELEASE_INTERVAL = .1      # Seconds without input before stuck keys are released
+
+
+class Surface(object):
+    """
+    Surface: A launchpad with its pages, and the threads reading its buttons and writing its LEDs.
 
+    Initialization parameters:
+    settings - devices.LaunchpadSettings of the launchpad
+    animation_rate - Animation frames per second.  Default animations.FRAME_RATE
+    """
 
-def handle_event(launchpad, arduino, button_key, button_pressed, pad_states, current_pad_state):
+    def __init__(self, settings, animation_rate=ANIMATION_FRAME_RATE):
+        self.settings = settings
+        self.launchpad = settings.launchpad
+        self.arduino = None     # Board the buttons send keys to.  Set before build.
+        self.draw_buffer = FrameBuffer()    # LED colors being drawn
+        self.reader = MidiReader(InputEngine(self.launchpad))
+        self.timers = GestureTimers(self.reader.post)   # Gesture windows close through the reader's queue
+        self.led_writer = LedWriter(LaunchpadDisplay(self.launchpad))
+        self.profile_watcher = ProfileWatcher(settings.profile, first_page=0)
+        self.animator = Animator(animation_rate)
+        self.renderer = Renderer(self.draw_buffer, self.animator)
+        self.pad_states = list()
+        self.current_pad_state = None
+        self.held = dict()      # cell: button pressed there.  The release goes to it even if the page changed.
+
+    def open(self):
+        self.launchpad.Open(self.settings.number)  # start it
+
+        # Reset the launchpad
+        self.launchpad.midi.RawWrite(176, 0, 0)
+
+        # Set X/Y Mode
+        self.launchpad.midi.RawWrite(176, 0, 1)
+
+        # Turn Flashing on
+        self.launchpad.midi.RawWrite(176, 0, 40)
+
+        # Control Duty cycle
+        # numerator = 16
+        # denominator = 4
+        # if numerator < 9:
+        #     value = (16 * (numerator - 1)) + (denominator - 3)
+        #     self.launchpad.midi.RawWrite(176, 30, value)
+        # else:
+        #     value = (16 * (numerator - 9)) + (denominator - 3)
+        #     self.launchpad.midi.RawWrite(176, 31, value)
+
+    def build(self):
+        """
+        Create the pages of buttons and show the first one
+        """
+        if self.settings.trade:
+            # The ship page switches to page 1 for trading
+            self.pad_states.extend([new_pad_state(), new_pad_state()])
+            self.profile_watcher.build(self.pad_states)
+            setup_trade(self.pad_states[1])
+        else:
+            self.profile_watcher.build(self.pad_states)
+        # Every page gets a frame now so switching pages doesn't draw them from scratch
+        for page in self.pad_states:
+            self.renderer.add_page(page)
+        self.show_page(self.pad_states[0])
+
+    def start(self):
+        self.led_writer.start()
+        self.reader.start()
+        self.profile_watcher.start()
+
+    def stop(self):
+        self.reader.stop()
+        self.profile_watcher.stop()
+        self.led_writer.stop()
+
+    def close(self):
+        self.launchpad.Reset()
+        self.launchpad.Close()
+
+    def show_page(self, page):
+        self.current_pad_state = self.renderer.show_page(page)
+
+    def navigate(self, response):
+        """
+        Change the page as a handler response asks: {"state": page}, {"push": page} or {"back": True}
+        """
+        if "state" in response:
+            self.current_pad_state = self.renderer.show_page(response["state"])
+        elif "push" in response:
+            self.current_pad_state = self.renderer.push_page(response["push"])
+        elif response.get("back"):
+            self.current_pad_state = self.renderer.pop_page()
+
+    def swap_pages(self):
+        """
+        Swap in any pages rebuilt from an edited profile
+        """
+        self.current_pad_state = self.profile_watcher.swap_pages(self.pad_states, self.current_pad_state,
+                                                                 self.renderer, self.arduino, self.held)
+
+    def page_number(self):
+        """
+        Returns the index in pad_states of the page being shown
+        """
+        for number, page in enumerate(self.pad_states):
+            if page is self.current_pad_state:
+                return number
+        return NO_PAGE
+
+    def button_for(self, cell, pressed):
+        """
+        Returns the button that handles a press or release of a cell
+        """
+        if pressed:
+            button_key = self.held[cell] = self.current_pad_state.cells[cell]
+            return button_key
+        return self.held.pop(cell, None) or self.current_pad_state.cells[cell]
+
+    def post_telemetry(self, status, events):
+        """
+        Telemetry subscriber.  Hands a new game status and journal events to the logic thread.
+        """
+        self.reader.post((TelemetryUpdate(self.show_telemetry, status, events), monotonic()))
+
+    def show_telemetry(self, status, events, animator=None, **kwargs):
+        """
+        Show the game status and journal events on the buttons and groups of every page
+        """
+        buttons = [button for page in self.pad_states for button in page.buttons()]
+        show_telemetry(buttons, self.profile_watcher.groups(), status, events, animator)
+
+    def render(self):
+        return self.renderer.render()
+
+    def post_frame(self):
+        """
+        Hand a copy of the draw buffer to the LED writer
+        """
+        self.led_writer.post(self.draw_buffer.copy())
+
+
+def handle_event(launchpad, arduino, button_key, button_pressed, pad_states, current_pad_state,
+                 profiler=NULL_PROFILER, timers=None, animator=None):
     """
-    Call the method on the button type to handle the event
+    Call the method on the button type to handle the event.
+    button_key can also be a gestures.GestureTimer that closed or a telemetry.TelemetryUpdate, which is fired instead.
     """
     kwargs = {"launchpad": launchpad,
               "arduino": arduino,
               "pad_states": pad_states,
-              "current_pad_state": current_pad_state}
-
-    if button_pressed:
+              "current_pad_state": current_pad_state,
+              "timers": timers,
+              "animator": animator}
+
+    started = profiler.now()
+    if isinstance(button_key, (GestureTimer, TelemetryUpdate)):
+        response = button_key.fire(**kwargs)
+        profiler.record_handler(button_key, started, "fired")
+    elif button_pressed:
         response = button_key.pressed(**kwargs)
+        profiler.record_handler(button_key, started, "pressed")
         if button_key.description:
-            print button_key.description
+            print(button_key.description)
             say(button_key.description)
     else:
         response = button_key.released(**kwargs)
+        profiler.record_handler(button_key, started, "released")
 
     return response
 
 
-def write_changes(launchpad, new_buffer, old_buffer):
-    for index in range(0, len(new_buffer)):
-        if new_buffer[index] != old_buffer[index]:
-            if index > 120:  # Automap buttons
-                launchpad.midi.RawWrite(176, 104 + (index - 121), new_buffer[index])
-            else:
-                launchpad.midi.RawWrite(144, index, new_buffer[index])
-
-            old_buffer[index] = new_buffer[index]
-
-
-def main():
-    launchpad = Launchpad()  # create a Launchpad instance
-    launchpad.Open()         # start it
-    launchpad_buffer = [0 for _ in range(200)]    # LED color map
-    launchpad_buffer_cache = [0 for _ in range(200)]    # LED color map
-
-    # Reset the launchpad
-    launchpad.midi.RawWrite(176, 0, 0)
-
-    # Set X/Y Mode
-    launchpad.midi.RawWrite(176, 0, 1)
-
-    # Turn Flashing on
-    launchpad.midi.RawWrite(176, 0, 40)
-
-    # Control Duty cycle
-    # numerator = 16
-    # denominator = 4
-    # if numerator < 9:
-    #     value = (16 * (numerator - 1)) + (denominator - 3)
-    #     launchpad.midi.RawWrite(176, 30, value)
-    # else:
-    #     value = (16 * (numerator - 9)) + (denominator - 3)
-    #     launchpad.midi.RawWrite(176, 31, value)
+def main(launchpad=None, arduino=None, histogram=None, profiler=None, devices=None, recorder=None,
+         animation_rate=ANIMATION_FRAME_RATE, telemetry=None):
+    """
+    Run the mapper.  The launchpad and arduino are opened here unless stand-ins are passed in.
+    devices (devices.DeviceRegistry) lists the launchpads and boards to use instead.
+    This thread runs the button logic.  Input is read and the LEDs and keys are written on
+    the pipeline threads (see pipeline.py for who owns what).
+    histogram collects the time from reading a button event to dispatching it.
+    profiler (instrumentation.Profiler) times each stage of the main loop when given.
+    recorder (session_log.SessionRecorder) logs the session when given.
+    animation_rate is the LED animation frames per second, up to the display refresh rate.
+    telemetry (telemetry.Telemetry) shows the game status on the buttons when given.
+    Returns the run statistics: frames, frames_drawn and duration (seconds).
+    """
+    if histogram is None:
+        histogram = LatencyHistogram("event dispatch")
+    if profiler is None:
+        profiler = NullProfiler()
+    if devices is None:
+        devices = DeviceRegistry()
+        devices.add_launchpad(DEFAULT_LAUNCHPAD, launchpad if launchpad is not None else Launchpad(), trade=True)
+        if arduino is not None:
+            devices.add_board(DEFAULT_BOARD, arduino)
+
+    surfaces = list()
+    serial_writers = list()
+    stats = {"frames": 0, "frames_drawn": 0, "duration": 0.0}
+    started = monotonic()
 
     try:
-        # Open communication to the Arduino
-        arduino = Arduino('COM6', 9600)
-
-        pad_states = list()
-
-        # Prepare the 9X9 array of buttons to the list
-        pad_states.append([[ButtonKey(x, y) for y in range(0, 9)] for x in range(0, 9)])
-        # Add another page
-        pad_states.append([[ButtonKey(x, y) for y in range(0, 9)] for x in range(0, 9)])
-
-        # Update the array with the buttons that are mapped
-        setup_ship(pad_states[0])
-        setup_trade(pad_states[1])
-
-        current_pad_state = pad_states[0]
+        for settings in devices.launchpads.values():
+            surface = Surface(settings, animation_rate)
+            surface.open()
+            surfaces.append(surface)
 
+        # Open communication to the Arduino
+        if not devices.boards:
+            devices.add_board(DEFAULT_BOARD, Arduino('COM6', BAUD_RATE))
+        devices.check()
+        for board_index, board in enumerate(devices.boards.values()):
+            if isinstance(profiler, Profiler):
+                # Count on the raw port, so only the serial writer thread counts
+                profiler.instrument(None, board)
+            if hasattr(board, "port"):
+                serial_writers.append(SerialWriter(board.port))
+                board.port = serial_writers[-1]
+                if recorder:
+                    board.port = RecordingPort(board.port, recorder, board_index)
+
+        # Prepare the pages of buttons, bound to their launchpad's board
+        for surface in surfaces:
+            surface.arduino = devices.board(surface.settings.board)
+            if isinstance(profiler, Profiler):
+                profiler.instrument(surface.launchpad, None)
+            surface.build()
+
+        # Every launchpad has its own reader thread.  The events are taken from them in turn.
+        input_multiplexer = InputMultiplexer([surface.reader for surface in surfaces])
+        if recorder:
+            recorder.start()
+        for serial_writer in serial_writers:
+            serial_writer.start()
+        for surface in surfaces:
+            surface.start()
+        if telemetry:
+            for surface in surfaces:
+                telemetry.subscribe(surface.post_telemetry)
+            telemetry.start()
         try:
+            started = next_frame = monotonic()
+            next_idle_release = next_frame + IDLE_RELEASE_INTERVAL
             while True:
-                # Update the display buffer
-                for button in chain(*current_pad_state):  # Flatten out the 2d array
-                    button.draw(launchpad_buffer_cache)
-
-                # Write the display buffer
-                write_changes(launchpad, launchpad_buffer_cache, launchpad_buffer)
-
-                # Check for button event
-                button_event = launchpad.ButtonStateXY()
-                if button_event:
-                    response = handle_event(launchpad=launchpad,
-                                            arduino=arduino,
-                                            button_key=current_pad_state[button_event[0]][button_event[1]],
-                                            button_pressed=button_event[2],
-                                            pad_states=pad_states,
-                                            current_pad_state=current_pad_state)
-                    # Was there a state change
-                    if response and "state" in response:
-                        current_pad_state = response.get("state")
-
-                    continue
-
-                time.sleep(.1)
-
-                arduino.key_release(0x00)  # Release all keys
-
-        except ShutdownException, _ex:
+                profiler.begin()
+                now = monotonic()
+                if now >= next_frame:
+                    # Swap in any pages rebuilt from an edited profile
+                    for surface in surfaces:
+                        surface.swap_pages()
+                    profiler.mark(SWAP)
+
+                    # Redraw the buttons that changed and hand the frames to the LED writers
+                    stats["frames"] += 1
+                    drawn = [surface for surface in surfaces if surface.render()]
+                    profiler.mark(RENDER)
+                    if drawn:
+                        stats["frames_drawn"] += 1
+                        for surface in drawn:
+                            surface.post_frame()
+                        profiler.mark(WRITE_LEDS)
+                    next_frame = now + FRAME_INTERVAL
+                    profiler.tick()
+
+                if now >= next_idle_release:
+                    for board in devices.boards.values():
+                        board.reconcile()  # Release keys stuck down on the board
+                    next_idle_release = now + IDLE_RELEASE_INTERVAL
+                    profiler.mark(IDLE_RELEASE)
+
+                # Wait for a button event until the next scheduled frame or release
+                event = input_multiplexer.get_event(min(next_frame, next_idle_release) - monotonic())
+                profiler.mark(WAIT)
+                if event:
+                    index, (button_event, event_time) = event
+                    surface = surfaces[index]
+                    if isinstance(button_event, (GestureTimer, TelemetryUpdate)):
+                        button_key, button_pressed, cell = button_event, True, NO_PAGE
+                        if recorder and isinstance(button_event, TelemetryUpdate):
+                            recorder.telemetry(index, button_event.status, button_event.events, event_time)
+                    else:
+                        button_pressed = button_event[2]
+                        cell = CELL_INDEX[button_event[0]][button_event[1]]
+                        button_key = surface.button_for(cell, button_pressed)
+                        if recorder:
+                            recorder.event(index, button_event[0], button_event[1], button_pressed, event_time)
+                    histogram.record(monotonic() - event_time)
+                    with surface.arduino.batch():  # Send every key the event produces in one write
+                        response = handle_event(launchpad=surface.launchpad,
+                                                arduino=surface.arduino,
+                                                button_key=button_key,
+                                                button_pressed=button_pressed,
+                                                pad_states=surface.pad_states,
+                                                current_pad_state=surface.current_pad_state,
+                                                profiler=profiler,
+                                                timers=surface.timers,
+                                                animator=surface.animator)
+                        profiler.mark(HANDLE_EVENT)
+                    profiler.mark(SERIAL_FLUSH)
+                    # Was there a page change
+                    if response:
+                        surface.navigate(response)
+                        if recorder:
+                            recorder.response(index, cell, response)
+                            recorder.page(index, surface.page_number())
+
+                    # Show the result of the press right away
+                    next_frame = monotonic()
+                    next_idle_release = next_frame + IDLE_RELEASE_INTERVAL
+
+        except ShutdownException as _ex:
             pass
-        except Exception, ex:
-            print ex
+        except Exception as ex:
+            print(ex)
 
     finally:
-        launchpad.Reset()
-        launchpad.Close()
+        stats["duration"] = monotonic() - started
+        if telemetry:
+            telemetry.stop()
+        for surface in surfaces:
+            surface.stop()
+        async_runtime.stop()
+        for serial_writer in serial_writers:
+            serial_writer.stop()
+        for board in devices.boards.values():
+            board.close()
+        if recorder:
+            recorder.stop()
+        for surface in surfaces:
+            surface.close()
+        if histogram.count:
+            print(histogram.summary())
+        report = profiler.report()
+        if report:
+            print(report)
+
+    return stats
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Map the Novation Launchpad buttons to USB keystrokes")
+    parser.add_argument("--devices", metavar="FILE",
+                        help="devices file listing the launchpads and boards to use (see devices.py)")
+    parser.add_argument("--output", choices=("arduino", "uinput"), default="arduino",
+                        help="send the keys through the Arduino (default) or a local uinput keyboard (Linux)")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each stage of the main loop.  Dump with SIGUSR1 (Ctrl+Break on Windows)")
+    parser.add_argument("--profile-summary", type=float, metavar="SECONDS",
+                        help="print the profile every SECONDS")
+    parser.add_argument("--profile-port", type=int, metavar="PORT",
+                        help="send the profile to connections on localhost:PORT")
+    parser.add_argument("--record", metavar="FILE",
+                        help="append the session to a log file (see session_log.py and replay.py)")
+    parser.add_argument("--animation-rate", type=float, default=ANIMATION_FRAME_RATE, metavar="FPS",
+                        help="LED animation frames per second, up to %d.  Default %d" %
+                             (round(1 / FRAME_INTERVAL), ANIMATION_FRAME_RATE))
+    parser.add_argument("--telemetry", nargs="?", const="", metavar="DIR",
+                        help="show the game status on the buttons, from the journal directory DIR.  "
+                             "Default the game's directory in Saved Games")
+    args = parser.parse_args()
+    if not 0 < args.animation_rate <= round(1 / FRAME_INTERVAL):
+        parser.error("--animation-rate must be more than 0 and at most %d" % round(1 / FRAME_INTERVAL))
+
+    device_registry = None
+    output = None
+    try:
+        if args.devices:
+            device_registry = load_devices(args.devices, Launchpad, lambda port: Arduino(port, BAUD_RATE),
+                                           UinputKeyboard)
+        elif args.output == "uinput":
+            output = UinputKeyboard()
+    except (DeviceError, IOError, OSError) as ex:
+        parser.error(str(ex))
+
+    loop_profiler = None
+    if args.profile or args.profile_summary or args.profile_port:
+        loop_profiler = Profiler(summary_interval=args.profile_summary)
+        loop_profiler.install_signal_handler()
+        if args.profile_port:
+            loop_profiler.serve(args.profile_port)
+
+    session_recorder = SessionRecorder(args.record) if args.record else None
+    game_telemetry = Telemetry(args.telemetry) if args.telemetry is not None else None
+    main(arduino=output, profiler=loop_profiler, devices=device_registry, recorder=session_recorder,
+         animation_rate=args.animation_rate, telemetry=game_telemetry)
@@ -0,0 +1,104 @@
+"""
+macros.py
+Compiles key macros into the op list the Arduino plays back.
+
+A macro is a list of steps:
+  "v", "F9", "0x76"         Tap the key: press, hold, release
+  "LEFT_SHIFT+TAB"          Chord: press the keys in order, hold, release them in reverse order
+  {"down": "LEFT_SHIFT"}    Press a key and leave it down
+  {"up": "LEFT_SHIFT"}      Release a key
+  {"wait": .5}              Pause, in seconds
+
+Steps are separated by a short gap so the game sees each one.  Keys still down at the end are released.
+The compiled list is sent to the board in one batch and the pauses are timed on the board,
+so playback timing does not depend on the host.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from arduino import OP_PRESS, OP_RELEASE, OP_DELAY, MAX_DELAY_MS, TAP_HOLD
+from key_codes import key_code
+
+STEP_GAP = .03      # Seconds between steps
+
+try:
+    string_types = basestring
+except NameError:  # Python 3
+    string_types = str
+
+
+def delay_ops(seconds):
+    """
+    Returns the delay ops for a pause of seconds.  Long pauses take more than one op.
+    """
+    ops = []
+    remaining = int(round(seconds * 1000))
+    while remaining > 0:
+        step = min(remaining, MAX_DELAY_MS)
+        ops.append((OP_DELAY, step))
+        remaining -= step
+    return ops
+
+
+def _chord_keys(step):
+    if len(step) > 1 and "+" in step:
+        return [key_code(name) for name in step.split("+")]
+    return [key_code(step)]
+
+
+def compile_macro(steps, hold=TAP_HOLD, gap=STEP_GAP):
+    """
+    Compile macro steps into a tuple of (op, key) pairs.  Raises ValueError for a bad step.
+    """
+    if not isinstance(steps, (list, tuple)) or not steps:
+        raise ValueError("A macro is a list of steps")
+
+    ops = []
+    down = []
+    for number, step in enumerate(steps):
+        if number:
+            ops.extend(delay_ops(gap))
+        if isinstance(step, dict):
+            if len(step) != 1:
+                raise ValueError("Step %d: expected one of down, up or wait" % number)
+            (action, value), = step.items()
+            if action == "wait":
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                    raise ValueError("Step %d: wait must be a positive number of seconds" % number)
+                ops.extend(delay_ops(value))
+            elif action == "down":
+                key = key_code(value)
+                ops.append((OP_PRESS, key))
+                if key not in down:
+                    down.append(key)
+            elif action == "up":
+                key = key_code(value)
+                ops.append((OP_RELEASE, key))
+                if key in down:
+                    down.remove(key)
+            else:
+                raise ValueError("Step %d: unknown action %r" % (number, action))
+        elif isinstance(step, string_types) or (not isinstance(step, bool) and isinstance(step, int)):
+            keys = _chord_keys(step) if isinstance(step, string_types) else [key_code(step)]
+            ops.extend((OP_PRESS, key) for key in keys)
+            ops.extend(delay_ops(hold))
+            ops.extend((OP_RELEASE, key) for key in reversed(keys))
+            down = [key for key in down if key not in keys]
+        else:
+            raise ValueError("Step %d: expected a key or an object, got %r" % (number, step))
+
+    ops.extend((OP_RELEASE, key) for key in reversed(down))
+    return tuple(ops)
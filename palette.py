@@ -0,0 +1,52 @@
+"""
+palette.py
+Precomputed LED colors for the Launchpad S.
+
+Every red (0-3), green (0-3) and flashing combination is looked up once here so the
+buttons can keep ready to send velocities instead of working them out every frame.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Velocity flag bits
+VELOCITY_COPY = 4       # Write the LED to both buffers
+VELOCITY_CLEAR = 8      # Clear the LED in the other buffer
+VELOCITY_FLAGS = VELOCITY_COPY | VELOCITY_CLEAR
+
+NORMAL = VELOCITY_COPY | VELOCITY_CLEAR     # Steady LED
+FLASHING = VELOCITY_CLEAR                   # Lit in one buffer only.  Flashes while flashing is on.
+
+
+def palette_index(red, green, flashing=False):
+    """
+    Returns the PALETTE index for a color
+    """
+    return red + 4 * green + (16 if flashing else 0)
+
+
+# Velocity for each palette index
+PALETTE = tuple(red + 16 * green + (FLASHING if flashing else NORMAL)
+                for flashing in (False, True) for green in range(4) for red in range(4))
+
+
+def color(red, green, flashing=False):
+    """
+    Returns the LED velocity for the red and green intensities (0-3)
+    """
+    return PALETTE[palette_index(red, green, flashing)]
+
+
+OFF = color(0, 0)
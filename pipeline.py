@@ -0,0 +1,301 @@
+"""
+pipeline.py
+Threads that keep launchpad input apart from the slow MIDI and serial output.
+
+  MidiReader  -> event queue -> logic thread (main loop) -> LedWriter   -> launchpad
+                                                         -> SerialWriter -> arduino
+
+Ownership:
+ - The logic thread owns the pages and their buttons and the draw buffer.  Buttons are only
+   pressed, released and drawn there.  Other threads may only call ButtonKey.mark_dirty.
+ - The logic thread hands the LedWriter a copy of the draw buffer.  A posted frame is never
+   changed again.  The LedWriter owns the buffer of what the launchpad is showing.
+ - Serial data is handed to the SerialWriter as bytes, in the order the Arduino object wrote it.
+ - Input events and errors are handed to the logic thread through the event queue.
+   So are the gesture timers that close (see gestures.py).
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import deque
+from threading import Thread, Condition, Event
+from time import sleep
+from frame_buffer import FrameBuffer
+from latency import monotonic
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+
+class MidiReader(object):
+    """
+    MidiReader: Reads button events on its own thread and queues them for the logic thread.
+
+    Initialization parameters:
+    input_engine - InputEngine polling the launchpad
+    poll_timeout - Seconds each wait for input runs before checking for stop.  Default .05
+    """
+
+    def __init__(self, input_engine, poll_timeout=.05):
+        self.input_engine = input_engine
+        self.poll_timeout = poll_timeout
+        self.events = Queue()
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        self.input_engine.start()
+        self._thread = Thread(target=self._run, name="midi reader")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.input_engine.stop()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                event = self.input_engine.wait_event(self.poll_timeout)
+                if event:
+                    self.events.put(event)
+        except Exception as ex:
+            # Launchpad errors (and the ShutdownException of stand-ins) end the logic thread too
+            self.events.put(ex)
+
+    def post(self, event):
+        """
+        Queue an event for the logic thread from another thread, such as a closed gesture window
+        """
+        self.events.put(event)
+
+    def poll(self):
+        """
+        Returns the next queued (button_event, timestamp) or None.  Raises any exception the reader hit.
+        """
+        try:
+            event = self.events.get_nowait()
+        except Empty:
+            return None
+        if isinstance(event, Exception):
+            raise event
+        return event
+
+    def get_event(self, timeout):
+        """
+        Wait up to timeout seconds for a button event.
+        Returns (button_event, timestamp) or None.  Raises any exception the reader hit.
+
+        Polls like the InputEngine does: a Queue.get with a timeout sleeps in steps of up to 50ms on Python 2.
+        """
+        deadline = monotonic() + max(timeout, 0)
+        while True:
+            event = self.poll()
+            if event:
+                return event
+            now = monotonic()
+            if now >= deadline:
+                return None
+            sleep(min(self.input_engine.poll_interval, deadline - now))
+
+
+class InputMultiplexer(object):
+    """
+    InputMultiplexer: Takes the events of several MidiReaders in turn.
+
+    Every launchpad has its own reader thread and queue, so a busy one doesn't hold up the others.
+    The queues are visited round robin, one event at a time.
+
+    Initialization parameters:
+    readers - List of MidiReader objects
+    poll_interval - Seconds between checks of the queues while waiting.  Default .001
+    """
+
+    def __init__(self, readers, poll_interval=.001):
+        self.readers = list(readers)
+        self.poll_interval = poll_interval
+        self._next = 0
+
+    def get_event(self, timeout):
+        """
+        Wait up to timeout seconds for a button event from any reader.
+        Returns (reader index, (button_event, timestamp)) or None.  Raises any exception a reader hit.
+        """
+        deadline = monotonic() + max(timeout, 0)
+        count = len(self.readers)
+        while True:
+            for offset in range(count):
+                index = (self._next + offset) % count
+                event = self.readers[index].poll()
+                if event:
+                    self._next = (index + 1) % count
+                    return index, event
+            now = monotonic()
+            if now >= deadline:
+                return None
+            sleep(min(self.poll_interval, deadline - now))
+
+
+class LedWriter(object):
+    """
+    LedWriter: Sends frames to the launchpad on its own thread.
+
+    Only the newest posted frame is kept.  When the launchpad can't keep up the frames in between
+    are skipped, and what the launchpad shows still ends up matching the last frame.
+
+    Initialization parameters:
+    display - LaunchpadDisplay sending the changes
+    shown - FrameBuffer of what the launchpad is showing.  Owned by the writer once started.
+    """
+
+    def __init__(self, display, shown=None):
+        self.display = display
+        self.shown = shown if shown is not None else FrameBuffer()
+        self.frames_written = 0
+        self.frames_skipped = 0
+        self._frame = None
+        self._stopping = False
+        self._busy = False
+        self._condition = Condition()
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="led writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write the last posted frame and stop the thread
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+
+    def post(self, frame):
+        """
+        Queue a frame (FrameBuffer) to be shown.  The caller must not change it afterwards.
+        """
+        with self._condition:
+            if self._frame is not None:
+                self.frames_skipped += 1
+            self._frame = frame
+            self._condition.notify()
+
+    def wait_idle(self):
+        with self._condition:
+            while self._frame is not None or self._busy:
+                self._condition.wait()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._frame is None and not self._stopping:
+                    self._condition.wait()
+                if self._frame is None:
+                    return
+                frame, self._frame = self._frame, None
+                self._busy = True
+            try:
+                self.display.write_changes(frame, self.shown)
+                self.frames_written += 1
+            except Exception as ex:
+                print(ex)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+
+class SerialWriter(object):
+    """
+    SerialWriter: Stands in for the serial port of the Arduino object and does the writes on its own thread.
+
+    Data written while the port is busy is joined into one write.  Once stopped, writes go straight
+    to the port so releases sent at exit still reach the board.
+
+    Initialization parameters:
+    port - The serial port (or a stand-in with write)
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self._pending = deque()
+        self._stopping = False
+        self._direct = False
+        self._busy = False
+        self._condition = Condition()
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="serial writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write everything queued and stop the thread
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+        with self._condition:
+            self._direct = True
+
+    def write(self, data):
+        with self._condition:
+            if not self._direct:
+                self._pending.append(bytes(data))
+                self._condition.notify()
+                return len(data)
+        return self.port.write(data)
+
+    def wait_idle(self):
+        with self._condition:
+            while self._pending or self._busy:
+                self._condition.wait()
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._pending:
+                    self._direct = True
+                    return
+                data = b"".join(self._pending)
+                self._pending.clear()
+                self._busy = True
+            try:
+                self.port.write(data)
+            except Exception as ex:
+                print(ex)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
@@ -0,0 +1,352 @@
+"""
+profile_loader.py
+Loads mapping profiles: JSON files describing the pages of buttons.
+
+A profile is validated and compiled into plain button specifications.  The compiled form
+is cached on disk keyed by the SHA-1 of the profile file, so an unchanged profile is
+not parsed or validated again at startup.
+
+Profile layout:
+{
+  "pages": [
+    {
+      "name": "ship",
+      "buttons": [
+        {"type": "InputButton", "x": 2, "y": 0, "red": 3, "green": 0, "pressed_red": 3,
+         "pressed_green": 3, "key_output": "v", "flashing": true, "description": "Heat Sink"},
+        ...
+      ],
+      "groups": [
+        {"type": "SystemsButtonGroup", "systems": [4, 5], "weapons": [6, 5], "engines": [5, 4], "reset": [5, 5]}
+      ]
+    }
+  ]
+}
+
+Keys may be given as a key name ("ESC", "F9", "UP_ARROW"), a single character ("v"),
+a hex string ("0x76") or a number.
+
+A MacroButton takes a "macro" list of steps (see macros.py), for example
+  {"type": "MacroButton", "x": 7, "y": 3, "macro": ["u", {"wait": 1.5}, "n"], "description": "Deploy and Cycle"}
+
+A GestureButton runs a different action for each gesture (see gestures.py).  An action is a key,
+a macro list, or a page change {"show": page}, {"push": page} or {"back": true}:
+  {"type": "GestureButton", "x": 3, "y": 0, "tap": "F9", "double_tap": ["F9", "F9"], "long_press": {"push": 1},
+   "long_press_time": .6, "description": "Chaff"}
+
+A ToggleButton with a "status_flag" (see telemetry.STATUS_FLAGS) follows that flag of the game status
+when telemetry is on, for example "status_flag": "LandingGear".  An InputButton with a "countdown"
+(seconds) shows it after a press, and stops it early at any of its "countdown_events" from the journal.
+
+A PadPageButton with "action": "push" opens its page on top of the current one, and one with
+"action": "back" goes back to the page it was opened from.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+from button_types import (ButtonKey, InputButton, ToggleButton, PadPageButton, FlashingButton, ShutdownButton,
+                          MacroButton, PAGE_ACTIONS)
+from systems_button_group import SystemsButtonGroup
+from telemetry import STATUS_FLAGS
+from gestures import GestureButton
+from key_codes import key_code
+from macros import compile_macro, string_types
+
+CACHE_VERSION = 2     # Bump whenever the compiled form or the checks change without a change to the fields below
+CACHE_DIRECTORY = ".cache"   # Created next to the profile
+
+COLOR_FIELDS = ("red", "green", "pressed_red", "pressed_green", "toggled_red", "toggled_green")
+KEY_FIELDS = ("key_output", "key_output_set", "key_output_cleared")
+GESTURE_FIELDS = ("tap", "double_tap", "long_press", "hold_repeat")
+TIME_FIELDS = ("key_duration", "long_press_time", "double_tap_time", "repeat_interval", "countdown")
+PAGE_CHANGES = ("show", "push", "back")
+
+# Fields each button type accepts (besides type, x and y)
+BUTTON_TYPES = {
+    "ButtonKey": (ButtonKey, ("description",)),
+    "ShutdownButton": (ShutdownButton, ("description",)),
+    "FlashingButton": (FlashingButton, ("description",)),
+    "PadPageButton": (PadPageButton, ("red", "green", "page", "action", "description")),
+    "InputButton": (InputButton, ("red", "green", "pressed_red", "pressed_green", "key_output",
+                                  "flashing", "countdown", "countdown_events", "description")),
+    "ToggleButton": (ToggleButton, ("red", "green", "toggled_red", "toggled_green", "key_output_set",
+                                    "key_output_cleared", "flashing", "key_duration", "status_flag",
+                                    "description")),
+    "MacroButton": (MacroButton, ("red", "green", "pressed_red", "pressed_green", "macro", "description")),
+    "GestureButton": (GestureButton, ("red", "green", "pressed_red", "pressed_green", "tap", "double_tap",
+                                      "long_press", "hold_repeat", "long_press_time", "double_tap_time",
+                                      "repeat_interval", "description")),
+}
+
+# Roles each group type needs, in constructor keyword form
+GROUP_TYPES = {
+    "SystemsButtonGroup": (SystemsButtonGroup, InputButton, {"systems": "systems_button",
+                                                             "weapons": "weapons_button",
+                                                             "engines": "engines_button",
+                                                             "reset": "reset_button"}),
+}
+
+
+def _loader_key():
+    """
+    Returns a short digest of CACHE_VERSION and the fields the loader accepts.  Part of the cache file name,
+    so a profile compiled by a loader with other fields or checks is compiled again.
+    """
+    schema = (CACHE_VERSION,
+              sorted((name, fields) for name, (_, fields) in BUTTON_TYPES.items()),
+              sorted((name, member_class.__name__, sorted(roles.items()))
+                     for name, (_, member_class, roles) in GROUP_TYPES.items()),
+              COLOR_FIELDS, KEY_FIELDS, GESTURE_FIELDS, TIME_FIELDS, PAGE_CHANGES, PAGE_ACTIONS,
+              sorted(STATUS_FLAGS.items()))
+    return hashlib.sha1(repr(schema).encode("utf-8")).hexdigest()[:12]
+
+
+class ProfileError(Exception):
+    """
+    ProfileError: Raised when a profile does not describe a valid mapping.
+    """
+    pass
+
+
+def _position(value, where):
+    if not isinstance(value, list) or len(value) != 2:
+        raise ProfileError("%s: expected [x, y]" % where)
+    x, y = value
+    _check_coordinate(x, "%s x" % where)
+    _check_coordinate(y, "%s y" % where)
+    return x, y
+
+
+def _check_coordinate(value, where):
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= 8:
+        raise ProfileError("%s: must be 0-8, got %r" % (where, value))
+
+
+def _compile_action(value, where):
+    if isinstance(value, list):
+        try:
+            return "macro", compile_macro(value)
+        except (ValueError, TypeError) as ex:
+            raise ProfileError("%s: %s" % (where, ex))
+    if isinstance(value, dict):
+        if len(value) != 1 or list(value)[0] not in PAGE_CHANGES:
+            raise ProfileError("%s: expected one of %s" % (where, ", ".join(PAGE_CHANGES)))
+        (change, page), = value.items()
+        if change == "back":
+            if page is not True:
+                raise ProfileError("%s back: must be true" % where)
+            return "back", None
+        if isinstance(page, bool) or not isinstance(page, int) or page < 0:
+            raise ProfileError("%s %s: must be a page number, got %r" % (where, change, page))
+        return str(change), page
+    try:
+        return "key", key_code(value)
+    except (ValueError, TypeError) as ex:
+        raise ProfileError("%s: %s" % (where, ex))
+
+
+def _compile_button(button, where):
+    if not isinstance(button, dict):
+        raise ProfileError("%s: expected an object" % where)
+    type_name = button.get("type")
+    if type_name not in BUTTON_TYPES:
+        raise ProfileError("%s: unknown button type %r" % (where, type_name))
+    _, fields = BUTTON_TYPES[type_name]
+    _check_coordinate(button.get("x"), "%s x" % where)
+    _check_coordinate(button.get("y"), "%s y" % where)
+
+    kwargs = {}
+    for name, value in button.items():
+        if name in ("type", "x", "y"):
+            continue
+        if name not in fields:
+            raise ProfileError("%s: %s does not take %r" % (where, type_name, name))
+        if name in COLOR_FIELDS:
+            if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= 3:
+                raise ProfileError("%s %s: must be 0-3, got %r" % (where, name, value))
+        elif name in KEY_FIELDS:
+            if value is not None:
+                try:
+                    value = key_code(value)
+                except (ValueError, TypeError) as ex:
+                    raise ProfileError("%s %s: %s" % (where, name, ex))
+        elif name == "countdown_events":
+            if not isinstance(value, list) or not all(isinstance(event, string_types) for event in value):
+                raise ProfileError("%s countdown_events: must be a list of journal event names" % where)
+            value = [str(event) for event in value]
+        elif name == "status_flag":
+            if value is not None and value not in STATUS_FLAGS:
+                raise ProfileError("%s status_flag: expected one of %s, got %r" %
+                                   (where, ", ".join(sorted(STATUS_FLAGS)), value))
+        elif name == "flashing":
+            if not isinstance(value, bool):
+                raise ProfileError("%s flashing: must be true or false" % where)
+        elif name in TIME_FIELDS:
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ProfileError("%s %s: must be a positive number of seconds" % (where, name))
+            if name == "repeat_interval" and not value:
+                raise ProfileError("%s repeat_interval: must be more than 0" % where)
+        elif name in GESTURE_FIELDS:
+            if value is not None:
+                value = _compile_action(value, "%s %s" % (where, name))
+        elif name == "macro":
+            try:
+                value = compile_macro(value)
+            except (ValueError, TypeError) as ex:
+                raise ProfileError("%s macro: %s" % (where, ex))
+        elif name == "page":
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                raise ProfileError("%s page: must be a page number, got %r" % (where, value))
+        elif name == "action":
+            if value not in PAGE_ACTIONS:
+                raise ProfileError("%s action: must be one of %s, got %r" % (where, ", ".join(PAGE_ACTIONS), value))
+        kwargs[str(name)] = value
+    return str(type_name), button["x"], button["y"], kwargs
+
+
+def _compile_group(group, where, button_types):
+    if not isinstance(group, dict):
+        raise ProfileError("%s: expected an object" % where)
+    type_name = group.get("type")
+    if type_name not in GROUP_TYPES:
+        raise ProfileError("%s: unknown group type %r" % (where, type_name))
+    _, member_class, roles = GROUP_TYPES[type_name]
+
+    members = {}
+    for role, keyword in roles.items():
+        if role not in group:
+            raise ProfileError("%s: %s needs %r" % (where, type_name, role))
+        position = _position(group[role], "%s %s" % (where, role))
+        button_type = button_types.get(position)
+        if button_type is None or not issubclass(BUTTON_TYPES[button_type][0], member_class):
+            raise ProfileError("%s %s: no %s at %r" % (where, role, member_class.__name__, list(position)))
+        members[keyword] = position
+    unknown = set(group) - set(roles) - set(["type"])
+    if unknown:
+        raise ProfileError("%s: %s does not take %s" % (where, type_name, ", ".join(sorted(unknown))))
+    return str(type_name), members
+
+
+def compile_profile(profile, name="profile"):
+    """
+    Validate a parsed profile and return its compiled pages.
+    Each page is a dict with "name", "buttons" [(type, x, y, kwargs)] and "groups" [(type, {keyword: (x, y)})].
+    """
+    if not isinstance(profile, dict) or not isinstance(profile.get("pages"), list) or not profile["pages"]:
+        raise ProfileError("%s: expected {\"pages\": [...]}" % name)
+
+    pages = []
+    for page_number, page in enumerate(profile["pages"]):
+        where = "%s page %d" % (name, page_number)
+        if not isinstance(page, dict):
+            raise ProfileError("%s: expected an object" % where)
+
+        buttons = []
+        button_types = {}
+        for button_number, button in enumerate(page.get("buttons", [])):
+            compiled = _compile_button(button, "%s button %d" % (where, button_number))
+            position = (compiled[1], compiled[2])
+            if position in button_types:
+                raise ProfileError("%s button %d: %r is already mapped" % (where, button_number, list(position)))
+            button_types[position] = compiled[0]
+            buttons.append(compiled)
+
+        groups = [_compile_group(group, "%s group %d" % (where, group_number), button_types)
+                  for group_number, group in enumerate(page.get("groups", []))]
+
+        pages.append({"name": str(page.get("name", page_number)), "buttons": buttons, "groups": groups})
+    return pages
+
+
+def check_page_numbers(pages, page_count, name="profile"):
+    """
+    Raise ProfileError if a button of the compiled pages goes to a page number of page_count or more.
+    page_count counts the profile's pages and the built in ones (like the trade page).
+    """
+    for page_number, page in enumerate(pages):
+        for button_number, (type_name, _, _, kwargs) in enumerate(page["buttons"]):
+            where = "%s page %d button %d" % (name, page_number, button_number)
+            targets = [("page", kwargs["page"])] if "page" in kwargs and kwargs.get("action") != "back" else []
+            targets.extend((field, kwargs[field][1]) for field in GESTURE_FIELDS
+                           if kwargs.get(field) and kwargs[field][0] in ("show", "push"))
+            for field, target in targets:
+                if target >= page_count:
+                    raise ProfileError("%s %s: page %d does not exist (%d pages)" %
+                                       (where, field, target, page_count))
+
+
+def load_profile(path, use_cache=True):
+    """
+    Returns the compiled pages of the profile at path, from the cache when the file is unchanged
+    """
+    with open(path, "rb") as profile_file:
+        data = profile_file.read()
+    digest = hashlib.sha1(data).hexdigest()
+
+    cache_directory = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIRECTORY)
+    cache_prefix = os.path.basename(path) + "."
+    cache_path = os.path.join(cache_directory, "%s%s.%s.pickle" % (cache_prefix, digest, LOADER_KEY))
+
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as cache_file:
+                return pickle.load(cache_file)
+        except Exception as ex:
+            print("Ignoring profile cache %s: %s" % (cache_path, ex))
+
+    try:
+        profile = json.loads(data.decode("utf-8"))
+    except ValueError as ex:
+        raise ProfileError("%s: %s" % (path, ex))
+    pages = compile_profile(profile, name=os.path.basename(path))
+
+    if use_cache:
+        try:
+            if not os.path.isdir(cache_directory):
+                os.makedirs(cache_directory)
+            # Drop caches of older versions of this profile
+            for old_cache in os.listdir(cache_directory):
+                if old_cache.startswith(cache_prefix):
+                    os.remove(os.path.join(cache_directory, old_cache))
+            with open(cache_path, "wb") as cache_file:
+                pickle.dump(pages, cache_file, 2)
+        except (IOError, OSError) as ex:
+            print("Unable to write profile cache %s: %s" % (cache_path, ex))
+    return pages
+
+
+LOADER_KEY = _loader_key()
+
+
+def build_page(page, pad_state):
+    """
+    Create the buttons and groups of a compiled page in the pad_state page.
+    Returns the groups that were created.
+    """
+    for type_name, x, y, kwargs in page["buttons"]:
+        button_class = BUTTON_TYPES[type_name][0]
+        pad_state[x][y] = button_class(x, y, **kwargs)
+
+    groups = []
+    for type_name, members in page["groups"]:
+        group_class = GROUP_TYPES[type_name][0]
+        # Callback mappings will keep the group from being garbage collected
+        groups.append(group_class(**dict((keyword, pad_state[x][y]) for keyword, (x, y) in members.items())))
+    return groups
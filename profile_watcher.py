@@ -0,0 +1,164 @@
+"""
+profile_watcher.py
+Reloads a mapping profile while the mapper is running.
+
+A background thread watches the profile file.  When it changes the profile is compiled and
+only the pages whose description changed are rebuilt, still on the background thread.
+The main loop swaps the rebuilt pages in between frames, carrying over live button state.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+from threading import Thread, Event, Lock
+from button_types import Page
+from profile_loader import load_profile, build_page, check_page_numbers, ProfileError
+
+
+def new_pad_state():
+    """
+    Returns an empty page of buttons
+    """
+    return Page()
+
+
+class ProfileWatcher(object):
+    """
+    ProfileWatcher: Builds the pages of a profile and rebuilds them when the file changes.
+
+    Initialization parameters:
+    path - Profile file
+    first_page - Index in pad_states of the profile's first page.  Default 0
+    interval - Seconds between checks of the file.  Default .5
+
+    A reload can change pages but not add or remove them.  The pages after the profile's belong to others
+    (like the trade page).  Restart to change the number of pages.
+    """
+
+    def __init__(self, path, first_page=0, interval=.5):
+        self.path = path
+        self.first_page = first_page
+        self.interval = interval
+        self._pages = []            # Compiled pages currently in use
+        self._groups = {}           # pad_states index: groups built for that page
+        self._ready = []            # (pad_states index, pad_state, groups) waiting to be swapped in
+        self._lock = Lock()
+        self._stop = Event()
+        self._mtime = None
+        self._page_count = 0        # Pages in pad_states, the profile's and the built in ones
+        self._thread = None
+
+    def _modified_time(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def build(self, pad_states):
+        """
+        Build every page of the profile into pad_states.  Called once before the main loop.
+        """
+        self._mtime = self._modified_time()
+        self._pages = load_profile(self.path)
+        self._page_count = max(len(pad_states), self.first_page + len(self._pages))
+        check_page_numbers(self._pages, self._page_count, os.path.basename(self.path))
+        for number, page in enumerate(self._pages):
+            index = self.first_page + number
+            while len(pad_states) <= index:
+                pad_states.append(new_pad_state())
+            self._groups[index] = build_page(page, pad_states[index])
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="profile watcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            mtime = self._modified_time()
+            if mtime is not None and mtime != self._mtime:
+                self._mtime = mtime
+                self.reload()
+
+    def reload(self):
+        """
+        Compile the profile and build any page that changed.  The pages are swapped in by swap_pages.
+        """
+        try:
+            pages = load_profile(self.path)
+            check_page_numbers(pages, self._page_count, os.path.basename(self.path))
+        except (ProfileError, IOError, OSError) as ex:
+            print("Profile not reloaded: %s" % ex)
+            return
+        if len(pages) != len(self._pages):
+            print("Profile not reloaded: it has %d page(s) instead of %d.  Restart to add or remove pages." %
+                  (len(pages), len(self._pages)))
+            return
+
+        ready = []
+        for number, page in enumerate(pages):
+            if page == self._pages[number]:
+                continue
+            pad_state = new_pad_state()
+            groups = build_page(page, pad_state)
+            ready.append((self.first_page + number, pad_state, groups))
+        self._pages = pages
+
+        if ready:
+            print("Reloaded %s: %d page(s) changed" % (os.path.basename(self.path), len(ready)))
+            with self._lock:
+                self._ready.extend(ready)
+
+    def groups(self):
+        """
+        Returns the groups built for the pages in use
+        """
+        return [group for groups in self._groups.values() for group in groups]
+
+    def swap_pages(self, pad_states, current_pad_state, renderer=None, arduino=None, held=None):
+        """
+        Put rebuilt pages into pad_states.  Call between frames.
+        held ({cell: button pressed there}) is pointed at the rebuilt buttons of the same type, which took over
+        the pressed state.  Buttons replaced by another type keep getting their release.
+        Returns the page to show, which is the rebuilt page if the current one was replaced.
+        """
+        with self._lock:
+            if not self._ready:
+                return current_pad_state
+            ready, self._ready = self._ready, []
+
+        for index, pad_state, groups in ready:
+            old_pad_state = pad_states[index]
+            for new_button, old_button in zip(pad_state.cells, old_pad_state.cells):
+                new_button.adopt_state(old_button, arduino=arduino)
+            if held:
+                for cell, button in list(held.items()):
+                    if button is old_pad_state.cells[cell] and type(pad_state.cells[cell]) is type(button):
+                        held[cell] = pad_state.cells[cell]
+            for new_group, old_group in zip(groups, self._groups.get(index, [])):
+                if type(new_group) is type(old_group):
+                    new_group.adopt_state(old_group)
+            pad_states[index] = pad_state
+            self._groups[index] = groups
+
+            if renderer:
+                renderer.replace_page(old_pad_state, pad_state)
+            if old_pad_state is current_pad_state:
+                current_pad_state = pad_state
+        return current_pad_state
@@ -0,0 +1,175 @@
+"""
+render.py
+Retained mode renderer.  Only buttons that have changed since the last frame are drawn.
+
+Every page has its own LED frame that is kept up to date while the page is hidden, so showing
+a page is a copy of its frame into the draw buffer.  The LED writer then only sends the cells
+that differ from what the launchpad is showing.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from threading import Lock
+from frame_buffer import FrameBuffer
+from latency import monotonic
+from palette import OFF
+
+
+class PageFrame(object):
+    """
+    PageFrame: A page of buttons and the LED frame drawn from them.
+
+    Initialization parameters:
+    page - button_types.Page
+    lock - Lock guarding the dirty set.  Shared by the pages of a renderer.
+    """
+
+    def __init__(self, page, lock):
+        self.page = page
+        self.frame = FrameBuffer()
+        self.frame.fill(OFF)    # Empty cells are never drawn
+        self.buttons = page.buttons()
+        self._lock = lock
+        self._dirty = set()
+
+    def attach(self):
+        for button in self.buttons:
+            button.attach(self)
+        with self._lock:
+            self._dirty = set(self.buttons)
+
+    def detach(self):
+        for button in self.buttons:
+            button.attach(None)
+        with self._lock:
+            self._dirty = set()
+
+    def mark_dirty(self, button):
+        with self._lock:
+            self._dirty.add(button)
+
+    def render(self):
+        """
+        Draw the dirty buttons into the page frame.  Returns True if anything was drawn.
+        """
+        with self._lock:
+            if not self._dirty:
+                return False
+            dirty, self._dirty = self._dirty, set()
+        for button in dirty:
+            button.draw(self.frame)
+        return True
+
+
+class Renderer(object):
+    """
+    Renderer: Keeps the frames of the pages and the stack of pages navigated through.
+
+    Buttons report changes through ButtonKey.mark_dirty to the frame of their page, shown or not.
+
+    Initialization parameters:
+    draw_buffer - The raw drawing array for the launchpad
+    animator - animations.Animator drawing over the shown page.  Default None
+    """
+
+    def __init__(self, draw_buffer, animator=None):
+        self.draw_buffer = draw_buffer
+        self.animator = animator
+        self.page = None
+        self.stack = []         # Pages navigated through.  The shown page is last.
+        self._frames = {}       # id(page): PageFrame
+        self._lock = Lock()     # Threaded buttons mark themselves dirty when they finish
+        self._switched = False
+
+    def add_page(self, page):
+        """
+        Keep a frame for a page (button_types.Page) from now on
+        """
+        if id(page) not in self._frames:
+            page_frame = PageFrame(page, self._lock)
+            self._frames[id(page)] = page_frame
+            page_frame.attach()
+        return self._frames[id(page)]
+
+    def remove_page(self, page):
+        page_frame = self._frames.pop(id(page), None)
+        if page_frame:
+            page_frame.detach()
+
+    def replace_page(self, old_page, new_page):
+        """
+        Put new_page in the place of old_page, in the stack too.  Returns the page being shown.
+        """
+        self.remove_page(old_page)
+        self.add_page(new_page)
+        self.stack = [new_page if page is old_page else page for page in self.stack]
+        if self.page is old_page:
+            self._show(new_page)
+        return self.page
+
+    def _show(self, page):
+        self.add_page(page)
+        self.page = page
+        self._switched = True
+
+    def show_page(self, page):
+        """
+        Show a page in place of the one on top of the stack
+        """
+        if self.stack:
+            self.stack[-1] = page
+        else:
+            self.stack.append(page)
+        self._show(page)
+        return page
+
+    def push_page(self, page):
+        """
+        Show a page.  pop_page goes back to the one shown now.
+        """
+        self.stack.append(page)
+        self._show(page)
+        return page
+
+    def pop_page(self):
+        """
+        Go back to the page shown before the last push.  Returns the page being shown.
+        """
+        if len(self.stack) > 1:
+            self.stack.pop()
+            self._show(self.stack[-1])
+        return self.page
+
+    def render(self):
+        """
+        Bring the page frames up to date and copy the shown one into the draw buffer, then draw the
+        animations over it.  Returns True if the draw buffer changed.
+        """
+        shown_changed = self._switched
+        for page_frame in list(self._frames.values()):
+            if page_frame.render() and page_frame.page is self.page:
+                shown_changed = True
+        if self.page is None:
+            return False
+        shown = self._frames[id(self.page)].frame
+        if shown_changed:
+            self._switched = False
+            self.draw_buffer.blit(shown)
+        if self.animator is not None:
+            # A blit covered the animated cells, so they are all drawn again
+            if self.animator.render(self.draw_buffer, shown, self.page, monotonic(), repaint=shown_changed):
+                shown_changed = True
+        return shown_changed
@@ -0,0 +1,172 @@
+"""
+replay.py
+Plays a recorded session log back through the mapper against simulated devices and compares the output.
+
+Usage:
+python replay.py session.log [--session N] [--devices FILE]
+
+The button events and game telemetry updates of each launchpad are fed back with their recorded timing.  The key ops written
+to each board and the page changes of the replay are compared with the recording, and the
+time differences of the key writes are reported.  Use the devices file (and the profiles) the
+session was recorded with.  The exit status is 1 if the output differs.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import launchpad_mapper
+import speech
+from arduino import Arduino, decode_frames
+from devices import load_devices, DeviceError
+from session_log import (SessionRecorder, read_sessions, session_events, session_telemetry, EVENT, PAGE, SERIAL,
+                         TELEMETRY)
+from simulator import ScriptedLaunchpad, ScriptedTelemetry, SimulatedDue
+from uinput_keyboard import UinputKeyboard, RecordingDevice
+
+
+def key_writes(records):
+    """
+    Returns {board index: [(seconds, (op, key)), ...]} for the key ops written in a session.  Pings have none.
+    """
+    writes = {}
+    for seconds, kind, index, payload in records:
+        if kind == SERIAL:
+            for _, ops in decode_frames(payload):
+                writes.setdefault(index, []).extend((seconds, op) for op in ops)
+    return writes
+
+
+def page_changes(records):
+    return [(index, bytearray(payload)[0]) for _, kind, index, payload in records if kind == PAGE]
+
+
+def telemetry_updates(records):
+    """
+    Returns the (launchpad index, status, events) telemetry updates of a session
+    """
+    indexes = sorted(set(index for _, kind, index, _ in records if kind == TELEMETRY))
+    return [(index, status, events) for index in indexes for _, status, events in session_telemetry(records, index)]
+
+
+def first_event_time(records):
+    times = [seconds for seconds, kind, _, _ in records if kind == EVENT]
+    return min(times) if times else 0.0
+
+
+def replay_session(records, devices_path=None, end_delay=.5):
+    """
+    Run the mapper over the button events of a session.  Returns the records of the replay.
+    """
+    speech.set_backend(speech.RecordingBackend())
+    launchpad_count = max([index + 1 for _, kind, index, _ in records if kind == EVENT] or [1])
+    launchpads = [ScriptedLaunchpad(session_events(records, index), end_delay=end_delay)
+                  for index in range(launchpad_count)]
+    telemetry = None
+    if any(kind == TELEMETRY for _, kind, _, _ in records):
+        telemetry = ScriptedTelemetry([session_telemetry(records, index) for index in range(launchpad_count)])
+
+    handle, log_path = tempfile.mkstemp(suffix=".log")
+    os.close(handle)
+    try:
+        recorder = SessionRecorder(log_path)
+        if devices_path:
+            unused = list(launchpads)
+            devices = load_devices(devices_path, lambda: unused.pop(0),
+                                   lambda port: Arduino(None, port=SimulatedDue()),
+                                   lambda: UinputKeyboard(RecordingDevice()))
+            launchpad_mapper.main(devices=devices, recorder=recorder, telemetry=telemetry)
+        else:
+            launchpad_mapper.main(launchpad=launchpads[0], arduino=Arduino(None, port=SimulatedDue()),
+                                  recorder=recorder, telemetry=telemetry)
+        return read_sessions(log_path)[-1]
+    finally:
+        os.remove(log_path)
+
+
+def compare(recorded, replayed):
+    """
+    Returns (True if the output matched, report lines)
+    """
+    lines = []
+    matched = True
+    shift = first_event_time(recorded) - first_event_time(replayed)
+
+    recorded_writes = key_writes(recorded)
+    replayed_writes = key_writes(replayed)
+    for board in sorted(set(recorded_writes) | set(replayed_writes)):
+        expected = recorded_writes.get(board, [])
+        actual = replayed_writes.get(board, [])
+        expected_ops = [op for _, op in expected]
+        actual_ops = [op for _, op in actual]
+        if expected_ops == actual_ops:
+            offsets = sorted(abs(replay_time + shift - record_time) * 1000.0
+                             for (record_time, _), (replay_time, _) in zip(expected, actual))
+            median = offsets[len(offsets) // 2] if offsets else 0.0
+            largest = offsets[-1] if offsets else 0.0
+            lines.append("board %d: %d key ops match  timing difference p50 %.3f ms  max %.3f ms" %
+                         (board, len(expected_ops), median, largest))
+        else:
+            matched = False
+            first = next((number for number, (a, b) in enumerate(zip(expected_ops, actual_ops)) if a != b),
+                         min(len(expected_ops), len(actual_ops)))
+            lines.append("board %d: key ops differ at op %d (%d recorded, %d replayed)" %
+                         (board, first, len(expected_ops), len(actual_ops)))
+
+    recorded_pages = page_changes(recorded)
+    replayed_pages = page_changes(replayed)
+    if recorded_pages == replayed_pages:
+        lines.append("%d page changes match" % len(recorded_pages))
+    else:
+        matched = False
+        lines.append("page changes differ: %r recorded, %r replayed" % (recorded_pages, replayed_pages))
+
+    recorded_telemetry = telemetry_updates(recorded)
+    replayed_telemetry = telemetry_updates(replayed)
+    if recorded_telemetry == replayed_telemetry:
+        lines.append("%d telemetry updates match" % len(recorded_telemetry))
+    else:
+        matched = False
+        lines.append("telemetry updates differ: %d recorded, %d replayed" %
+                     (len(recorded_telemetry), len(replayed_telemetry)))
+    return matched, lines
+
+
+def main(path, session=-1, devices_path=None):
+    sessions = read_sessions(path)
+    if not sessions:
+        print("%s has no sessions" % path)
+        return False
+    recorded = sessions[session]
+    matched, lines = compare(recorded, replay_session(recorded, devices_path))
+    print("\n".join(["%s session %d:" % (os.path.basename(path), session % len(sessions))] + lines))
+    return matched
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a recorded session against simulated devices")
+    parser.add_argument("log", help="session log written with launchpad_mapper.py --record")
+    parser.add_argument("--session", type=int, default=-1, metavar="N",
+                        help="session in the log to replay, counting from 0.  Default the last one")
+    parser.add_argument("--devices", metavar="FILE", help="devices file the session was recorded with")
+    args = parser.parse_args()
+    try:
+        ok = main(args.log, args.session, args.devices)
+    except (ValueError, IndexError, IOError, DeviceError) as ex:
+        parser.error(str(ex))
+    sys.exit(0 if ok else 1)
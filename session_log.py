@@ -0,0 +1,224 @@
+"""
+session_log.py
+Records what the mapper does to a compact binary log, and reads the log back.
+
+Every launchpad button event, handler response, page change, game telemetry update and write to a board is appended
+with its monotonic time since the session started.  The records are packed and written on a
+background thread so the main loop never waits on the disk.  replay.py feeds a log back through
+the mapper, and benchmark.py takes logs as workloads.
+
+Log layout: the MAGIC bytes, then records.  A record is a header
+  time (float64, seconds since the session started), kind (uint8), device index (uint8), payload size (uint16)
+followed by the payload, all little endian.  Each run of the mapper appends a SESSION record first.
+  SESSION   payload: wall clock start time (float64)
+  EVENT     index: launchpad.  payload: x, y, pressed (uint8 each)
+  RESPONSE  index: launchpad.  payload: cell, response (uint8 each, see RESPONSE_CODES)
+  PAGE      index: launchpad.  payload: index of the page shown in pad_states (uint8)
+  SERIAL    index: board.  payload: the bytes written
+  TELEMETRY index: launchpad.  payload: JSON {"status": status or null, "events": [journal events]}
+A record cut short by a crash ends the log.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import struct
+import time
+from threading import Thread
+from latency import monotonic
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+MAGIC = b"LPSL\x01"
+RECORD_HEADER = struct.Struct("<dBBH")
+WALL_TIME = struct.Struct("<d")
+
+# Record kinds
+SESSION = 0
+EVENT = 1
+RESPONSE = 2
+PAGE = 3
+SERIAL = 4
+TELEMETRY = 5
+
+# Handler responses
+RESPONSE_CODES = {"state": 1, "push": 2, "back": 3}
+OTHER_RESPONSE = 0xFF
+NO_PAGE = 0xFF      # Page that is not in pad_states
+
+
+class SessionRecorder(object):
+    """
+    SessionRecorder: Appends records to a session log on its own thread.
+
+    Initialization parameters:
+    path - Log file.  A new session is appended if it exists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records_written = 0
+        self._queue = Queue()
+        self._start = monotonic()
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="session recorder")
+        self._thread.daemon = True
+        self._thread.start()
+        self.record(SESSION, 0, WALL_TIME.pack(time.time()), self._start)
+
+    def stop(self):
+        """
+        Write the queued records and close the log
+        """
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def record(self, kind, index, payload, timestamp=None):
+        """
+        Queue a record.  timestamp is a monotonic time.  Default now.  Can be called from any thread.
+        """
+        if timestamp is None:
+            timestamp = monotonic()
+        self._queue.put((timestamp - self._start, kind, index, bytes(payload)))
+
+    def event(self, index, x, y, pressed, timestamp=None):
+        self.record(EVENT, index, bytearray([x, y, 1 if pressed else 0]), timestamp)
+
+    def response(self, index, cell, response):
+        codes = [RESPONSE_CODES.get(name, OTHER_RESPONSE) for name in response]
+        self.record(RESPONSE, index, bytearray([cell, codes[0] if len(codes) == 1 else OTHER_RESPONSE]))
+
+    def page(self, index, page_number):
+        self.record(PAGE, index, bytearray([page_number if 0 <= page_number < NO_PAGE else NO_PAGE]))
+
+    def serial(self, index, data):
+        self.record(SERIAL, index, data)
+
+    def telemetry(self, index, status, events, timestamp=None):
+        payload = json.dumps({"status": status, "events": events}).encode("utf-8")
+        if len(payload) > 0xFFFF:
+            print("Telemetry update too large to record (%d bytes)" % len(payload))
+            return
+        self.record(TELEMETRY, index, payload, timestamp)
+
+    def _run(self):
+        new_file = not os.path.exists(self.path) or not os.path.getsize(self.path)
+        with open(self.path, "ab") as log_file:
+            if new_file:
+                log_file.write(MAGIC)
+            stopping = False
+            while not stopping:
+                records = [self._queue.get()]
+                try:
+                    while True:
+                        records.append(self._queue.get_nowait())
+                except Empty:
+                    pass
+                if None in records:
+                    records = [record for record in records if record is not None]
+                    stopping = True
+                try:
+                    log_file.write(b"".join(RECORD_HEADER.pack(seconds, kind, index, len(payload)) + payload
+                                            for seconds, kind, index, payload in records))
+                    log_file.flush()
+                    self.records_written += len(records)
+                except (IOError, OSError) as ex:
+                    print(ex)
+
+
+class RecordingPort(object):
+    """
+    RecordingPort: Stands in for a board's serial port and records what is written to it.
+
+    Initialization parameters:
+    port - The serial port (or SerialWriter)
+    recorder - SessionRecorder
+    index - Index of the board
+    """
+
+    def __init__(self, port, recorder, index):
+        self.port = port
+        self.recorder = recorder
+        self.index = index
+
+    def write(self, data):
+        self.recorder.serial(self.index, data)
+        return self.port.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+
+def read_sessions(path):
+    """
+    Returns the sessions in a log.  Each is a list of (seconds, kind, index, payload) records in the order written.
+    Raises ValueError if the file is not a session log.
+    """
+    with open(path, "rb") as log_file:
+        data = log_file.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("%s is not a session log" % path)
+
+    sessions = []
+    position = len(MAGIC)
+    while position + RECORD_HEADER.size <= len(data):
+        seconds, kind, index, size = RECORD_HEADER.unpack_from(data, position)
+        position += RECORD_HEADER.size
+        if position + size > len(data):
+            break
+        payload = data[position:position + size]
+        position += size
+        if kind == SESSION or not sessions:
+            sessions.append([])
+        sessions[-1].append((seconds, kind, index, payload))
+    return sessions
+
+
+def is_session_log(path):
+    with open(path, "rb") as log_file:
+        return log_file.read(len(MAGIC)) == MAGIC
+
+
+def session_telemetry(records, index=0):
+    """
+    Returns the (seconds, status, events) telemetry updates of one launchpad in a session, oldest first
+    """
+    updates = []
+    for seconds, kind, record_index, payload in records:
+        if kind == TELEMETRY and record_index == index:
+            update = json.loads(payload.decode("utf-8"))
+            updates.append((seconds, update["status"], update["events"]))
+    return sorted(updates, key=lambda update: update[0])
+
+
+def session_events(records, index=0):
+    """
+    Returns the (seconds, x, y, pressed) button events of one launchpad in a session, oldest first
+    """
+    events = []
+    for seconds, kind, record_index, payload in records:
+        if kind == EVENT and record_index == index:
+            x, y, pressed = bytearray(payload)
+            events.append((seconds, x, y, bool(pressed)))
+    return sorted(events, key=lambda event: event[0])
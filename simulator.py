@@ -0,0 +1,287 @@
+"""
+simulator.py
+Stand-in devices so the mapper can run without the Launchpad connected.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+from threading import Lock, Thread, Event
+from time import sleep
+from latency import monotonic
+from button_types import ShutdownException
+from arduino import (FRAME_SYNC, STATUS_SYNC, STATUS_BITMAP_BYTES, OP_PRESS, OP_RELEASE, OP_RELEASE_ALL, OP_ARG,
+                     OP_PRESS_FOR, OP_TAP, OP_RELEASE_AFTER, next_sequence)
+
+
+class SimulatedMidi(object):
+    """
+    SimulatedMidi: Records the raw MIDI messages written to the launchpad
+
+    Initialization parameters:
+    write_delay - Seconds each message takes to send.  Default 0
+    """
+
+    def __init__(self, write_delay=0.0):
+        self.write_delay = write_delay
+        self.messages = []
+
+    def RawWrite(self, status, data1=0, data2=0):
+        if self.write_delay:
+            sleep(self.write_delay)
+        self.messages.append((monotonic(), status, data1, data2))
+
+    @property
+    def bytes_written(self):
+        return 3 * len(self.messages)
+
+
+class SimulatedSerial(object):
+    """
+    SimulatedSerial: Stand-in for the serial port to the arduino.
+    Every write is kept as (time, data).
+
+    Initialization parameters:
+    write_delay - Seconds each write takes.  Default 0
+    """
+
+    def __init__(self, write_delay=0.0):
+        self.write_delay = write_delay
+        self.frames = []
+
+    def write(self, data):
+        if self.write_delay:
+            sleep(self.write_delay)
+        self.frames.append((monotonic(), bytes(bytearray(data))))
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self, size=1):
+        return b""
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    @property
+    def bytes_written(self):
+        return sum(len(data) for _, data in self.frames)
+
+
+class SimulatedDue(SimulatedSerial):
+    """
+    SimulatedDue: Stand-in for the serial port that answers like the keyboard_mapper firmware.
+    It tracks the held keys and acknowledges frames with status frames.  Op timing is not simulated:
+    delays are skipped and a tap holds the key until the last tap ends.
+
+    Initialization parameters:
+    write_delay - Seconds each write takes.  Default 0
+    loss - Fraction of writes that are lost on the way to the board.  Default 0
+    seed - Seed for choosing the lost writes.  Default 0
+    """
+
+    def __init__(self, write_delay=0.0, loss=0.0, seed=0):
+        super(SimulatedDue, self).__init__(write_delay)
+        self.loss = loss
+        self.held = set()
+        self.lost = 0
+        self._random = random.Random(seed)
+        self._last_sequence = 0
+        self._timers = {}           # key: time the board releases it
+        self._incoming = bytearray()
+        self._lock = Lock()
+
+    def write(self, data):
+        written = super(SimulatedDue, self).write(data)
+        with self._lock:
+            if self.loss and self._random.random() < self.loss:
+                self.lost += 1
+                return written
+            data = bytearray(data)
+            position = 0
+            while position + 3 < len(data) and data[position] == FRAME_SYNC:
+                sequence, count = data[position + 1], data[position + 2]
+                ops = data[position + 3:position + 3 + 2 * count]
+                position += 4 + 2 * count
+                if sequence == 0 or sequence == next_sequence(self._last_sequence):
+                    self._last_sequence = sequence
+                    self._run(ops)
+                self._send_status()
+        return written
+
+    def _run(self, ops):
+        args = []
+        now = monotonic()
+        for index in range(0, len(ops), 2):
+            op, key = ops[index], ops[index + 1]
+            if op == OP_ARG:
+                args.append(key)
+                continue
+            times = [((args[at] << 8) | args[at + 1]) / 1000.0 for at in range(len(args) % 2, len(args) - 1, 2)]
+            if op == OP_PRESS:
+                self.held.add(key)
+            elif op == OP_RELEASE:
+                self.held.discard(key)
+                self._timers.pop(key, None)
+            elif op == OP_RELEASE_ALL:
+                self.held.clear()
+                self._timers.clear()
+            elif op == OP_PRESS_FOR and times:
+                self.held.add(key)
+                self._timers[key] = now + times[0]
+            elif op == OP_TAP and len(times) == 2:
+                self.held.add(key)
+                self._timers[key] = now + (args[0] - 1) * times[0] + times[1]
+            elif op == OP_RELEASE_AFTER and times:
+                self._timers[key] = now + times[0]
+            args = []
+
+    def _send_status(self):
+        bitmap = bytearray(STATUS_BITMAP_BYTES)
+        for key in self.held:
+            bitmap[key >> 3] |= 1 << (key & 7)
+        checksum = self._last_sequence
+        for value in bitmap:
+            checksum ^= value
+        self._incoming += bytearray([STATUS_SYNC, self._last_sequence]) + bitmap + bytearray([checksum])
+
+    def _run_timers(self):
+        now = monotonic()
+        expired = [key for key, until in self._timers.items() if until <= now]
+        for key in expired:
+            del self._timers[key]
+            self.held.discard(key)
+        if expired:
+            self._send_status()
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            self._run_timers()
+            return len(self._incoming)
+
+    def read(self, size=1):
+        with self._lock:
+            self._run_timers()
+            data = bytes(self._incoming[:size])
+            del self._incoming[:size]
+            return data
+
+
+class ScriptedLaunchpad(object):
+    """
+    ScriptedLaunchpad: Plays back a list of button events in place of the real launchpad.
+
+    Initialization parameters:
+    script - List of (seconds, x, y, pressed) tuples.  seconds is measured from the first poll.
+    end_delay - Seconds to keep running after the last event before raising ShutdownException.  Default .5
+    midi_delay - Seconds each MIDI message to the launchpad takes.  Default 0
+
+    Each event handed out is added to delivered as (due time, read time, x, y, pressed).
+    """
+
+    def __init__(self, script, end_delay=.5, midi_delay=0.0):
+        self.script = sorted(script, key=lambda event: event[0])
+        self.end_delay = end_delay
+        self.midi = SimulatedMidi(write_delay=midi_delay)
+        self.delivered = []
+        self._start = None
+        self._next = 0
+
+    def Open(self, number=0, name="Launchpad"):
+        return True
+
+    def Close(self):
+        pass
+
+    def Reset(self):
+        self.midi.RawWrite(176, 0, 0)
+
+    def ButtonStateXY(self):
+        now = monotonic()
+        if self._start is None:
+            self._start = now
+        elapsed = now - self._start
+
+        if self._next < len(self.script):
+            offset, x, y, pressed = self.script[self._next]
+            if elapsed >= offset:
+                self._next += 1
+                self.delivered.append((self._start + offset, now, x, y, pressed))
+                return [x, y, pressed]
+            return []
+
+        last_offset = self.script[-1][0] if self.script else 0
+        if elapsed >= last_offset + self.end_delay:
+            raise ShutdownException("Script finished")
+        return []
+
+
+class ScriptedTelemetry(object):
+    """
+    ScriptedTelemetry: Plays back recorded game telemetry in place of telemetry.Telemetry.
+
+    Initialization parameters:
+    updates - List with a list of (seconds, status, events) updates for each subscriber, in subscribe order.
+              seconds is measured from start.
+    """
+
+    def __init__(self, updates):
+        self.updates = updates
+        self._subscribers = []
+        self._stop = Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="scripted telemetry")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        started = monotonic()
+        script = sorted((seconds, index, status, events)
+                        for index, updates in enumerate(self.updates) if index < len(self._subscribers)
+                        for seconds, status, events in updates)
+        for seconds, index, status, events in script:
+            if self._stop.wait(max(0.0, started + seconds - monotonic())):
+                return
+            self._subscribers[index](status, events)
+
+
+def press_script(buttons, interval=.05, hold=.02):
+    """
+    Builds a script that presses and releases each (x, y) in order
+    """
+    script = []
+    for index, (x, y) in enumerate(buttons):
+        start = index * interval
+        script.append((start, x, y, True))
+        script.append((start + hold, x, y, False))
+    return script
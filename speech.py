@@ -1,11 +1,179 @@
+"""
+speech.py
+Announces button descriptions without holding up the main loop.
+
+Utterances are queued to a background worker.  When buttons are mashed only the newest
+utterances are kept and the audio for each description is rendered once and cached.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
 from subprocess import Popen, PIPE
-import json
+from collections import deque, OrderedDict
+from threading import Thread, Condition
+import os
+import tempfile
 
 
-SPEECH = 'cscript "C:\Program Files\Jampal\ptts.vbs"'
+SPEECH = r'cscript //nologo "C:\Program Files\Jampal\ptts.vbs"'
+CACHE_SIZE = 32     # Rendered phrases kept
 
 
-def say(text):
+class PttsBackend(object):
+    """
+    PttsBackend: Renders speech to wave data with Jampal ptts and plays it with winsound
+    """
+
+    def __init__(self, command=SPEECH):
+        self.command = command
+
+    def render(self, text):
+        handle, wave_file = tempfile.mkstemp(suffix=".wav")
+        os.close(handle)
+        try:
+            proc = Popen('%s -w "%s"' % (self.command, wave_file), stdin=PIPE, stdout=PIPE, shell=True)
+            proc.communicate(text.encode("utf-8"))
+            with open(wave_file, "rb") as wave:
+                return wave.read()
+        finally:
+            os.remove(wave_file)
+
+    def play(self, audio):
+        import winsound
+        winsound.PlaySound(audio, winsound.SND_MEMORY)
+
+
+class RecordingBackend(object):
+    """
+    RecordingBackend: Stand-in backend that records what would have been spoken
+    """
+
+    def __init__(self):
+        self.rendered = []
+        self.played = []
+
+    def render(self, text):
+        self.rendered.append(text)
+        return text.encode("utf-8")
+
+    def play(self, audio):
+        self.played.append(audio.decode("utf-8"))
 
-    proc = Popen(["echo", text, "|", SPEECH], stdout=PIPE)
-    stdoutdata, stderrdata = proc.communicate()
+
+class SpeechWorker(object):
+    """
+    SpeechWorker: Speaks queued text on a background thread.
+
+    Initialization parameters:
+    backend - Object with render(text) -> audio and play(audio) methods
+    max_pending - Number of utterances allowed to wait.  Older ones are dropped.  Default 1
+    cache_size - Number of rendered phrases kept, least recently spoken dropped first.  Default 32
+    """
+
+    def __init__(self, backend, max_pending=1, cache_size=CACHE_SIZE):
+        self.backend = backend
+        self.max_pending = max_pending
+        self.cache_size = cache_size
+        self.dropped = 0
+        self._cache = OrderedDict()     # text: audio, least recently spoken first
+        self._pending = deque()
+        self._condition = Condition()
+        self._busy = False
+        self._stopping = False
+        self._thread = Thread(target=self._run, name="speech")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def say(self, text):
+        """
+        Queue text to be spoken.  Returns immediately.
+        """
+        with self._condition:
+            if text in self._pending:
+                return  # Already waiting to be said
+            self._pending.append(text)
+            while len(self._pending) > self.max_pending:
+                self._pending.popleft()
+                self.dropped += 1
+            self._condition.notify()
+
+    def wait_idle(self):
+        """
+        Block until everything queued has been spoken
+        """
+        with self._condition:
+            while self._pending or self._busy:
+                self._condition.wait()
+
+    def stop(self):
+        """
+        Drop what is waiting, let the utterance being played finish and end the thread
+        """
+        with self._condition:
+            self._stopping = True
+            self._pending.clear()
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _audio(self, text):
+        audio = self._cache.pop(text, None)
+        if audio is None:
+            audio = self.backend.render(text)
+            if not audio:
+                return audio    # Failed render.  Try again next time.
+        self._cache[text] = audio
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return audio
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._busy = False
+                    self._condition.notify_all()
+                    if self._stopping:
+                        return
+                    self._condition.wait()
+                text = self._pending.popleft()
+                self._busy = True
+            try:
+                self.backend.play(self._audio(text))
+            except Exception as ex:
+                print(ex)
+
+
+_worker = None
+
+
+def set_backend(backend, max_pending=1):
+    """
+    Replace the speech backend used by say().  The worker of the old one is stopped.
+    """
+    global _worker
+    if _worker is not None:
+        _worker.stop()
+    _worker = SpeechWorker(backend, max_pending=max_pending)
+    return _worker
+
+
+def say(text):
+    """
+    Queue text to be spoken by the default worker
+    """
+    if _worker is None:
+        set_backend(PttsBackend())
+    _worker.say(text)
@@ -43,6 +43,25 @@ class SystemsButtonGroup(object):
         self.engines_pip = 4
         self.update_colors()
 
+    def adopt_state(self, old_group):
+        """
+        Take the pip counts from the group this one replaces after a profile reload
+        """
+        self.systems_pip = old_group.systems_pip
+        self.weapons_pip = old_group.weapons_pip
+        self.engines_pip = old_group.engines_pip
+        self.update_colors()
+
+    def show_status(self, status):
+        """
+        Take the pip counts from the game status (see telemetry.py).  Status.json gives
+        [systems, engines, weapons] in half pips, the same units as the counts here.
+        """
+        pips = status.get("Pips")
+        if isinstance(pips, list) and len(pips) == 3:
+            self.systems_pip, self.engines_pip, self.weapons_pip = [int(pip) for pip in pips]
+            self.update_colors()
+
     def reallocate_pips(self, module_in, module_1_out, module_2_out):
         """
         Take pips from the two "out" modules and add them to the "in" module
@@ -0,0 +1,322 @@
+"""
+telemetry.py
+Follows the game's Status.json and journal files so the buttons show the real ship state.
+
+The game rewrites Status.json whenever the ship state changes and appends one JSON event per line to
+the newest Journal.*.log.  The status file is read only when its time or size changes.  The journal
+is read from the offset reached last time, so nothing is read twice.  On Linux the directory is
+watched with inotify and the files are read as soon as they change.  Elsewhere it is polled.
+
+The Telemetry thread hands each new status and the new journal events to its subscribers.  The
+mapper posts them to the launchpad's event queue as a TelemetryUpdate, so the buttons are changed
+on the logic thread.  ToggleButtons with a status_flag follow that flag, SystemsButtonGroups follow
+the pips, and an InputButton countdown stops at one of its countdown_events (like StartJump).
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import glob
+import json
+import os
+import select
+import sys
+from threading import Thread, Event
+
+STATUS_FILE = "Status.json"
+JOURNAL_PATTERN = "Journal.*.log"
+POLL_INTERVAL = .25     # Seconds between reads without inotify
+WAKE_INTERVAL = .5      # Longest wait for inotify, so stop is noticed
+
+# Bits of the Flags value in Status.json
+STATUS_FLAGS = {
+    "Docked": 1 << 0,
+    "Landed": 1 << 1,
+    "LandingGear": 1 << 2,
+    "Shields": 1 << 3,
+    "Supercruise": 1 << 4,
+    "FlightAssistOff": 1 << 5,
+    "Hardpoints": 1 << 6,
+    "InWing": 1 << 7,
+    "Lights": 1 << 8,
+    "CargoScoop": 1 << 9,
+    "SilentRunning": 1 << 10,
+    "Scooping": 1 << 11,
+    "MassLocked": 1 << 16,
+    "FsdCharging": 1 << 17,
+    "FsdCooldown": 1 << 18,
+    "NightVision": 1 << 28,
+}
+
+# inotify
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def default_directory():
+    """
+    Returns where the game writes its journal on Windows
+    """
+    return os.path.join(os.path.expanduser("~"), "Saved Games", "Frontier Developments", "Elite Dangerous")
+
+
+def show_telemetry(buttons, groups, status, events, animator=None):
+    """
+    Show a new status (None if it didn't change) and the new journal events on buttons and groups.
+    Call on the logic thread.
+    """
+    for button in buttons:
+        if status is not None:
+            button.show_status(status)
+        for event in events:
+            button.show_event(event, animator=animator)
+    if status is not None:
+        for group in groups:
+            group.show_status(status)
+
+
+class TelemetryUpdate(object):
+    """
+    TelemetryUpdate: A new game status and journal events.  Handed to the logic thread through the event queue.
+    """
+
+    def __init__(self, callback, status, events):
+        self.callback = callback
+        self.status = status
+        self.events = events
+
+    def fire(self, **kwargs):
+        """
+        Called on the logic thread with the handler keyword arguments
+        """
+        self.callback(self.status, self.events, **kwargs)
+        return None
+
+
+class StatusFile(object):
+    """
+    StatusFile: Reads Status.json when it changes.
+
+    Initialization parameters:
+    path - The status file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._stamp = None
+
+    def read(self):
+        """
+        Returns the status if it changed since the last read, else None
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        stamp = (stat.st_mtime, stat.st_size)
+        if stamp == self._stamp:
+            return None
+        try:
+            with open(self.path, "rb") as status_file:
+                status = json.loads(status_file.read().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            return None     # Caught mid write.  Read again next time.
+        self._stamp = stamp
+        return status if isinstance(status, dict) else None
+
+
+class JournalTail(object):
+    """
+    JournalTail: Reads the events added to the newest journal file.
+
+    Initialization parameters:
+    directory - The journal directory
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = None
+        self.offset = 0
+        self._partial = b""     # Start of a line still being written
+
+    def newest(self):
+        paths = glob.glob(os.path.join(self.directory, JOURNAL_PATTERN))
+        try:
+            return max(paths, key=os.path.getmtime) if paths else None
+        except OSError:
+            return None
+
+    def skip_to_end(self):
+        """
+        Start after the events already in the newest journal
+        """
+        self.path = self.newest()
+        try:
+            self.offset = os.path.getsize(self.path) if self.path else 0
+        except OSError:
+            self.offset = 0
+        self._partial = b""
+
+    def read_events(self):
+        """
+        Returns the events written since the last read, oldest first
+        """
+        newest = self.newest()
+        if newest != self.path:
+            # The game started a new journal.  Read it from the start.
+            self.path, self.offset, self._partial = newest, 0, b""
+        if self.path is None:
+            return []
+        try:
+            size = os.path.getsize(self.path)
+            if size < self.offset:
+                self.offset, self._partial = 0, b""
+            if size == self.offset:
+                return []
+            with open(self.path, "rb") as journal:
+                journal.seek(self.offset)
+                data = journal.read(size - self.offset)
+        except (IOError, OSError) as ex:
+            print(ex)
+            return []
+        self.offset += len(data)
+
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        events = []
+        for line in lines:
+            line = line.strip()
+            if line:
+                try:
+                    events.append(json.loads(line.decode("utf-8")))
+                except ValueError as ex:
+                    print("Journal line skipped: %s" % ex)
+        return events
+
+
+class Inotify(object):
+    """
+    Inotify: Wakes when a file in a directory is written.  Linux only.
+
+    Initialization parameters:
+    directory - Directory to watch
+    Raises OSError if inotify is not available.
+    """
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if not isinstance(directory, bytes):
+            directory = directory.encode(sys.getfilesystemencoding() or "utf-8")
+        if libc.inotify_add_watch(self.fd, directory, IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, "inotify_add_watch failed")
+
+    def wait(self, timeout):
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if readable:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except OSError as ex:
+                if ex.errno != errno.EAGAIN:
+                    raise
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Telemetry(object):
+    """
+    Telemetry: Follows the status and journal files of the game on its own thread.
+
+    Initialization parameters:
+    directory - The journal directory.  Default the game's directory on Windows
+    poll_interval - Seconds between reads when inotify is not available.  Default .25
+    """
+
+    def __init__(self, directory=None, poll_interval=POLL_INTERVAL):
+        self.directory = directory or default_directory()
+        self.poll_interval = poll_interval
+        self.status_file = StatusFile(os.path.join(self.directory, STATUS_FILE))
+        self.journal = JournalTail(self.directory)
+        self.status = None      # Latest status
+        self._subscribers = []
+        self._stop = Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        """
+        callback(status, events) is called on the telemetry thread with each change.
+        status is None if only journal events (a list of dicts) were added.
+        """
+        self._subscribers.append(callback)
+
+    def start(self):
+        self.journal.skip_to_end()
+        self._thread = Thread(target=self._run, name="telemetry")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def poll(self):
+        """
+        Read the files and tell the subscribers what changed
+        """
+        status = self.status_file.read()
+        events = self.journal.read_events()
+        if status is not None:
+            self.status = status
+        if status is not None or events:
+            for callback in self._subscribers:
+                try:
+                    callback(status, events)
+                except Exception as ex:
+                    print(ex)
+
+    def _run(self):
+        try:
+            watcher = Inotify(self.directory)
+        except OSError:
+            watcher = None
+        try:
+            self.poll()     # Show the state the game is in now
+            while not self._stop.is_set():
+                if watcher:
+                    watcher.wait(WAKE_INTERVAL)
+                elif self._stop.wait(self.poll_interval):
+                    break
+                self.poll()
+        finally:
+            if watcher:
+                watcher.close()
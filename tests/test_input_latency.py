@@ -0,0 +1,120 @@
+"""
+test_input_latency.py
+Tests for the event driven input path: the key scheduler, the latency histogram and a scripted
+launchpad read through the InputEngine and MidiReader.
+
+Run from the top directory with: python -m unittest discover tests
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import unittest
+from threading import Event
+from time import sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from button_types import ShutdownException
+from input_engine import InputEngine
+from key_scheduler import KeyScheduler
+from latency import LatencyHistogram, monotonic
+from pipeline import MidiReader
+from simulator import ScriptedLaunchpad, press_script
+
+
+class KeySchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = KeyScheduler()
+        self.ran = []
+        self.done = Event()
+
+    def test_actions_run_in_due_order(self):
+        self.scheduler.schedule(.06, self.ran.append, "late")
+        self.scheduler.schedule(.02, self.ran.append, "early")
+        self.scheduler.schedule(.08, self.done.set)
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.ran, ["early", "late"])
+
+    def test_cancelled_action_does_not_run(self):
+        scheduled = self.scheduler.schedule(.02, self.ran.append, "cancelled")
+        self.scheduler.schedule(.04, self.done.set)
+        scheduled.cancel()
+        self.assertEqual(self.scheduler.pending(), 1)
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.ran, [])
+
+    def test_run_all_runs_pending_actions_once(self):
+        self.scheduler.schedule(.05, self.ran.append, "release")
+        self.scheduler.run_all()
+        self.assertEqual(self.ran, ["release"])
+        self.assertEqual(self.scheduler.pending(), 0)
+        sleep(.1)
+        self.assertEqual(self.ran, ["release"])
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_samples_are_counted_in_buckets(self):
+        histogram = LatencyHistogram("test")
+        for seconds in (.0003, .0008, .0009, .004, .150):
+            histogram.record(seconds)
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.counts[:5], [0, 1, 2, 0, 1])
+        self.assertEqual(histogram.percentile(50), 1)
+        self.assertAlmostEqual(histogram.percentile(99), 150.0)
+        self.assertAlmostEqual(histogram.max_ms, 150.0)
+
+    def test_reset(self):
+        histogram = LatencyHistogram()
+        histogram.record(.002)
+        histogram.reset()
+        self.assertEqual((histogram.count, histogram.percentile(50), histogram.mean_ms), (0, 0.0, 0.0))
+
+
+class ScriptedInputTest(unittest.TestCase):
+
+    def test_events_reach_the_logic_thread_in_order(self):
+        script = press_script([(0, 0), (1, 2), (8, 4)], interval=.03, hold=.01)
+        launchpad = ScriptedLaunchpad(script, end_delay=.05)
+        reader = MidiReader(InputEngine(launchpad))
+        histogram = LatencyHistogram("input")
+        events = []
+        reader.start()
+        try:
+            deadline = monotonic() + 5
+            with self.assertRaises(ShutdownException):
+                while monotonic() < deadline:
+                    event = reader.get_event(.1)
+                    if event:
+                        button_event, timestamp = event
+                        histogram.record(monotonic() - timestamp)
+                        events.append(tuple(button_event))
+        finally:
+            reader.stop()
+
+        self.assertEqual(events, [(x, y, pressed) for _, x, y, pressed in script])
+        self.assertEqual(histogram.count, len(script))
+        # Polled every millisecond, so the events are handed over well inside one old 100 ms poll
+        self.assertLess(histogram.percentile(50), 100)
+        for due, read, _, _, _ in launchpad.delivered:
+            self.assertGreaterEqual(read, due)
+
+
+if __name__ == '__main__':
+    unittest.main()
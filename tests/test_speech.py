@@ -0,0 +1,129 @@
+"""
+test_speech.py
+Tests for speech.py with a recording backend.
+
+Run from the top directory with: python -m unittest discover tests
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import unittest
+from threading import Event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import speech
+from speech import SpeechWorker, RecordingBackend
+
+
+class HeldBackend(RecordingBackend):
+    """
+    HeldBackend: RecordingBackend whose play waits until release() is called.  Failed renders come back empty.
+    """
+
+    def __init__(self, failing=()):
+        super(HeldBackend, self).__init__()
+        self.failing = failing
+        self.playing = Event()
+        self._released = Event()
+
+    def render(self, text):
+        audio = super(HeldBackend, self).render(text)
+        return b"" if text in self.failing else audio
+
+    def play(self, audio):
+        self.playing.set()
+        self._released.wait(5)
+        super(HeldBackend, self).play(audio)
+
+    def release(self):
+        self._released.set()
+
+
+class SpeechWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = HeldBackend(failing=["fail"])
+        self.worker = None
+
+    def tearDown(self):
+        self.backend.release()
+        if self.worker:
+            self.worker.stop()
+
+    def start(self, **kwargs):
+        self.worker = SpeechWorker(self.backend, **kwargs)
+        return self.worker
+
+    def say_while_playing(self, first, *texts):
+        """
+        Say first, then say texts while first is still being played
+        """
+        self.worker.say(first)
+        self.assertTrue(self.backend.playing.wait(5))
+        for text in texts:
+            self.worker.say(text)
+        self.backend.release()
+        self.worker.wait_idle()
+
+    def test_text_already_waiting_is_said_once(self):
+        self.start(max_pending=3)
+        self.say_while_playing("Gear", "Lights", "Lights", "Lights")
+        self.assertEqual(self.backend.played, ["Gear", "Lights"])
+        self.assertEqual(self.worker.dropped, 0)
+
+    def test_oldest_waiting_text_is_dropped(self):
+        self.start(max_pending=1)
+        self.say_while_playing("Gear", "Lights", "Hardpoints")
+        self.assertEqual(self.backend.played, ["Gear", "Hardpoints"])
+        self.assertEqual(self.worker.dropped, 1)
+
+    def test_render_is_cached(self):
+        self.start(max_pending=3)
+        self.say_while_playing("Gear", "Lights", "Gear")
+        self.assertEqual(self.backend.played, ["Gear", "Lights", "Gear"])
+        self.assertEqual(self.backend.rendered, ["Gear", "Lights"])
+
+    def test_failed_render_is_not_cached(self):
+        self.start(max_pending=3)
+        self.say_while_playing("fail", "Gear", "fail")
+        self.assertEqual(self.backend.rendered, ["fail", "Gear", "fail"])
+
+    def test_cache_keeps_the_most_recently_said(self):
+        self.start(max_pending=4, cache_size=2)
+        self.say_while_playing("Gear", "Lights", "Gear", "Hardpoints")
+        for text in ["Gear", "Lights"]:
+            self.worker.say(text)
+            self.worker.wait_idle()
+        self.assertEqual(self.backend.rendered, ["Gear", "Lights", "Hardpoints", "Lights"])
+
+    def test_set_backend_stops_the_old_worker(self):
+        old = speech.set_backend(RecordingBackend())
+        try:
+            new = speech.set_backend(RecordingBackend())
+            self.assertFalse(old._thread.is_alive())
+            speech.say("Gear")
+            new.wait_idle()
+            self.assertEqual(new.backend.played, ["Gear"])
+        finally:
+            speech._worker.stop()
+            speech._worker = None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+test_telemetry.py
+Tests for telemetry.py against a fake journal directory.
+
+Run from the top directory with: python -m unittest discover tests
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from time import strftime, gmtime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from animations import Animator
+from button_types import InputButton, ToggleButton
+from systems_button_group import SystemsButtonGroup
+from telemetry import Telemetry, STATUS_FLAGS, STATUS_FILE, show_telemetry
+
+
+class FakeJournal(object):
+    """
+    FakeJournal: Writes Status.json and a journal file the way the game does.
+
+    Initialization parameters:
+    directory - Journal directory to write in.  Created if needed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.journal_path = os.path.join(directory, strftime("Journal.%Y-%m-%dT%H%M%S.01.log"))
+
+    def set_status(self, flags=0, pips=(4, 4, 4), **fields):
+        """
+        Rewrite Status.json with the flags (see telemetry.STATUS_FLAGS) and [systems, engines, weapons] half pips
+        """
+        status = {"timestamp": strftime("%Y-%m-%dT%H:%M:%SZ", gmtime()), "event": "Status",
+                  "Flags": flags, "Pips": list(pips)}
+        status.update(fields)
+        with open(os.path.join(self.directory, STATUS_FILE), "w") as status_file:
+            status_file.write(json.dumps(status))
+
+    def add_event(self, event, **fields):
+        """
+        Append an event line to the journal
+        """
+        entry = {"timestamp": strftime("%Y-%m-%dT%H:%M:%SZ", gmtime()), "event": event}
+        entry.update(fields)
+        with open(self.journal_path, "a") as journal:
+            journal.write(json.dumps(entry) + "\n")
+
+
+class TelemetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal = FakeJournal(self.directory)
+        self.journal.add_event("Fileheader")   # Written before the telemetry starts, so skipped
+
+        self.gear = ToggleButton(7, 1, status_flag="LandingGear")
+        self.hardpoints = ToggleButton(8, 6, status_flag="Hardpoints")
+        self.fsd = InputButton(8, 1, countdown=15, countdown_events=["StartJump"])
+        self.group = SystemsButtonGroup(InputButton(4, 5), InputButton(6, 5), InputButton(5, 4), InputButton(5, 5))
+        self.animator = Animator()
+
+        self.telemetry = Telemetry(self.directory)
+        self.telemetry.journal.skip_to_end()
+        self.events = []
+        self.telemetry.subscribe(self.show)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def show(self, status, events):
+        self.events.extend(event["event"] for event in events)
+        show_telemetry([self.gear, self.hardpoints, self.fsd], [self.group], status, events, self.animator)
+
+    def test_flags_set_toggle_buttons(self):
+        self.journal.set_status(STATUS_FLAGS["LandingGear"] | STATUS_FLAGS["Lights"])
+        self.telemetry.poll()
+        self.assertTrue(self.gear._toggled)
+        self.assertFalse(self.hardpoints._toggled)
+
+        self.journal.set_status(STATUS_FLAGS["Hardpoints"])
+        self.telemetry.poll()
+        self.assertFalse(self.gear._toggled)
+        self.assertTrue(self.hardpoints._toggled)
+
+    def test_pips_set_group(self):
+        self.journal.set_status(pips=(8, 2, 2))
+        self.telemetry.poll()
+        self.assertEqual((self.group.systems_pip, self.group.engines_pip, self.group.weapons_pip), (8, 2, 2))
+        self.assertEqual((self.group.systems_button.red, self.group.systems_button.green), (0, 3))
+        self.assertEqual((self.group.weapons_button.red, self.group.weapons_button.green), (1, 0))
+
+    def test_unchanged_status_is_not_read_again(self):
+        self.journal.set_status(STATUS_FLAGS["LandingGear"])
+        self.telemetry.poll()
+        self.gear._toggled = False
+        self.telemetry.poll()
+        self.assertFalse(self.gear._toggled)
+
+    def test_journal_is_read_from_the_offset(self):
+        self.journal.add_event("Docked")
+        self.telemetry.poll()
+        self.journal.add_event("Undocked")
+        self.telemetry.poll()
+        self.telemetry.poll()
+        self.assertEqual(self.events, ["Docked", "Undocked"])
+
+    def test_partial_journal_line_waits(self):
+        with open(self.journal.journal_path, "a") as journal:
+            journal.write('{"event": "Lau')
+        self.telemetry.poll()
+        self.assertEqual(self.events, [])
+        with open(self.journal.journal_path, "a") as journal:
+            journal.write('nchSRV"}\n')
+        self.telemetry.poll()
+        self.assertEqual(self.events, ["LaunchSRV"])
+
+    def test_journal_event_stops_countdown(self):
+        self.fsd.pressed(animator=self.animator)
+        countdown = self.fsd._countdown
+        self.assertTrue(self.animator.running(countdown))
+        self.journal.add_event("StartJump", JumpType="Hyperspace")
+        self.telemetry.poll()
+        self.assertFalse(self.animator.running(countdown))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+test_uinput_keyboard.py
+Tests for uinput_keyboard.py against a recording device.
+
+Run from the top directory with: python -m unittest discover tests
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import unittest
+from time import sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from arduino import OP_PRESS, OP_RELEASE, OP_DELAY
+from key_codes import SPECIAL_KEYS
+from key_scheduler import KeyScheduler
+from uinput_keyboard import UinputKeyboard, RecordingDevice, KEY_LEFTSHIFT
+
+KEY_A = 30
+KEY_B = 48
+KEY_LEFTCTRL = 29
+
+
+class UinputKeyboardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = RecordingDevice()
+        self.keyboard = UinputKeyboard(self.device, KeyScheduler())
+
+    def tearDown(self):
+        self.keyboard.close()
+
+    def reports(self):
+        return [events for _, events in self.device.reports]
+
+    def test_key_down_and_release(self):
+        self.keyboard.key_down(ord("a"))
+        self.keyboard.key_release(ord("a"))
+        self.assertEqual(self.reports(), [[(KEY_A, 1)], [(KEY_A, 0)]])
+        self.assertEqual(self.keyboard.keys_down, frozenset())
+
+    def test_shifted_key_presses_shift_first(self):
+        self.keyboard.key_down(ord("A"))
+        self.keyboard.key_release(ord("A"))
+        self.assertEqual(self.reports(), [[(KEY_LEFTSHIFT, 1), (KEY_A, 1)], [(KEY_A, 0), (KEY_LEFTSHIFT, 0)]])
+
+    def test_shift_held_while_a_shifted_key_is_down(self):
+        self.keyboard.key_down(ord("A"))
+        self.keyboard.key_down(ord("B"))
+        self.keyboard.key_release(ord("A"))
+        self.assertEqual(self.reports()[-1], [(KEY_A, 0)])
+        self.keyboard.key_release(ord("B"))
+        self.assertEqual(self.reports()[-1], [(KEY_B, 0), (KEY_LEFTSHIFT, 0)])
+
+    def test_batch_sends_one_report(self):
+        with self.keyboard.batch():
+            self.keyboard.key_down(SPECIAL_KEYS["LEFT_CTRL"])
+            self.keyboard.key_down(ord("a"))
+        self.assertEqual(self.reports(), [[(KEY_LEFTCTRL, 1), (KEY_A, 1)]])
+
+    def test_release_all(self):
+        self.keyboard.key_down(ord("a"))
+        self.keyboard.key_down(ord("B"))
+        self.keyboard.key_release(0x00)
+        self.assertEqual(self.reports()[-1], [(KEY_A, 0), (KEY_LEFTSHIFT, 0), (KEY_B, 0)])
+        self.assertEqual(self.keyboard.keys_down, frozenset())
+
+    def test_key_press_releases_after_duration(self):
+        self.keyboard.key_press(ord("a"), .05)
+        self.assertEqual(self.keyboard.keys_down, frozenset([ord("a")]))
+        sleep(.2)
+        self.assertEqual(self.reports(), [[(KEY_A, 1)], [(KEY_A, 0)]])
+        held = self.device.reports[1][0] - self.device.reports[0][0]
+        self.assertGreaterEqual(held, .04)
+
+    def test_play_runs_delays_on_the_scheduler(self):
+        self.keyboard.play(((OP_PRESS, ord("a")), (OP_DELAY, 50), (OP_RELEASE, ord("a"))))
+        self.assertEqual(self.reports(), [[(KEY_A, 1)]])
+        sleep(.2)
+        self.assertEqual(self.reports(), [[(KEY_A, 1)], [(KEY_A, 0)]])
+
+    def test_close_releases_held_keys_once(self):
+        self.keyboard.key_press(ord("a"), 10)
+        self.keyboard.close()
+        self.keyboard.close()
+        self.assertEqual(self.reports(), [[(KEY_A, 1)], [(KEY_A, 0)]])
+        self.assertTrue(self.device.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
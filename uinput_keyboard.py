@@ -0,0 +1,324 @@
+"""
+uinput_keyboard.py
+Sends the keys straight to a virtual keyboard made with Linux uinput, without the Arduino.
+
+UinputKeyboard has the key methods of the Arduino class and takes the same key codes
+(the Arduino Keyboard library codes, see key_codes.py), so it can be used in its place when
+the game runs on the same Linux machine.  The user needs write access to /dev/uinput.
+
+Copyright (C) 2016  Bob Helander
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import atexit
+import os
+import struct
+from contextlib import contextmanager
+from threading import RLock
+from arduino import OP_PRESS, OP_RELEASE, OP_RELEASE_ALL, OP_DELAY, TAP_HOLD
+from key_codes import SPECIAL_KEYS
+from key_scheduler import KeyScheduler
+from latency import monotonic
+
+UINPUT_PATH = "/dev/uinput"
+DEVICE_NAME = "launchpad mapper keyboard"
+
+# linux/input.h and linux/uinput.h
+EV_SYN = 0x00
+EV_KEY = 0x01
+SYN_REPORT = 0
+BUS_VIRTUAL = 0x06
+UI_SET_EVBIT = 0x40045564
+UI_SET_KEYBIT = 0x40045565
+UI_DEV_CREATE = 0x5501
+UI_DEV_DESTROY = 0x5502
+INPUT_EVENT = struct.Struct("llHHi")
+ABS_CNT = 64
+
+KEY_LEFTCTRL = 29
+KEY_LEFTSHIFT = 42
+
+# Linux key codes of the unshifted characters on a US keyboard
+_CHARACTER_ROWS = (
+    (2, "1234567890-="),
+    (16, "qwertyuiop[]"),
+    (30, "asdfghjkl;'`"),
+    (44, "zxcvbnm,./"),
+)
+_SHIFTED = dict(zip("!@#$%^&*()_+{}:\"~<>?|", "1234567890-=[];'`,./\\"))
+
+# Arduino special key names: Linux key codes
+_SPECIAL_CODES = {
+    "LEFT_CTRL": 29, "LEFT_SHIFT": 42, "LEFT_ALT": 56, "LEFT_GUI": 125,
+    "RIGHT_CTRL": 97, "RIGHT_SHIFT": 54, "RIGHT_ALT": 100, "RIGHT_GUI": 126,
+    "UP_ARROW": 103, "DOWN_ARROW": 108, "LEFT_ARROW": 105, "RIGHT_ARROW": 106,
+    "BACKSPACE": 14, "TAB": 15, "RETURN": 28, "ESC": 1, "INSERT": 110, "DELETE": 111,
+    "PAGE_UP": 104, "PAGE_DOWN": 109, "HOME": 102, "END": 107, "CAPS_LOCK": 58, "SPACE": 57,
+    "F1": 59, "F2": 60, "F3": 61, "F4": 62, "F5": 63, "F6": 64, "F7": 65, "F8": 66, "F9": 67, "F10": 68,
+    "F11": 87, "F12": 88,
+}
+
+
+def _build_key_map():
+    key_map = {}
+    for first_code, characters in _CHARACTER_ROWS:
+        for offset, character in enumerate(characters):
+            key_map[ord(character)] = (first_code + offset, False)
+    key_map[ord("\\")] = (43, False)
+    for character in "abcdefghijklmnopqrstuvwxyz":
+        key_map[ord(character.upper())] = (key_map[ord(character)][0], True)
+    for shifted, plain in _SHIFTED.items():
+        key_map[ord(shifted)] = (key_map[ord(plain)][0], True)
+    for name, code in _SPECIAL_CODES.items():
+        key_map[SPECIAL_KEYS[name]] = (code, False)
+    return key_map
+
+
+# Arduino key code: (Linux key code, needs shift)
+KEY_MAP = _build_key_map()
+
+
+class UinputDevice(object):
+    """
+    UinputDevice: A virtual keyboard created through /dev/uinput
+
+    Initialization parameters:
+    path - The uinput device.  Default /dev/uinput
+    name - Name of the virtual keyboard.  Default "launchpad mapper keyboard"
+    """
+
+    def __init__(self, path=UINPUT_PATH, name=DEVICE_NAME):
+        import fcntl
+        self._ioctl = fcntl.ioctl
+        self._fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        try:
+            self._ioctl(self._fd, UI_SET_EVBIT, EV_KEY)
+            self._ioctl(self._fd, UI_SET_EVBIT, EV_SYN)
+            for code in sorted(set(code for code, _ in KEY_MAP.values())):
+                self._ioctl(self._fd, UI_SET_KEYBIT, code)
+            # struct uinput_user_dev: name, input_id, ff_effects_max, absmax, absmin, absfuzz, absflat
+            user_dev = struct.pack("80sHHHHi%di" % (4 * ABS_CNT), name.encode("utf-8"),
+                                   BUS_VIRTUAL, 0x1209, 0x0001, 1, 0, *([0] * (4 * ABS_CNT)))
+            os.write(self._fd, user_dev)
+            self._ioctl(self._fd, UI_DEV_CREATE)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def emit(self, events):
+        """
+        Send (Linux key code, value) key events followed by a sync report.  value is 1 for down, 0 for up.
+        """
+        data = b"".join(INPUT_EVENT.pack(0, 0, EV_KEY, code, value) for code, value in events)
+        os.write(self._fd, data + INPUT_EVENT.pack(0, 0, EV_SYN, SYN_REPORT, 0))
+
+    def close(self):
+        if self._fd is not None:
+            self._ioctl(self._fd, UI_DEV_DESTROY)
+            os.close(self._fd)
+            self._fd = None
+
+
+class RecordingDevice(object):
+    """
+    RecordingDevice: Stand-in for UinputDevice that keeps the events.
+    reports holds a list of (time, [(Linux key code, value), ...]) for each sync report.
+    """
+
+    def __init__(self):
+        self.reports = []
+        self.closed = False
+
+    def emit(self, events):
+        self.reports.append((monotonic(), list(events)))
+
+    def close(self):
+        self.closed = True
+
+
+class UinputKeyboard(object):
+    """
+    UinputKeyboard: Output backend that types on a local virtual keyboard.  Used in place of Arduino.
+
+    Initialization parameters:
+    device - UinputDevice or RecordingDevice.  Default a new UinputDevice
+    scheduler - KeyScheduler for the timed releases.  Default a new one
+    """
+
+    def __init__(self, device=None, scheduler=None):
+        self.device = device if device is not None else UinputDevice()
+        self.scheduler = scheduler if scheduler else KeyScheduler()
+        self._lock = RLock()
+        self._events = []
+        self._batch_depth = 0
+        self._keys_down = set()     # Arduino key codes the mapper holds down
+        self._pressed = {}          # Linux key code: number of held keys using it
+        self._pending_releases = {}
+        self._closed = False
+        atexit.register(self.close)
+
+    @contextmanager
+    def batch(self):
+        """
+        Collect the key events made inside the block and send them as one report
+        """
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._events:
+                events, self._events = self._events, []
+                self.device.emit(events)
+
+    def _event(self, code, down):
+        held = self._pressed.get(code, 0)
+        if down:
+            self._pressed[code] = held + 1
+            if held:
+                return
+        else:
+            if not held:
+                return
+            if held > 1:
+                self._pressed[code] = held - 1
+                return
+            del self._pressed[code]
+        self._events.append((code, 1 if down else 0))
+        if not self._batch_depth:
+            self.flush()
+
+    def _linux_codes(self, key):
+        if key not in KEY_MAP:
+            print("No uinput key for 0x%02X" % key)
+            return []
+        code, shift = KEY_MAP[key]
+        return [KEY_LEFTSHIFT, code] if shift else [code]
+
+    def _press(self, key):
+        with self.batch():
+            for code in self._linux_codes(key):
+                self._event(code, True)
+
+    def _release(self, key):
+        with self.batch():
+            for code in reversed(self._linux_codes(key)):
+                self._event(code, False)
+
+    @property
+    def keys_down(self):
+        return frozenset(self._keys_down)
+
+    def key_down(self, key):
+        with self._lock:
+            if key not in self._keys_down:
+                self._keys_down.add(key)
+                self._press(key)
+
+    def key_release(self, key):
+        """
+        Release a key.  Key 0x00 releases all keys.
+        """
+        with self._lock:
+            if key == 0x00:
+                for pending in self._pending_releases.values():
+                    pending.cancel()
+                self._pending_releases.clear()
+                with self.batch():
+                    for code in sorted(self._pressed):
+                        self._pressed[code] = 1
+                        self._event(code, False)
+                self._keys_down.clear()
+            elif key in self._keys_down:
+                self._keys_down.discard(key)
+                self._pending_releases.pop(key, None)
+                self._release(key)
+
+    def _cancel_release(self, key):
+        pending = self._pending_releases.pop(key, None)
+        if pending:
+            pending.cancel()
+
+    def key_press(self, key, duration):
+        """
+        Press a key for duration seconds.  Pressing it again while it is held restarts its hold time.
+        """
+        with self._lock:
+            self._cancel_release(key)
+            self.key_down(key)
+            self._pending_releases[key] = self.scheduler.schedule(duration, self.key_release, key)
+
+    def key_tap(self, key, count, interval, hold=TAP_HOLD):
+        """
+        Tap a key count times, starting a tap every interval seconds
+        """
+        hold = min(hold, interval)
+        for tap in range(max(1, count)):
+            self.scheduler.schedule(tap * interval, self.key_press, key, hold)
+
+    def key_release_after(self, key, delay):
+        with self._lock:
+            self._cancel_release(key)
+            self._pending_releases[key] = self.scheduler.schedule(delay, self.key_release, key)
+
+    def play(self, ops):
+        """
+        Play a compiled macro (see macros.compile_macro).  The ops after a delay run on the scheduler.
+        """
+        offset = 0.0
+        steps = []
+        for op, key in ops:
+            if op == OP_DELAY:
+                offset += key / 1000.0
+            elif op in (OP_PRESS, OP_RELEASE, OP_RELEASE_ALL):
+                steps.append((offset, op, key))
+        with self.batch():
+            for offset, op, key in steps:
+                if offset:
+                    self.scheduler.schedule(offset, self._run_op, op, key)
+                else:
+                    self._run_op(op, key)
+
+    def _run_op(self, op, key):
+        if op == OP_PRESS:
+            self.key_down(key)
+        elif op == OP_RELEASE:
+            self.key_release(key)
+        else:
+            self.key_release(0x00)
+
+    def reconcile(self):
+        """
+        Nothing to do: the key state is all in this process
+        """
+        pass
+
+    def close(self):
+        """
+        Release every key and remove the virtual keyboard.  Can be called more than once.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self.scheduler.run_all()
+            self.key_release(0x00)
+            self.device.close()